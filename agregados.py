@@ -0,0 +1,295 @@
+import argparse
+import logging
+import sqlite3
+import time
+
+import particiones
+from esquema import podado_hasta
+
+# Niveles de agregación: nombre -> duración del intervalo en milisegundos
+NIVELES = {
+    "1m": 60 * 1000,
+    "1h": 60 * 60 * 1000,
+    "1d": 24 * 60 * 60 * 1000,
+}
+
+# Canales que se agregan en cada intervalo
+CANALES_AGREGADOS = ("temperatura", "humedad")
+
+# ts es el timestamp del último valor (last) de cada canal
+_ESTADISTICOS = ("n", "min", "max", "sum", "last", "ts")
+
+# Valor de la columna dispositivo para las filas sin dispositivo (NULL en
+# sensores); los ids de la tabla dispositivos empiezan en 1
+SIN_DISPOSITIVO = 0
+
+# Posición del primer estadístico en las filas de las tablas
+_INICIO = 4
+
+log = logging.getLogger(__name__)
+
+
+def tabla(nivel):
+    return f"sensores_{nivel}"
+
+
+def _columnas():
+    return [f"{canal}_{estadistico}" for canal in CANALES_AGREGADOS for estadistico in _ESTADISTICOS]
+
+
+def crear_tablas(conn):
+    # Una tabla por nivel, con una fila por dispositivo e intervalo; bucket es
+    # el inicio del intervalo en ms y dispositivo el id de la tabla
+    # dispositivos (SIN_DISPOSITIVO para las filas de sensores sin él)
+    definicion = ",\n".join(
+        f"            {columna} {'INTEGER' if columna.endswith(('_n', '_ts')) else 'REAL'}"
+        for columna in _columnas())
+    for nivel in NIVELES:
+        nombre = tabla(nivel)
+        columnas = {fila[1] for fila in conn.execute(f"PRAGMA table_info({nombre})")}
+        antigua = bool(columnas) and "dispositivo" not in columnas
+        if antigua:
+            conn.execute("BEGIN")
+            conn.execute(f"ALTER TABLE {nombre} RENAME TO {nombre}_antigua")
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {nombre} (
+                dispositivo INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                n INTEGER NOT NULL,
+                ts_last INTEGER NOT NULL,
+{definicion},
+                PRIMARY KEY (dispositivo, bucket)
+            )
+        ''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{nombre}_bucket ON {nombre}(bucket)")
+        if antigua:
+            # Agregados de antes de separarlos por dispositivo: se conservan
+            # (pueden ser lo único que queda de días ya podados) sin dispositivo
+            copiar = ", ".join(["bucket", "n", "ts_last"] + _columnas())
+            conn.execute(f"INSERT INTO {nombre} (dispositivo, {copiar}) "
+                         f"SELECT {SIN_DISPOSITIVO}, {copiar} FROM {nombre}_antigua")
+            conn.execute(f"DROP TABLE {nombre}_antigua")
+            conn.execute("COMMIT")
+            log.warning("Agregados de %s conservados sin dispositivo; python agregados.py los recalcula "
+                        "por dispositivo a partir de las filas que aún existen", nombre)
+
+
+def _sql_upsert(nivel):
+    columnas = ["dispositivo", "bucket", "n", "ts_last"] + _columnas()
+    actualizar = ["n = n + excluded.n"]
+    for canal in CANALES_AGREGADOS:
+        actualizar += [
+            f"{canal}_n = {canal}_n + excluded.{canal}_n",
+            f"{canal}_min = min(coalesce({canal}_min, excluded.{canal}_min), "
+            f"coalesce(excluded.{canal}_min, {canal}_min))",
+            f"{canal}_max = max(coalesce({canal}_max, excluded.{canal}_max), "
+            f"coalesce(excluded.{canal}_max, {canal}_max))",
+            f"{canal}_sum = coalesce({canal}_sum + excluded.{canal}_sum, {canal}_sum, excluded.{canal}_sum)",
+            f"{canal}_last = CASE WHEN {canal}_ts IS NULL OR excluded.{canal}_ts >= {canal}_ts "
+            f"THEN coalesce(excluded.{canal}_last, {canal}_last) ELSE {canal}_last END",
+            f"{canal}_ts = max(coalesce({canal}_ts, excluded.{canal}_ts), "
+            f"coalesce(excluded.{canal}_ts, {canal}_ts))",
+        ]
+    # En SQLite todas las expresiones de SET usan los valores anteriores de la fila
+    actualizar.append("ts_last = max(ts_last, excluded.ts_last)")
+    return f'''
+        INSERT INTO {tabla(nivel)} ({", ".join(columnas)})
+        VALUES ({", ".join("?" * len(columnas))})
+        ON CONFLICT(dispositivo, bucket) DO UPDATE SET {", ".join(actualizar)}
+    '''
+
+
+_UPSERT = {nivel: _sql_upsert(nivel) for nivel in NIVELES}
+
+
+def _nuevo_acumulado(dispositivo, bucket, ts):
+    # Un canal sin valores queda como en reconstruir_intervalo: n 0 y el resto NULL
+    return [dispositivo, bucket, 0, ts] + [0, None, None, None, None, None] * len(CANALES_AGREGADOS)
+
+
+def _fusionar(destino, origen):
+    # Suma el acumulado origen a destino (mismo formato que las filas de las
+    # tablas, y del mismo dispositivo)
+    destino[2] += origen[2]
+    destino[3] = max(destino[3], origen[3])
+    for posicion in range(_INICIO, len(destino), len(_ESTADISTICOS)):
+        if not origen[posicion]:
+            continue
+        n, minimo, maximo, suma, ultimo, ts = origen[posicion:posicion + len(_ESTADISTICOS)]
+        if destino[posicion]:
+            minimo = min(minimo, destino[posicion + 1])
+            maximo = max(maximo, destino[posicion + 2])
+            suma += destino[posicion + 3]
+            if ts < destino[posicion + 5]:
+                ultimo, ts = destino[posicion + 4], destino[posicion + 5]
+        destino[posicion:posicion + len(_ESTADISTICOS)] = [
+            destino[posicion] + n, minimo, maximo, suma, ultimo, ts]
+
+
+def actualizar(conn, lecturas):
+    # Suma un lote de Lecturas a los agregados. Se llama dentro de la misma
+    # transacción que inserta las filas en sensores, así ambos quedan consistentes;
+    # dispositivo es el id ya asignado (ver dispositivos.RegistroDispositivos).
+    # Las lecturas se recorren una sola vez para el nivel más fino; los demás
+    # niveles se obtienen fusionando esos acumulados.
+    niveles = list(NIVELES.items())
+    nivel, duracion = niveles[0]
+    intervalos = {}
+    for lectura in lecturas:
+        ts = lectura.timestamp
+        dispositivo = lectura.dispositivo or SIN_DISPOSITIVO
+        clave = (dispositivo, ts - ts % duracion)
+        acumulado = intervalos.get(clave)
+        if acumulado is None:
+            acumulado = intervalos[clave] = _nuevo_acumulado(dispositivo, clave[1], ts)
+        acumulado[2] += 1
+        if ts > acumulado[3]:
+            acumulado[3] = ts
+        posicion = _INICIO
+        for canal in CANALES_AGREGADOS:
+            valor = getattr(lectura, canal)
+            if valor is not None:
+                if acumulado[posicion]:
+                    if valor < acumulado[posicion + 1]:
+                        acumulado[posicion + 1] = valor
+                    if valor > acumulado[posicion + 2]:
+                        acumulado[posicion + 2] = valor
+                    if ts >= acumulado[posicion + 5]:
+                        acumulado[posicion + 4] = valor
+                        acumulado[posicion + 5] = ts
+                    acumulado[posicion + 3] += valor
+                else:
+                    acumulado[posicion + 1] = acumulado[posicion + 2] = acumulado[posicion + 3] = valor
+                    acumulado[posicion + 4] = valor
+                    acumulado[posicion + 5] = ts
+                acumulado[posicion] += 1
+            posicion += len(_ESTADISTICOS)
+    conn.executemany(_UPSERT[nivel], intervalos.values())
+
+    for nivel, duracion in niveles[1:]:
+        gruesos = {}
+        for acumulado in intervalos.values():
+            clave = (acumulado[0], acumulado[1] - acumulado[1] % duracion)
+            grueso = gruesos.get(clave)
+            if grueso is None:
+                grueso = gruesos[clave] = _nuevo_acumulado(*clave, acumulado[3])
+            _fusionar(grueso, acumulado)
+        conn.executemany(_UPSERT[nivel], gruesos.values())
+        intervalos = gruesos
+
+
+def reconstruir(conn, desde=None, hasta=None, bloque=NIVELES["1d"], detener=None):
+    # Recalcula los agregados a partir de las filas de sensores (p. ej. para
+    # una base de datos existente). Se procesa por bloques de un día, cada uno
+    # en su propia transacción, para no bloquear al escritor mucho tiempo; los
+    # días sin filas ni agregados se saltan. Los días cuyas filas ya borró
+    # retencion.py no se tocan: sus agregados son lo único que queda de ellos.
+    # Si se activa el evento detener, para entre dos días y devuelve el inicio
+    # (ms) del primero sin recalcular; si termina, None.
+    crear_tablas(conn)
+    if desde is None or hasta is None:
+        minimo, maximo = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM sensores").fetchone()
+        rango = particiones.rango(conn)
+        if rango is not None:
+            minimo = rango[0] if minimo is None else min(minimo, rango[0])
+            maximo = rango[1] if maximo is None else max(maximo, rango[1])
+        if minimo is None:
+            return None
+        desde = minimo if desde is None else desde
+        hasta = maximo + 1 if hasta is None else hasta
+    desde -= desde % bloque
+    podado = podado_hasta(conn)
+    if podado is not None and desde < podado:
+        desde = podado
+    total = max(0, -(-(hasta - desde) // bloque))
+
+    grueso = tabla(list(NIVELES)[-1])
+    for i, inicio in enumerate(range(desde, hasta, bloque), 1):
+        if detener is not None and detener.is_set():
+            return inicio
+        with particiones.adjuntar(conn, inicio, inicio + bloque) as sensores:
+            vacio = (conn.execute(f"SELECT 1 FROM {sensores} WHERE timestamp >= ? AND timestamp < ? LIMIT 1",
+                                  (inicio, inicio + bloque)).fetchone() is None
+                     and conn.execute(f"SELECT 1 FROM {grueso} WHERE bucket >= ? AND bucket < ? LIMIT 1",
+                                      (inicio, inicio + bloque)).fetchone() is None)
+            if vacio:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            reconstruir_intervalo(conn, inicio, inicio + bloque, sensores)
+            conn.execute("COMMIT")
+        log.info("Agregados reconstruidos: %d/%d días", i, total)
+    return None
+
+
+def reconstruir_intervalo(conn, inicio, fin, sensores="sensores"):
+    # Recalcula todos los niveles en [inicio, fin), alineado a días, dentro
+    # de la transacción en curso; sensores es la tabla (o la unión de
+    # particiones, ver particiones.adjuntar) de la que se leen las filas
+    for nivel, duracion in NIVELES.items():
+        columnas = ["dispositivo", "bucket", "n", "ts_last"]
+        seleccion = []
+        for canal in CANALES_AGREGADOS:
+            columnas += [f"{canal}_n", f"{canal}_min", f"{canal}_max", f"{canal}_sum"]
+            seleccion += [f"COUNT({canal})", f"MIN({canal})", f"MAX({canal})", f"SUM({canal})"]
+        conn.execute(f"DELETE FROM {tabla(nivel)} WHERE bucket >= ? AND bucket < ?", (inicio, fin))
+        conn.execute(f'''
+            INSERT INTO {tabla(nivel)} ({", ".join(columnas)})
+            SELECT coalesce(dispositivo, {SIN_DISPOSITIVO}) AS d, timestamp - timestamp % {duracion} AS b,
+                   COUNT(*), MAX(timestamp), {", ".join(seleccion)}
+            FROM {sensores}
+            WHERE timestamp >= ? AND timestamp < ?
+            GROUP BY d, b
+        ''', (inicio, fin))
+        # Último valor no nulo de cada canal (búsqueda por el índice de
+        # dispositivo y timestamp)
+        for canal in CANALES_AGREGADOS:
+            conn.execute(f'''
+                UPDATE {tabla(nivel)} SET ({canal}_last, {canal}_ts) = (
+                    SELECT {canal}, timestamp FROM {sensores}
+                    WHERE dispositivo IS nullif({tabla(nivel)}.dispositivo, {SIN_DISPOSITIVO})
+                      AND timestamp >= bucket AND timestamp < bucket + {duracion}
+                      AND {canal} IS NOT NULL
+                    ORDER BY timestamp DESC LIMIT 1)
+                WHERE bucket >= ? AND bucket < ?
+            ''', (inicio, fin))
+
+
+def consultar(conn, nivel, desde, hasta, canal="temperatura", dispositivo=None):
+    # Devuelve (bucket, n, min, max, media, último) del canal en el intervalo
+    # para un dispositivo (id, o SIN_DISPOSITIVO) o, con None, para todos juntos
+    if dispositivo is not None:
+        return conn.execute(f'''
+            SELECT bucket, {canal}_n, {canal}_min, {canal}_max,
+                   {canal}_sum / NULLIF({canal}_n, 0), {canal}_last
+            FROM {tabla(nivel)}
+            WHERE dispositivo = ? AND bucket >= ? AND bucket < ?
+            ORDER BY bucket
+        ''', (dispositivo, desde, hasta)).fetchall()
+    # El último valor es el de la fila con mayor {canal}_ts (columna suelta de
+    # un agregado MAX en SQLite)
+    return [fila[:-1] for fila in conn.execute(f'''
+        SELECT bucket, SUM({canal}_n), MIN({canal}_min), MAX({canal}_max),
+               SUM({canal}_sum) / NULLIF(SUM({canal}_n), 0), {canal}_last, MAX({canal}_ts)
+        FROM {tabla(nivel)}
+        WHERE bucket >= ? AND bucket < ?
+        GROUP BY bucket
+        ORDER BY bucket
+    ''', (desde, hasta))]
+
+
+# Reconstruye los agregados de una base de datos existente:
+#   python agregados.py datos_sensores.db [--desde MS] [--hasta MS]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruye las tablas de agregados de sensores")
+    parser.add_argument("db", nargs="?", default="datos_sensores.db")
+    parser.add_argument("--desde", type=int, help="Inicio en ms desde epoch")
+    parser.add_argument("--hasta", type=int, help="Fin en ms desde epoch")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    conn = sqlite3.connect(args.db, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000")
+    t0 = time.monotonic()
+    reconstruir(conn, args.desde, args.hasta)
+    conn.close()
+    print(f"Listo en {time.monotonic() - t0:.1f} s")
@@ -1,40 +1,29 @@
 import socket
-import sqlite3
-from datetime import datetime
 from PyQt5.QtWidgets import QApplication, QMainWindow
 from PyQt5.QtCore import QTimer, QThread, pyqtSignal
 import sys
 from PyQt5.uic import loadUi
 from pyqtgraph import PlotWidget
+from escritor_db import EscritorDB
+from parseo import parsear, temperatura_humedad
+from estadisticas import VentanaDeslizante
 
 ESP32_HOST = "0.0.0.0"  # Cambia esto por la IP del ESP32
 ESP32_PORT = 1234        # Puerto usado por el ESP32
 db_filename = "datos_sensores.db"
+VENTANA_ESTADISTICAS = 60  # Muestras usadas para Max/Min/Prom (None: sin límite de muestras)
+SEGUNDOS_ESTADISTICAS = None  # Antigüedad máxima de las muestras en segundos (None: sin límite)
+
+# Escritor de la base de datos (conexión persistente con escrituras por lotes)
+escritor = EscritorDB(db_filename)
 
 # Función para inicializar la base de datos
 def inicializar_db():
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sensores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            datos TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    escritor.iniciar()
 
 # Función para guardar los datos en la base de datos
 def guardar_datos(datos):
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO sensores (timestamp, datos) 
-        VALUES (?, ?)
-    ''', (datetime.now().isoformat(), datos))
-    conn.commit()
-    conn.close()
+    escritor.guardar(parsear(datos))
 
 class ServerThread(QThread):
     new_data_signal = pyqtSignal(str)
@@ -108,6 +97,11 @@ class MainWindow(QMainWindow):
         self.temp_data = []
         self.hum_data = []
 
+        # Estadísticas calculadas en el equipo sobre una ventana deslizante;
+        # se mantienen aunque el ESP32 se reconecte
+        self.temp_stats = VentanaDeslizante(VENTANA_ESTADISTICAS, SEGUNDOS_ESTADISTICAS)
+        self.hum_stats = VentanaDeslizante(VENTANA_ESTADISTICAS, SEGUNDOS_ESTADISTICAS)
+
         # Configurar el temporizador para actualizar los datos
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_graph)
@@ -147,14 +141,14 @@ class MainWindow(QMainWindow):
     def update_graph_and_data(self, data):
         # Parsear los datos recibidos
         try:
-            data_dict = {}
-            for pair in data.split(","):
-                key, value = pair.split(":")
-                data_dict[key.strip()] = float(value.strip().replace("°C", "").replace("%", ""))
+            # Valor instantáneo (las placas antiguas solo envían el promedio); ver parseo.py
+            temp, hum = temperatura_humedad(data)
+            self.temp_stats.agregar(temp)
+            self.hum_stats.agregar(hum)
 
             # Actualizar gráficas
-            self.temp_data.append(data_dict["T_Avg"])
-            self.hum_data.append(data_dict["H_Avg"])
+            self.temp_data.append(self.temp_stats.media)
+            self.hum_data.append(self.hum_stats.media)
 
             if len(self.temp_data) > 100:
                 self.temp_data.pop(0)
@@ -163,15 +157,12 @@ class MainWindow(QMainWindow):
             self.update_graph()
 
             # Mostrar valores en los labels
-            self.label_1.setText(f"T° Max: {data_dict['T_Max']:.2f} °C")
-            self.label_2.setText(f"T° Min: {data_dict['T_Min']:.2f} °C")
-            self.label_3.setText(f"T° Prom: {data_dict['T_Avg']:.2f} °C")
-            self.label_4.setText(f"Hum Max: {data_dict['H_Max']:.2f} %")
-            self.label_5.setText(f"Hum Min: {data_dict['H_Min']:.2f} %")
-            self.label_6.setText(f"Hum Prom: {data_dict['H_Avg']:.2f} %")
-
-            # Guardar datos en la base de datos
-            guardar_datos(data)
+            self.label_1.setText(f"T° Max: {self.temp_stats.maximo:.2f} °C")
+            self.label_2.setText(f"T° Min: {self.temp_stats.minimo:.2f} °C")
+            self.label_3.setText(f"T° Prom: {self.temp_stats.media:.2f} °C")
+            self.label_4.setText(f"Hum Max: {self.hum_stats.maximo:.2f} %")
+            self.label_5.setText(f"Hum Min: {self.hum_stats.minimo:.2f} %")
+            self.label_6.setText(f"Hum Prom: {self.hum_stats.media:.2f} %")
         except Exception as e:
             print(f"Error al parsear los datos procesados: {e}")
 
@@ -198,4 +189,6 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
-    sys.exit(app.exec_())
+    codigo = app.exec_()
+    escritor.detener()  # Escribe las filas pendientes antes de salir
+    sys.exit(codigo)
@@ -0,0 +1,220 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+
+import registro
+import simulador
+from escritor_db import EscritorDB
+
+BENCHMARK_PORT = 5234
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+class Medidor:
+    # Recoge las latencias de los mensajes marcados por el simulador
+    # (la temperatura lleva la hora de envío, ver simulador.reloj_marca)
+    def __init__(self):
+        self.commit = []   # Envío -> COMMIT en la base de datos (s)
+        self.grafica = []  # Envío -> dibujado en la gráfica (s)
+        self.filas = 0
+
+    def al_escribir(self, lote):
+        # Hilo escritor, justo después del COMMIT
+        for lectura in lote:
+            if lectura.temperatura is not None:
+                self.commit.append(simulador.latencia_marca(lectura.temperatura))
+        self.filas += len(lote)
+
+    def al_dibujar(self, temperatura):
+        # Hilo de la interfaz, después de dibujar el cuadro
+        self.grafica.append(simulador.latencia_marca(temperatura))
+
+
+def percentiles(valores):
+    if not valores:
+        return None
+    ms = np.asarray(valores) * 1000
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {"p50_ms": p50, "p90_ms": p90, "p99_ms": p99, "max_ms": ms.max(), "muestras": len(ms)}
+
+
+def rss_mb():
+    # Memoria residente actual del proceso (Linux)
+    try:
+        with open("/proc/self/status") as f:
+            for linea in f:
+                if linea.startswith("VmRSS:"):
+                    return int(linea.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def cpu_s():
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    return uso.ru_utime + uso.ru_stime
+
+
+def lanzar_simulador(args):
+    return subprocess.Popen(
+        [sys.executable, os.path.join(DIRECTORIO, "simulador.py"),
+         "--host", "127.0.0.1", "--puerto", str(args.puerto),
+         "--clientes", str(args.clientes), "--tasa", str(args.tasa),
+         "--formato", args.formato, "--duracion", str(args.duracion),
+         "--marcar-tiempo", "--json"],
+        stdout=subprocess.PIPE, text=True)
+
+
+def resultado_simulador(proceso):
+    salida = proceso.communicate()[0].strip().splitlines()
+    return json.loads(salida[-1]) if salida else {}
+
+
+def ejecutar_colector(args, escritor):
+    # Sin interfaz: colector en un hilo y simulador en otro proceso
+    from colector import Colector
+    colector = Colector("127.0.0.1", args.puerto, escritor=escritor)
+    hilo = threading.Thread(target=colector.ejecutar, daemon=True)
+    hilo.start()
+    time.sleep(0.5)
+    simulado = resultado_simulador(lanzar_simulador(args))
+    colector.detener()
+    hilo.join()
+    return simulado
+
+
+def ejecutar_gui(args, escritor, medidor):
+    # Interfaz completa de start.py con la plataforma Qt offscreen
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt5.QtCore import QTimer
+    from PyQt5.QtWidgets import QApplication
+    import start
+
+    start.escritor = escritor
+    start.retencion = None
+    start.db_filename = args.db
+    start.ESP32_PORT = args.puerto
+
+    class VentanaMedida(start.MainWindow):
+        def update_graph(self):
+            super(VentanaMedida, self).update_graph()
+            for serie in self.series.dibujadas:
+                medidor.al_dibujar(serie.buffer.ultimo(0))
+
+    app = QApplication(sys.argv[:1])
+    ventana = VentanaMedida()
+    estado = {}
+
+    def comprobar():
+        proceso = estado.get("proceso")
+        if proceso is None:
+            estado["proceso"] = lanzar_simulador(args)
+        elif proceso.poll() is not None:
+            app.quit()
+
+    temporizador = QTimer()
+    temporizador.timeout.connect(comprobar)
+    temporizador.start(500)
+    app.exec_()
+    ventana.server_thread.stop()
+    ventana.historial.cerrar()
+    return resultado_simulador(estado["proceso"])
+
+
+def informe(args, simulado, medidor, escritor, segundos, cpu, rss_inicio):
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "formato": args.formato,
+        "clientes": args.clientes,
+        "tasa_por_cliente": args.tasa,
+        "gui": args.gui,
+        "segundos": segundos,
+        "enviados": simulado.get("enviados"),
+        "enviados_por_segundo": simulado.get("mensajes_por_segundo"),
+        "guardados": medidor.filas,
+        "guardados_por_segundo": medidor.filas / args.duracion,
+        "latencia_commit": percentiles(medidor.commit),
+        "latencia_grafica": percentiles(medidor.grafica),
+        "escritor": escritor.estadisticas(),
+        "cpu_servidor_pct": 100 * cpu / segundos if segundos else 0.0,
+        "cpu_simulador_s": simulado.get("cpu_s"),
+        "rss_mb": rss_mb(),
+        "rss_inicio_mb": rss_inicio,
+        "rss_pico_mb": uso.ru_maxrss / 1024,
+    }
+
+
+def imprimir(datos):
+    print(f"Formato {datos['formato']}, {datos['clientes']} clientes x {datos['tasa_por_cliente']:g} msg/s, "
+          f"{'interfaz offscreen' if datos['gui'] else 'colector sin interfaz'}")
+    print(f"  Enviados:  {datos['enviados']} ({datos['enviados_por_segundo'] or 0:.0f} msg/s)")
+    print(f"  Guardados: {datos['guardados']} ({datos['guardados_por_segundo']:.0f} filas/s)")
+    for nombre, clave in (("envío -> COMMIT", "latencia_commit"), ("envío -> gráfica", "latencia_grafica")):
+        p = datos[clave]
+        if p is None:
+            print(f"  Latencia {nombre}: sin muestras")
+        else:
+            print(f"  Latencia {nombre}: p50 {p['p50_ms']:.1f} ms, p90 {p['p90_ms']:.1f} ms, "
+                  f"p99 {p['p99_ms']:.1f} ms, máx {p['max_ms']:.1f} ms ({p['muestras']} muestras)")
+    print(f"  CPU servidor: {datos['cpu_servidor_pct']:.0f} %, simulador: {datos['cpu_simulador_s'] or 0:.1f} s")
+    print(f"  RSS servidor: {datos['rss_mb'] or 0:.0f} MB (inicio {datos['rss_inicio_mb'] or 0:.0f} MB, "
+          f"pico {datos['rss_pico_mb']:.0f} MB)")
+
+
+# Mide cuántos mensajes por segundo soporta la ingesta (y la interfaz con --gui):
+#   python benchmark.py --clientes 8 --tasa 200 --formato etiquetas --duracion 20 [--gui]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark de ingesta con ESP32 simulados")
+    parser.add_argument("--clientes", type=int, default=4)
+    parser.add_argument("--tasa", type=float, default=100.0, help="Mensajes por segundo por cliente")
+    parser.add_argument("--formato", choices=simulador.FORMATOS + ("mixto",), default="etiquetas")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos")
+    parser.add_argument("--puerto", type=int, default=BENCHMARK_PORT)
+    parser.add_argument("--db", help="Base de datos (por defecto una temporal que se borra al terminar)")
+    parser.add_argument("--gui", action="store_true", help="Incluye la interfaz de start.py (Qt offscreen)")
+    parser.add_argument("--json", action="store_true", help="Imprime el resultado como JSON")
+    parser.add_argument("--log", default="WARNING", help="Nivel de registro durante la prueba")
+    parser.add_argument("--verbose", action="store_true", help="No oculta la salida de cada mensaje")
+    args = parser.parse_args()
+    registro.configurar(args.log)
+
+    temporal = None
+    if args.db is None:
+        temporal = tempfile.mkdtemp(prefix="benchmark_")
+        args.db = os.path.join(temporal, "benchmark.db")
+    args.db = os.path.abspath(args.db)
+    os.chdir(DIRECTORIO)  # interfaz.ui se carga por ruta relativa
+
+    medidor = Medidor()
+    escritor = EscritorDB(args.db, al_escribir=medidor.al_escribir)
+    rss_inicio = rss_mb()
+    cpu_inicio = cpu_s()
+    t0 = time.monotonic()
+    try:
+        with open(os.devnull, "w") as nulo, redirect_stdout(sys.stdout if args.verbose else nulo):
+            if args.gui:
+                simulado = ejecutar_gui(args, escritor, medidor)
+            else:
+                escritor.iniciar()
+                simulado = ejecutar_colector(args, escritor)
+            escritor.detener()  # Escribe lo pendiente antes de medir
+        datos = informe(args, simulado, medidor, escritor, time.monotonic() - t0,
+                        cpu_s() - cpu_inicio, rss_inicio)
+    finally:
+        if temporal is not None:
+            shutil.rmtree(temporal, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(datos, default=float))
+    else:
+        imprimir(datos)
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class BufferCircular:
+    # Buffer circular de capacidad fija para las series de la gráfica.
+    # Cada muestra se escribe dos veces (posición i e i + capacidad), así la
+    # ventana más reciente es siempre un tramo contiguo del array y vista()
+    # la devuelve sin copiar ni reservar memoria.
+    def __init__(self, capacidad, canales=1, dtype=np.float64):
+        if capacidad < 1:
+            raise ValueError("La capacidad debe ser al menos 1")
+        self.capacidad = capacidad
+        self.canales = canales
+        self._datos = np.zeros((canales, 2 * capacidad), dtype=dtype)
+        self._pos = 0       # Siguiente posición a escribir (0 <= pos < capacidad)
+        self.tamano = 0     # Número de muestras válidas
+        self.total = 0      # Muestras agregadas desde el inicio
+
+    def __len__(self):
+        return self.tamano
+
+    def extender(self, bloque):
+        # Agrega varias muestras de una vez; bloque tiene forma (canales, n)
+        bloque = np.asarray(bloque, dtype=self._datos.dtype).reshape(self.canales, -1)
+        n = bloque.shape[1]
+        self.total += n
+        cap = self.capacidad
+        if n > cap:
+            bloque = bloque[:, -cap:]
+            n = cap
+
+        p = self._pos
+        primero = min(n, cap - p)
+        resto = n - primero
+        datos = self._datos
+        datos[:, p:p + primero] = bloque[:, :primero]
+        datos[:, cap + p:cap + p + primero] = bloque[:, :primero]
+        if resto:
+            datos[:, :resto] = bloque[:, primero:]
+            datos[:, cap:cap + resto] = bloque[:, primero:]
+
+        self._pos = (p + n) % cap
+        self.tamano = min(self.tamano + n, cap)
+
+    def vista(self, canal=0):
+        # Ventana de las últimas muestras del canal, de la más antigua a la
+        # más reciente; es una vista de solo lectura válida hasta la próxima escritura
+        fin = self._pos + self.capacidad
+        vista = self._datos[canal, fin - self.tamano:fin]
+        vista.flags.writeable = False
+        return vista
+
+    def ultimo(self, canal=0):
+        if not self.tamano:
+            return None
+        return self._datos[canal, self._pos + self.capacidad - 1]
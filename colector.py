@@ -0,0 +1,293 @@
+import argparse
+import asyncio
+import logging
+import signal
+import socket
+import threading
+import time
+
+import metricas
+import registro
+from escritor_db import EscritorDB
+from parseo import Parser
+from retencion import Retencion
+from servidor import ServidorIngesta
+from spool import SpoolLleno
+from tramas import DecodificadorTramas
+
+ESP32_HOST = "0.0.0.0"  # Cambia esto por la IP del ESP32
+ESP32_PORT = 1234        # Puerto usado por el ESP32
+VISOR_PORT = 1235        # Puerto para las interfaces que se conectan al colector
+# Dirección en la que escucha el puerto de los visores. Por defecto solo la
+# propia máquina: el flujo de datos se envía sin autenticación ni cifrado, así
+# que con otra dirección (p. ej. "0.0.0.0") cualquiera que llegue al puerto
+# puede leerlo. Solo en una red de confianza o detrás de un túnel/cortafuegos.
+VISOR_HOST = "127.0.0.1"
+MAX_CONEXIONES = 64      # Número máximo de ESP32 conectados a la vez
+db_filename = "datos_sensores.db"
+
+# Bytes pendientes de envío a partir de los cuales se descartan mensajes para
+# un visor lento, en lugar de frenar la recepción de datos
+MAX_PENDIENTE_VISOR = 1024 * 1024
+
+# Cada línea que reciben los visores es "<dispositivo>\t<mensaje de texto>"
+SEPARADOR_VISOR = "\t"
+
+# Con el spool del escritor lleno se deja de leer del ESP32 afectado y se
+# vuelve a intentar guardar lo retenido cada REINTENTO_SPOOL segundos
+REINTENTO_SPOOL = 0.2
+
+log = logging.getLogger(__name__)
+
+_PARSEAR = metricas.histograma("ingesta_parsear_segundos", "Parseo de cada mensaje de texto")
+_ERRORES_PARSEO = metricas.contador("ingesta_parseo_errores_total", "Mensajes que no se pudieron interpretar")
+
+
+class _ProtocoloVisor(asyncio.Protocol):
+    def __init__(self, colector):
+        self.colector = colector
+
+    def connection_made(self, transporte):
+        self.transporte = transporte
+        self.colector._visores.add(transporte)
+        log.info("Visor conectado %s", transporte.get_extra_info("peername"))
+
+    def data_received(self, data):
+        pass
+
+    def connection_lost(self, exc):
+        self.colector._visores.discard(self.transporte)
+
+
+class Colector:
+    # Recepción, parseo y almacenamiento de los datos de los ESP32 sin
+    # depender de PyQt5. La interfaz gráfica es opcional: puede ejecutarlo en
+    # su propio proceso (suscribir) o conectarse como visor al puerto_visor de
+    # un colector independiente (python colector.py).
+    def __init__(self, host=ESP32_HOST, port=ESP32_PORT, db=db_filename, escritor=None,
+                 max_conexiones=MAX_CONEXIONES, host_visor=VISOR_HOST, puerto_visor=None,
+                 al_conectar=None, al_desconectar=None, particiones=None):
+        # Si se pasa un escritor ya iniciado, su ciclo de vida es del llamador
+        self._escritor_propio = escritor is None
+        self.escritor = EscritorDB(db, particiones=particiones) if escritor is None else escritor
+        self.al_conectar = al_conectar
+        self.servidor = ServidorIngesta(
+            host, port, self._al_recibir, al_conectar=self._al_conectar,
+            al_desconectar=al_desconectar, max_conexiones=max_conexiones,
+            al_recibir_lecturas=self._al_recibir_lecturas)
+        self.host_visor = host_visor
+        self.puerto_visor = puerto_visor
+        self.suscriptores = []
+        self._visores = set()
+        self.descartados_visor = 0
+
+    def suscribir(self, funcion):
+        # funcion(conexion, lectura) se llama en el hilo del servidor con cada
+        # Lectura ya parseada (sin valores y con datos si no se reconoció el mensaje)
+        self.suscriptores.append(funcion)
+
+    def _al_conectar(self, conexion):
+        # Cada conexión recuerda el formato de mensaje de su ESP32
+        conexion.parser = Parser(conexion.dispositivo)
+        conexion.retenidas = []            # Lecturas pendientes de guardar (spool lleno)
+        conexion.secuencia_retenida = None  # ACK pendiente de las retenidas
+        if self.al_conectar:
+            self.al_conectar(conexion)
+
+    def _al_recibir(self, conexion, mensaje):
+        log.info("Datos recibidos: %s", mensaje)  # Limitado por tipo de mensaje (ver registro.py)
+
+        # Intenta guardar el mensaje recibido en la base de datos
+        lectura = None
+        try:
+            t0 = time.perf_counter() if metricas.activas else None
+            if conexion.parser.dispositivo != conexion.dispositivo:
+                conexion.parser.identificar(conexion.dispositivo)  # Tras "HELLO ID"
+            lectura = conexion.parser.parsear(mensaje)
+            if t0 is not None:
+                _PARSEAR.observar(time.perf_counter() - t0)
+                if lectura.datos is not None:
+                    _ERRORES_PARSEO.sumar()
+            self._guardar(conexion, (lectura,))
+        except Exception as e:
+            log.error("Error al guardar los datos en la base de datos: %s", e)
+
+        if lectura is not None:
+            for funcion in self.suscriptores:
+                funcion(conexion, lectura)
+        self._difundir(conexion.dispositivo, mensaje)
+
+    def _al_recibir_lecturas(self, conexion, lecturas):
+        # Registros del protocolo binario, ya convertidos en Lecturas
+        secuencia = conexion.binario.contigua  # Tras un hueco, lo anterior a él
+        if self._guardar(conexion, lecturas):
+            self._confirmar(conexion, secuencia)
+        else:
+            conexion.secuencia_retenida = secuencia
+
+        for funcion in self.suscriptores:
+            for lectura in lecturas:
+                funcion(conexion, lectura)
+
+        # Los visores reciben el formato de texto "t,h"; los registros sin
+        # alguno de los dos canales no se pueden representar así y no se envían
+        if self._visores:
+            for lectura in lecturas:
+                if lectura.temperatura is not None and lectura.humedad is not None:
+                    self._difundir(conexion.dispositivo, f"{lectura.temperatura},{lectura.humedad}")
+
+    def _guardar(self, conexion, lecturas):
+        # Pasa las Lecturas al escritor en orden. Si no admite más (el spool
+        # en disco está lleno) las que faltan quedan retenidas en la conexión
+        # y se deja de leer de ella hasta poder guardarlas; devuelve False.
+        if not conexion.retenidas:
+            for i, lectura in enumerate(lecturas):
+                try:
+                    self.escritor.guardar(lectura)
+                except SpoolLleno as e:
+                    lecturas = lecturas[i:]
+                    log.warning("%s - pausando la recepción de %s", e, conexion.direccion)
+                    conexion.transporte.pause_reading()
+                    self.servidor.loop.call_later(REINTENTO_SPOOL, self._reintentar, conexion)
+                    break
+            else:
+                return True
+        conexion.retenidas.extend(lecturas)
+        return False
+
+    def _confirmar(self, conexion, secuencia):
+        # El ACK al ESP32 se envía cuando el bloque está guardado en la base de datos
+        try:
+            self.escritor.confirmar(lambda ok: conexion.confirmar(secuencia, ok))
+        except SpoolLleno:
+            conexion.confirmar(secuencia, False)  # El ESP32 reenviará desde su último ACK
+
+    def _reintentar(self, conexion):
+        if conexion.cerrada:
+            log.warning("Se pierden %d lecturas retenidas de %s", len(conexion.retenidas), conexion.direccion)
+            conexion.retenidas = []
+            return
+        retenidas, conexion.retenidas = conexion.retenidas, []
+        if not self._guardar(conexion, retenidas):
+            return  # Sigue en pausa; _guardar ha programado otro intento
+        if conexion.secuencia_retenida is not None:
+            self._confirmar(conexion, conexion.secuencia_retenida)
+            conexion.secuencia_retenida = None
+        conexion.transporte.resume_reading()
+        log.info("Reanudada la recepción de %s", conexion.direccion)
+
+    def _difundir(self, dispositivo, mensaje):
+        # Reenvía el mensaje de texto a las interfaces conectadas como visores
+        if self._visores:
+            linea = f"{dispositivo}{SEPARADOR_VISOR}{mensaje}\n".encode('utf-8')
+            for transporte in list(self._visores):
+                if transporte.get_write_buffer_size() > MAX_PENDIENTE_VISOR:
+                    self.descartados_visor += 1
+                else:
+                    transporte.write(linea)
+
+    async def servir(self):
+        loop = asyncio.get_running_loop()
+        if threading.current_thread() is threading.main_thread():
+            for senal in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(senal, self.detener)
+        visor = None
+        if self.puerto_visor is not None:
+            visor = await loop.create_server(
+                lambda: _ProtocoloVisor(self), self.host_visor, self.puerto_visor, reuse_address=True)
+            log.info("Visores: conectarse a %s:%s", self.host_visor, self.puerto_visor)
+            if self.host_visor not in ("127.0.0.1", "::1", "localhost"):
+                log.warning("El puerto de los visores escucha en %s: los datos se envían sin "
+                            "autenticación a quien se conecte", self.host_visor)
+        try:
+            await self.servidor.servir()
+        finally:
+            if visor is not None:
+                visor.close()
+                for transporte in list(self._visores):
+                    transporte.close()
+
+    def ejecutar(self):
+        # Bloquea el hilo actual hasta que se llame a detener()
+        if self._escritor_propio:
+            self.escritor.iniciar()
+        try:
+            asyncio.run(self.servir())
+        finally:
+            if self._escritor_propio:
+                self.escritor.detener()  # Escribe las filas pendientes antes de salir
+
+    def detener(self):
+        self.servidor.detener()
+
+
+def leer_visor(host, puerto, al_recibir, detener, reintento=2.0):
+    # Cliente para las interfaces: recibe los mensajes que reenvía un colector
+    # y llama a al_recibir(dispositivo, mensaje) por cada uno (dispositivo es
+    # None si el colector no lo envía). Se reconecta si se pierde la conexión
+    # hasta que se active el evento detener.
+    while not detener.is_set():
+        try:
+            with socket.create_connection((host, puerto), timeout=reintento) as s:
+                log.info("Conectado al colector %s", (host, puerto))
+                s.settimeout(0.5)
+                decodificador = DecodificadorTramas()
+                while not detener.is_set():
+                    try:
+                        n = decodificador.recibir_de(s)
+                    except socket.timeout:
+                        continue
+                    if not n:
+                        break
+                    for trama in decodificador.recibidos(n):
+                        texto = str(trama, 'utf-8', 'replace')
+                        dispositivo, separador, mensaje = texto.partition(SEPARADOR_VISOR)
+                        if not separador:  # Colector anterior, sin dispositivo
+                            dispositivo, mensaje = None, texto
+                        al_recibir(dispositivo, mensaje)
+        except OSError as e:
+            log.warning("Sin conexión con el colector: %s", e)
+        detener.wait(reintento)
+
+
+# Colector sin interfaz gráfica:
+#   python colector.py [--puerto 1234] [--db datos_sensores.db] [--puerto-visor 1235]
+#                      [--host-visor 127.0.0.1]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Colector de datos de los ESP32 sin interfaz gráfica")
+    parser.add_argument("--host", default=ESP32_HOST)
+    parser.add_argument("--puerto", type=int, default=ESP32_PORT)
+    parser.add_argument("--db", default=db_filename)
+    parser.add_argument("--max-conexiones", type=int, default=MAX_CONEXIONES)
+    parser.add_argument("--puerto-visor", type=int, default=VISOR_PORT,
+                        help="Puerto para las interfaces (0 lo desactiva)")
+    parser.add_argument("--host-visor", default=VISOR_HOST,
+                        help="Dirección del puerto de las interfaces; fuera de la propia máquina el "
+                             "flujo de datos queda expuesto sin autenticación (ver VISOR_HOST)")
+    parser.add_argument("--log", default="INFO", help="Nivel de registro (DEBUG, INFO, WARNING...)")
+    parser.add_argument("--log-archivo", help="Escribe también el registro en este archivo")
+    parser.add_argument("--metricas", metavar="PUERTO|RUTA",
+                        help="Publica las métricas de Prometheus en un puerto local o socket Unix")
+    parser.add_argument("--particiones", choices=("dia", "mes"),
+                        help="Guarda las filas en un archivo por día o por mes (ver particiones.py)")
+    parser.add_argument("--retencion", action="store_true",
+                        help="Borra periódicamente los datos antiguos según retencion.POLITICA")
+    args = parser.parse_args()
+
+    registro.configurar(args.log, archivo=args.log_archivo)
+    if args.metricas:
+        metricas.publicar(args.metricas)
+
+    colector = Colector(args.host, args.puerto, args.db, max_conexiones=args.max_conexiones,
+                        host_visor=args.host_visor, puerto_visor=args.puerto_visor or None,
+                        particiones=args.particiones)
+    retencion = Retencion(args.db) if args.retencion else None
+    if retencion is not None:
+        retencion.iniciar()
+    t0 = time.monotonic()
+    try:
+        colector.ejecutar()
+    finally:
+        if retencion is not None:
+            retencion.detener()
+    print(f"Colector detenido tras {time.monotonic() - t0:.0f} s:", colector.escritor.estadisticas())
@@ -0,0 +1,150 @@
+import asyncio
+import itertools
+import logging
+import time
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+# Canal de comandos hacia los ESP32, propiedad del servidor de ingesta
+# (servidor.py). Todo se escribe desde su bucle asyncio, así que enviar() se
+# puede llamar desde cualquier hilo (p. ej. el de la interfaz) sin bloquearlo
+# aunque un ESP32 no lea lo que se le envía. Un comando va a un dispositivo,
+# a un grupo o a todos a la vez.
+#
+# Sin esperar respuesta se envía el texto tal cual, como siempre ("START",
+# "STOP", ...). Esperando respuesta se envía
+#     CMD <id> <comando>\n
+# y el ESP32 contesta en su conexión de texto con
+#     RESP <id> <texto>\n
+# (p. ej. "RESP 17 OK"). Los ESP32 en protocolo binario no pueden responder
+# entre sus registros, así que a esos solo se les envían comandos sin espera.
+
+RESPUESTA = b"RESP "
+
+_ENVIADOS = metricas.contador("comandos_enviados_total", "Comandos enviados a los ESP32")
+_FALLIDOS = metricas.contador("comandos_fallidos_total", "Comandos sin enviar o sin respuesta a tiempo")
+_LATENCIA = metricas.histograma("comandos_latencia_segundos",
+                                "Desde que se pide un comando hasta su respuesta o, sin espera, hasta que se escribe")
+
+
+def es_respuesta(trama):
+    return bytes(trama[:len(RESPUESTA)]) == RESPUESTA
+
+
+class DespachadorComandos:
+    def __init__(self, servidor, timeout=5.0):
+        self.servidor = servidor
+        self.timeout = timeout
+        self._ids = itertools.count(1)
+        self._esperando = {}  # id -> (conexion, asyncio.Future)
+
+        # Contadores
+        self.enviados = 0
+        self.respondidos = 0
+        self.fallidos = 0
+
+    def enviar(self, comando, destinos=None, esperar=False, timeout=None):
+        # destinos: nombre de un dispositivo, lista de nombres o None (todos
+        # los conectados). Devuelve un concurrent.futures.Future con
+        # {dispositivo: resultado}; resultado es la respuesta (esperar=True),
+        # None (enviado sin esperar) o la excepción de ese dispositivo
+        # (TimeoutError, ConnectionError...). timeout en segundos por comando.
+        loop = self.servidor.loop
+        if loop is None or loop.is_closed():
+            raise ConnectionError("El servidor de ingesta no está en marcha")
+        return asyncio.run_coroutine_threadsafe(
+            self.ejecutar(comando, destinos, esperar, timeout, time.perf_counter()), loop)
+
+    async def ejecutar(self, comando, destinos=None, esperar=False, timeout=None, inicio=None):
+        # Lo mismo que enviar(), desde el bucle del servidor. inicio es el
+        # time.perf_counter() de la petición, para la métrica de latencia
+        timeout = self.timeout if timeout is None else timeout
+        inicio = time.perf_counter() if inicio is None else inicio
+        objetivos = self._objetivos(destinos)
+        resultados = await asyncio.gather(
+            *(self._enviar_a(nombre, conexion, comando, esperar, timeout, inicio) for nombre, conexion in objetivos),
+            return_exceptions=True)
+        return {nombre: resultado for (nombre, _), resultado in zip(objetivos, resultados)}
+
+    def _objetivos(self, destinos):
+        conexiones = [conexion for conexion in self.servidor.conexiones if not conexion.cerrada]
+        if destinos is None:
+            return [(conexion.dispositivo, conexion) for conexion in conexiones]
+        if isinstance(destinos, str):
+            destinos = [destinos]
+        por_nombre = {conexion.dispositivo: conexion for conexion in conexiones}
+        return [(nombre, por_nombre.get(nombre)) for nombre in destinos]
+
+    async def _enviar_a(self, nombre, conexion, comando, esperar, timeout, inicio):
+        # Tanto si se espera respuesta como si no, cualquier fallo (también al
+        # escribir, ver Conexion.escribir) cuenta en fallidos
+        try:
+            if conexion is None:
+                raise ConnectionError(f"{nombre} no está conectado")
+            if not esperar:
+                conexion.escribir(comando.encode('utf-8'))
+                self._contar_envio()
+                respuesta = None
+            elif conexion.binario is not None:
+                raise ConnectionError(f"{nombre} usa el protocolo binario y no puede responder")
+            else:
+                respuesta = await self._esperar_respuesta(conexion, comando, timeout)
+            if metricas.activas:
+                _LATENCIA.observar(time.perf_counter() - inicio)
+            return respuesta
+        except Exception:
+            self.fallidos += 1
+            if metricas.activas:
+                _FALLIDOS.sumar()
+            raise
+
+    async def _esperar_respuesta(self, conexion, comando, timeout):
+        id_ = next(self._ids)
+        futuro = self.servidor.loop.create_future()
+        self._esperando[id_] = (conexion, futuro)
+        try:
+            conexion.escribir(f"CMD {id_} {comando}\n".encode('utf-8'))
+            self._contar_envio()
+            respuesta = await asyncio.wait_for(futuro, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{conexion.dispositivo} no respondió a {comando!r} en {timeout} s") from None
+        finally:
+            del self._esperando[id_]
+        self.respondidos += 1
+        return respuesta
+
+    def _contar_envio(self):
+        self.enviados += 1
+        if metricas.activas:
+            _ENVIADOS.sumar()
+
+    def respuesta(self, conexion, trama):
+        # "RESP <id> <texto>" recibido de un ESP32 (desde el bucle del servidor)
+        partes = str(trama, 'utf-8', 'replace').split(None, 2)
+        try:
+            id_ = int(partes[1])
+        except (IndexError, ValueError):
+            log.warning("Respuesta no válida de %s: %r", conexion.dispositivo, bytes(trama))
+            return
+        esperando = self._esperando.get(id_)
+        if esperando is None or esperando[0] is not conexion:
+            log.info("Respuesta %s de %s sin comando pendiente", id_, conexion.dispositivo)
+            return
+        if not esperando[1].done():
+            esperando[1].set_result(partes[2].strip() if len(partes) > 2 else "")
+
+    def desconectado(self, conexion):
+        # Los comandos pendientes de esa conexión ya no tendrán respuesta
+        for otra, futuro in self._esperando.values():
+            if otra is conexion and not futuro.done():
+                futuro.set_exception(ConnectionError(f"{conexion.dispositivo} se ha desconectado"))
+
+    def estadisticas(self):
+        return {
+            "enviados": self.enviados,
+            "respondidos": self.respondidos,
+            "fallidos": self.fallidos,
+            "pendientes": len(self._esperando),
+        }
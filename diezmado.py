@@ -0,0 +1,120 @@
+import numpy as np
+
+
+def minmax(x, y, puntos):
+    # Envolvente mínimo/máximo: divide la serie en puntos // 2 grupos y conserva
+    # el mínimo y el máximo de cada uno, en orden temporal
+    n = len(y)
+    grupos = max(1, puntos // 2)
+    if n <= puntos:
+        return x, y
+    k = -(-n // grupos)
+    completos = n // k
+    bloques = y[:completos * k].reshape(completos, k)
+    base = np.arange(completos) * k
+    imin = base + bloques.argmin(axis=1)
+    imax = base + bloques.argmax(axis=1)
+    indices = np.column_stack((np.minimum(imin, imax), np.maximum(imin, imax))).ravel()
+    if completos * k < n:
+        resto = y[completos * k:]
+        extra = completos * k + np.array(sorted((resto.argmin(), resto.argmax())))
+        indices = np.concatenate((indices, extra))
+    return x[indices], y[indices]
+
+
+def lttb(x, y, puntos):
+    # Largest-Triangle-Three-Buckets: elige en cada grupo el punto que forma el
+    # triángulo de mayor área con el punto anterior y la media del grupo siguiente
+    n = len(y)
+    if puntos >= n or puntos < 3:
+        return x, y
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    limites = np.linspace(1, n - 1, puntos - 1).astype(np.int64)
+    indices = np.empty(puntos, dtype=np.int64)
+    indices[0] = 0
+    indices[-1] = n - 1
+    a = 0
+    for i in range(puntos - 2):
+        ini, fin = limites[i], limites[i + 1]
+        sig_ini, sig_fin = limites[i + 1], limites[i + 2] if i + 2 < len(limites) else n
+        mx = x[sig_ini:sig_fin].mean()
+        my = y[sig_ini:sig_fin].mean()
+        xs = x[ini:fin]
+        ys = y[ini:fin]
+        areas = np.abs((x[a] - mx) * (ys - y[a]) - (x[a] - xs) * (my - y[a]))
+        a = ini + int(areas.argmax())
+        indices[i + 1] = a
+    return x[indices], y[indices]
+
+
+class DiezmadorMinMax:
+    # Envolvente mínimo/máximo incremental para un canal de un BufferCircular.
+    # Los grupos se alinean al índice absoluto de la muestra, así los grupos ya
+    # completos no cambian al llegar datos nuevos: solo se calculan los nuevos
+    # y los extremos parciales de la ventana.
+    def __init__(self, pixeles=1000):
+        self.pixeles = pixeles
+        self._k = None
+        self._limpiar()
+
+    def _limpiar(self):
+        self._primer_grupo = 0
+        self._fin_grupos = 0  # Primer grupo aún no calculado
+        self._indices = np.empty(0, dtype=np.int64)  # Índices absolutos, dos por grupo
+
+    def ajustar_ancho(self, pixeles):
+        pixeles = max(1, int(pixeles))
+        if pixeles != self.pixeles:
+            self.pixeles = pixeles
+            self._k = None
+
+    def actualizar(self, buffer, canal=0):
+        # Devuelve (x, y) listos para setData; x es la posición dentro de la ventana
+        n = buffer.tamano
+        vista = buffer.vista(canal)
+        if n <= 2 * self.pixeles:
+            return np.arange(n), vista
+
+        k = max(1, -(-buffer.capacidad // self.pixeles))
+        if k != self._k:
+            self._k = k
+            self._limpiar()
+
+        total = buffer.total
+        inicio = total - n
+        primero = -(-inicio // k)  # Primer grupo completo dentro de la ventana
+        ultimo = total // k        # Grupo (incompleto) que se está llenando
+
+        # Descarta los grupos que han salido de la ventana
+        if self._fin_grupos <= primero or self._primer_grupo > primero:
+            self._primer_grupo = self._fin_grupos = primero
+            self._indices = self._indices[:0]
+        elif self._primer_grupo < primero:
+            self._indices = self._indices[2 * (primero - self._primer_grupo):]
+            self._primer_grupo = primero
+
+        # Calcula solo los grupos completados desde la última llamada
+        if ultimo > self._fin_grupos:
+            desde = self._fin_grupos * k
+            bloques = vista[desde - inicio:ultimo * k - inicio].reshape(-1, k)
+            base = desde + np.arange(len(bloques)) * k
+            imin = base + bloques.argmin(axis=1)
+            imax = base + bloques.argmax(axis=1)
+            nuevos = np.column_stack((np.minimum(imin, imax), np.maximum(imin, imax))).ravel()
+            self._indices = np.concatenate((self._indices, nuevos))
+            self._fin_grupos = ultimo
+
+        # Extremos parciales de la ventana (menos de k muestras cada uno)
+        partes = [self._parcial(vista, inicio, inicio, min(primero * k, total)),
+                  self._indices,
+                  self._parcial(vista, inicio, max(ultimo * k, inicio), total)]
+        indices = np.concatenate(partes) - inicio
+        return indices, vista[indices]
+
+    @staticmethod
+    def _parcial(vista, inicio, desde, hasta):
+        if hasta <= desde:
+            return np.empty(0, dtype=np.int64)
+        tramo = vista[desde - inicio:hasta - inicio]
+        return desde + np.array(sorted({int(tramo.argmin()), int(tramo.argmax())}), dtype=np.int64)
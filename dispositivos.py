@@ -0,0 +1,98 @@
+import sqlite3
+import sys
+import time
+
+from lectura import Lectura
+
+# Registro de los ESP32 que han enviado datos (tabla dispositivos, ver
+# esquema.crear_esquema). En memoria cada Lectura lleva el nombre de su
+# dispositivo: el que envía en el saludo (ver protocolo.py) o, si no se
+# identifica, su dirección IP. En la tabla sensores se guarda el id del
+# registro, con un índice (dispositivo, timestamp) para leer un solo dispositivo.
+
+_nueva = tuple.__new__
+
+
+def nombres(conn):
+    # {id: nombre} de todos los dispositivos registrados
+    try:
+        return dict(conn.execute("SELECT id, nombre FROM dispositivos"))
+    except sqlite3.OperationalError:  # Base de datos anterior al registro
+        return {}
+
+
+def ids(conn, lista):
+    # ids de los dispositivos con esos nombres; ValueError si alguno no existe
+    registrados = {nombre: id_ for id_, nombre in nombres(conn).items()}
+    desconocidos = [nombre for nombre in lista if nombre not in registrados]
+    if desconocidos:
+        raise ValueError(f"Dispositivos desconocidos: {', '.join(desconocidos)}")
+    return [registrados[nombre] for nombre in lista]
+
+
+def listar(conn):
+    # [(nombre, primera_vez, ultima_vez, lecturas)] del más reciente al más antiguo
+    try:
+        return conn.execute('''
+            SELECT nombre, primera_vez, ultima_vez, lecturas FROM dispositivos
+            ORDER BY ultima_vez DESC
+        ''').fetchall()
+    except sqlite3.OperationalError:
+        return []
+
+
+class RegistroDispositivos:
+    # Lado del escritor (EscritorDB): sustituye el nombre de cada Lectura por
+    # su id y lleva la cuenta de lecturas y la última vez de cada dispositivo.
+    # Solo la usa el hilo escritor.
+    def __init__(self):
+        self._ids = {}  # nombre -> id
+
+    def asignar(self, conn, lote):
+        # Antes de BEGIN: da de alta los dispositivos nuevos (aunque el lote
+        # falle después, el registro sigue siendo válido) y devuelve
+        # (filas para insertar, resumen para anotar)
+        resumen = {}
+        for lectura in lote:
+            nombre = lectura.dispositivo
+            if nombre is not None:
+                cuenta = resumen.get(nombre)
+                if cuenta is None:
+                    resumen[nombre] = [1, lectura.timestamp]
+                else:
+                    cuenta[0] += 1
+                    if lectura.timestamp > cuenta[1]:
+                        cuenta[1] = lectura.timestamp
+        if not resumen:
+            return lote, resumen
+
+        ids = self._ids
+        for nombre, (_, ultima) in resumen.items():
+            if nombre not in ids:
+                conn.execute('''
+                    INSERT INTO dispositivos (nombre, primera_vez, ultima_vez) VALUES (?, ?, ?)
+                    ON CONFLICT(nombre) DO NOTHING
+                ''', (nombre, ultima, ultima))
+                ids[nombre] = conn.execute("SELECT id FROM dispositivos WHERE nombre = ?",
+                                           (nombre,)).fetchone()[0]
+        filas = [_nueva(Lectura, lectura[:-1] + (ids.get(lectura[-1]),)) for lectura in lote]
+        return filas, resumen
+
+    def anotar(self, conn, resumen):
+        # Dentro de la transacción del lote
+        if resumen:
+            conn.executemany('''
+                UPDATE dispositivos SET lecturas = lecturas + ?, ultima_vez = max(ultima_vez, ?)
+                WHERE id = ?
+            ''', [(n, ultima, self._ids[nombre]) for nombre, (n, ultima) in resumen.items()])
+
+
+# Lista los dispositivos registrados:
+#   python dispositivos.py datos_sensores.db
+if __name__ == "__main__":
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else "datos_sensores.db")
+    for nombre, primera, ultima, lecturas in listar(conn):
+        desde = time.strftime("%Y-%m-%d %H:%M", time.localtime(primera / 1000))
+        hasta = time.strftime("%Y-%m-%d %H:%M", time.localtime(ultima / 1000))
+        print(f"{nombre:<24} {lecturas:>12} lecturas  {desde} - {hasta}")
+    conn.close()
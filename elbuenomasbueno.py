@@ -1,40 +1,26 @@
 import socket
-import sqlite3
-from datetime import datetime
 from PyQt5.QtWidgets import QApplication, QMainWindow
 from PyQt5.QtCore import QTimer, QThread, pyqtSignal
 import sys
 from PyQt5.uic import loadUi
 from pyqtgraph import PlotWidget
+from escritor_db import EscritorDB
+from parseo import parsear, temperatura_humedad
 
 ESP32_HOST = "0.0.0.0"  # Cambia esto por la IP del ESP32
 ESP32_PORT = 1234        # Puerto usado por el ESP32
 db_filename = "datos_sensores.db"
 
+# Escritor de la base de datos (conexión persistente con escrituras por lotes)
+escritor = EscritorDB(db_filename)
+
 # Función para inicializar la base de datos
 def inicializar_db():
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sensores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            datos TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    escritor.iniciar()
 
 # Función para guardar los datos en la base de datos
 def guardar_datos(datos):
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO sensores (timestamp, datos) 
-        VALUES (?, ?)
-    ''', (datetime.now().isoformat(), datos))
-    conn.commit()
-    conn.close()
+    escritor.guardar(parsear(datos))
 
 class ServerThread(QThread):
     new_data_signal = pyqtSignal(str)
@@ -148,10 +134,8 @@ class MainWindow(QMainWindow):
     def update_graph_and_data(self, data):
         # Parsear los datos recibidos
         try:
-            # Eliminar etiquetas y unidades
-            parsed_data = data.replace("Temperatura:", "").replace("Humedad:", "")
-            parsed_data = parsed_data.replace("°C", "").replace("%", "")
-            temp, hum = map(float, parsed_data.split(","))
+            # Cualquier formato de mensaje, también con "Â°C" (ver parseo.py)
+            temp, hum = temperatura_humedad(data)
 
             self.temp_data.append(temp)
             self.hum_data.append(hum)
@@ -171,4 +155,6 @@ if __name__ == "__main__":
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
-    sys.exit(app.exec_())
+    codigo = app.exec_()
+    escritor.detener()  # Escribe las filas pendientes antes de salir
+    sys.exit(codigo)
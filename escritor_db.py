@@ -0,0 +1,404 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import agregados
+import metricas
+from esquema import INSERTAR_LECTURA, crear_esquema, es_esquema_antiguo, migrar
+from dispositivos import RegistroDispositivos
+from particiones import EscrituraParticionada
+from spool import Spool, SpoolLleno
+
+log = logging.getLogger(__name__)
+
+# Marca para indicar al hilo escritor que debe terminar
+_FIN = object()
+
+_COMMIT = metricas.histograma("db_commit_segundos", "Inserción y COMMIT de cada lote")
+_TAMANO_LOTE = metricas.histograma("db_lote_filas", "Filas por lote",
+                                   (1, 5, 10, 50, 100, 250, 500, 1000, 5000))
+_FILAS = metricas.contador("db_filas_total", "Filas guardadas")
+_ERRORES = metricas.contador("db_errores_total", "Lotes que no se pudieron guardar")
+
+
+class _Aviso:
+    # Marca en la cola: funcion(ok) se llama cuando todo lo encolado antes ya
+    # está confirmado en la base de datos (ok=False si falló la transacción)
+    __slots__ = ("funcion",)
+
+    def __init__(self, funcion):
+        self.funcion = funcion
+
+
+class EscritorDB:
+    # Escritor dedicado: mantiene una única conexión abierta y agrupa las
+    # filas recibidas en transacciones con executemany, limitadas por número
+    # de filas (max_filas) y por latencia máxima (max_latencia, en segundos).
+    # al_escribir(lote), si se indica, se llama tras cada COMMIT correcto.
+    # Con particiones="dia" o "mes" las filas se guardan en un archivo por
+    # periodo (ver particiones.py) y los agregados en db_filename.
+    # Si la base de datos no da abasto o está bloqueada, las filas que no
+    # caben en la cola van a un spool en disco (ver spool.py) hasta max_spool
+    # bytes; un lote que falla se reintenta en lugar de descartarse.
+    def __init__(self, db_filename, max_filas=500, max_latencia=0.05,
+                 synchronous="NORMAL", max_cola=100000, al_escribir=None, particiones=None,
+                 spool=True, max_spool=1 << 30):
+        self.db_filename = db_filename
+        self.directorio_spool = f"{db_filename}.spool" if spool is True else spool or None
+        self.max_spool = max_spool
+        self.spool = None
+        self._desbordado = False  # Las filas nuevas van al spool hasta vaciarlo
+        self._avisos_spool = []   # (posición en el spool, funcion) de confirmar()
+        self._lock_spool = threading.Lock()
+        self._deteniendo = False
+        self.particiones = (EscrituraParticionada(db_filename, particiones, synchronous=synchronous)
+                            if particiones else None)
+        self.dispositivos = RegistroDispositivos()
+        self.al_escribir = al_escribir
+        self.max_filas = max_filas
+        self.max_latencia = max_latencia
+        self.synchronous = synchronous
+        self.cola = queue.Queue(maxsize=max_cola)
+        self._hilo = None
+        self._reconstruccion = None
+        self._detener_reconstruccion = threading.Event()
+        self._listo = threading.Event()
+        self._error_inicio = None
+        self.error = None  # Excepción que detuvo el hilo escritor (p. ej. al migrar)
+        self._lock = threading.Lock()
+
+        # Contadores de rendimiento
+        self.filas_escritas = 0
+        self.lotes_escritos = 0
+        self.errores = 0
+        self.latencia_flush_ultima = 0.0
+        self.latencia_flush_max = 0.0
+        self.tiempo_flush_total = 0.0
+        self.inicio = None
+
+    def iniciar(self):
+        # Arranca el hilo escritor y espera a que la tabla esté creada. Una
+        # base de datos con el esquema antiguo se migra después, en el hilo
+        # escritor: las lecturas esperan en la cola (y en el spool) mientras tanto
+        if self._hilo is not None:
+            return
+        self.inicio = time.monotonic()
+        metricas.indicador("db_cola_pendiente", "Lecturas en cola para el escritor", self.cola.qsize)
+        if self.directorio_spool is not None and self.spool is None:
+            self.spool = Spool(self.directorio_spool, self.max_spool)
+            self._desbordado = not self.spool.vacio()  # Pendiente de una ejecución anterior
+        self._deteniendo = False
+        self._detener_reconstruccion.clear()
+        self.error = None
+        self._hilo = threading.Thread(target=self._ejecutar, name="EscritorDB", daemon=True)
+        self._hilo.start()
+        self._listo.wait()
+        if self._error_inicio is not None:
+            raise self._error_inicio
+
+    def guardar(self, lectura):
+        # Encola una Lectura; la escritura real ocurre en el hilo escritor.
+        # Con la cola llena la Lectura va al spool, y también las siguientes
+        # hasta que el escritor lo vacíe (para conservar el orden). Nunca
+        # bloquea: si tampoco cabe en el spool lanza SpoolLleno y el que llama
+        # debe dejar de recibir datos un tiempo.
+        with self._lock_spool:
+            if not self._desbordado:
+                try:
+                    self.cola.put_nowait(lectura)
+                    return
+                except queue.Full:
+                    if self.spool is None:
+                        raise SpoolLleno("La cola del escritor está llena")
+                    self._desbordado = True
+                    log.warning("La base de datos va con retraso: guardando en el spool %s",
+                                self.directorio_spool)
+            self.spool.agregar((lectura,))
+
+    def confirmar(self, funcion):
+        # funcion(ok) se llama desde el hilo escritor tras el COMMIT que incluye
+        # todas las Lecturas guardadas hasta ahora
+        with self._lock_spool:
+            if not self._desbordado:
+                try:
+                    self.cola.put_nowait(_Aviso(funcion))
+                    return
+                except queue.Full:
+                    if self.spool is None:
+                        raise SpoolLleno("La cola del escritor está llena")
+                    self._desbordado = True
+            # Se avisa cuando el escritor haya guardado el spool hasta aquí
+            self._avisos_spool.append((self.spool.fin(), funcion))
+
+    def detener(self, timeout=None):
+        # Vacía la cola pendiente y cierra la conexión. Lo que quede en el
+        # spool se guarda al volver a iniciar el escritor. Si el hilo escritor
+        # se detuvo por un error, las filas de la cola pasan al spool y se
+        # lanza ese error.
+        if self._hilo is None:
+            return
+        self._deteniendo = True
+        self._detener_reconstruccion.set()
+        # El hilo puede haber terminado con la cola llena: no se espera por
+        # un hueco en ella si ya no hay quien la vacíe
+        while self._hilo.is_alive():
+            try:
+                self.cola.put(_FIN, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self._hilo.join(timeout)
+        if self._hilo.is_alive():
+            log.warning("El escritor de %s no ha terminado en %s s", self.db_filename, timeout)
+        else:
+            self._al_spool([])
+        self._hilo = None
+        if self._reconstruccion is not None:
+            # Se para entre dos días; el aviso indica cómo completarlo
+            self._reconstruccion.join(timeout)
+            self._reconstruccion = None
+        if self.spool is not None:
+            self.spool.cerrar()
+            self.spool = None
+        if self.error is not None:
+            raise self.error
+
+    def estadisticas(self):
+        with self._lock:
+            transcurrido = time.monotonic() - self.inicio if self.inicio else 0.0
+            return {
+                "filas_escritas": self.filas_escritas,
+                "lotes_escritos": self.lotes_escritos,
+                "errores": self.errores,
+                "detenido_por": repr(self.error) if self.error is not None else None,
+                "pendientes": self.cola.qsize(),
+                "spool": self.spool.estadisticas() if self.spool is not None else None,
+                "filas_por_segundo": self.filas_escritas / transcurrido if transcurrido else 0.0,
+                "latencia_flush_ultima_ms": self.latencia_flush_ultima * 1000,
+                "latencia_flush_max_ms": self.latencia_flush_max * 1000,
+                "latencia_flush_media_ms": (self.tiempo_flush_total / self.lotes_escritos * 1000
+                                            if self.lotes_escritos else 0.0),
+            }
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.db_filename, isolation_level=None)
+        # Solo tiene efecto en una base de datos nueva (ver retencion.convertir)
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        return conn
+
+    def _reconstruir_agregados(self):
+        orden = f"python agregados.py {self.db_filename}"
+        try:
+            conn = sqlite3.connect(self.db_filename, isolation_level=None)
+            try:
+                conn.execute("PRAGMA busy_timeout=5000")
+                pendiente = agregados.reconstruir(conn, detener=self._detener_reconstruccion)
+            finally:
+                conn.close()
+        except Exception:
+            log.exception("No se pudieron calcular los agregados de %s; se pueden recalcular con: %s",
+                          self.db_filename, orden)
+            return
+        if pendiente is None:
+            log.info("Agregados de %s calculados", self.db_filename)
+        else:
+            log.warning("Cálculo de agregados de %s interrumpido; para completarlo: %s --desde %d",
+                        self.db_filename, orden, pendiente)
+
+    def _preparar(self, conn):
+        crear_esquema(conn)
+        agregados.crear_tablas(conn)
+        if self.particiones is not None:
+            self.particiones.preparar(conn)
+
+    def _ejecutar(self):
+        try:
+            conn = self._conectar()
+            antiguo = es_esquema_antiguo(conn)
+            if not antiguo:
+                self._preparar(conn)
+        except Exception as e:
+            self._error_inicio = e
+            self._listo.set()
+            return
+        self._listo.set()
+
+        terminar = False
+        try:
+            if antiguo:
+                log.info("Migrando %s al esquema nuevo en segundo plano", self.db_filename)
+                migrar(conn)
+                self._preparar(conn)
+                log.info("Migración de %s terminada", self.db_filename)
+                # Las filas antiguas no tienen agregados: se calculan en otro
+                # hilo, un día por transacción, mientras se siguen guardando lecturas
+                self._reconstruccion = threading.Thread(target=self._reconstruir_agregados,
+                                                        name="Agregados", daemon=True)
+                self._reconstruccion.start()
+            while not terminar:
+                # Espera bloqueante por la primera fila del lote; con filas en
+                # el spool, se guardan cuando la cola queda vacía
+                try:
+                    item = self.cola.get(timeout=self.max_latencia if self._desbordado else None)
+                except queue.Empty:
+                    self._reproducir(conn)
+                    continue
+                lote = []
+                avisos = []
+                limite = time.monotonic() + self.max_latencia
+
+                # Acumula filas hasta llenar el lote o agotar la latencia máxima
+                while True:
+                    if item is _FIN:
+                        terminar = True
+                        break
+                    if type(item) is _Aviso:
+                        avisos.append((len(lote), item.funcion))
+                    else:
+                        lote.append(item)
+                        if len(lote) >= self.max_filas:
+                            break
+                    restante = limite - time.monotonic()
+                    try:
+                        item = self.cola.get(timeout=restante) if restante > 0 else self.cola.get_nowait()
+                    except queue.Empty:
+                        break
+
+                ok = self._escribir_lote(conn, lote) if lote else True
+                if not ok:
+                    ok = self._reintentar(conn, lote)
+                    if not ok:
+                        terminar = True
+                for filas, funcion in avisos:
+                    try:
+                        # Un aviso anterior a todas las filas del lote no depende de este COMMIT
+                        funcion(ok or not filas)
+                    except Exception as e:
+                        log.error("Error al confirmar la escritura: %s", e)
+        except Exception as e:
+            # Las lecturas siguen acumulándose en la cola y en el spool (hasta
+            # SpoolLleno); detener() pasa la cola al spool y lanza el error
+            log.exception("El escritor de %s se ha detenido; no se guardarán más lecturas", self.db_filename)
+            self.error = e
+        finally:
+            conn.close()
+            with self._lock_spool:
+                avisos, self._avisos_spool = self._avisos_spool, []
+            self._avisar(avisos, False)
+
+    def _avisar(self, avisos, ok):
+        for _, funcion in avisos:
+            try:
+                funcion(ok)
+            except Exception as e:
+                log.error("Error al confirmar la escritura: %s", e)
+
+    def _reintentar(self, conn, lote):
+        # El lote no se pudo escribir (p. ej. "database is locked"): se
+        # reintenta con esperas crecientes mientras las filas nuevas se
+        # acumulan en la cola y en el spool. Si se detiene el escritor antes,
+        # el lote y lo que queda en la cola van al principio del spool y se
+        # devuelve False.
+        espera = 0.1
+        while not self._deteniendo:
+            time.sleep(espera)
+            if self._escribir_lote(conn, lote):
+                return True
+            espera = min(espera * 2, 5.0)
+
+        self._al_spool(lote)
+        return False
+
+    def _al_spool(self, lote):
+        # El lote y lo que queda en la cola (siempre anterior al spool) van
+        # al principio del spool
+        pendientes = list(lote)
+        while True:
+            try:
+                item = self.cola.get_nowait()
+            except queue.Empty:
+                break
+            if type(item) is _Aviso:
+                self._avisar([(None, item.funcion)], False)
+            elif item is not _FIN:
+                pendientes.append(item)
+        if not pendientes:
+            return
+        if self.spool is None:
+            log.error("Se pierden %d filas que no se pudieron guardar", len(pendientes))
+        else:
+            self.spool.anteponer(pendientes)
+            log.warning("%d filas sin guardar quedan en el spool %s", len(pendientes), self.directorio_spool)
+
+    def _reproducir(self, conn):
+        # Guarda en orden lo acumulado en el spool mientras no lleguen filas
+        # nuevas a la cola (la cola es siempre anterior al spool)
+        while self.cola.empty():
+            lecturas, posicion = self.spool.leer(self.max_filas)
+            if not lecturas and not self.spool.vacio():
+                return  # Se está añadiendo una línea; en la siguiente espera
+            if lecturas and not self._escribir_lote(conn, lecturas):
+                return  # Se reintenta en la siguiente espera de la cola
+            self.spool.confirmar(posicion)
+            with self._lock_spool:
+                listos = [aviso for aviso in self._avisos_spool if aviso[0] <= posicion]
+                self._avisos_spool = self._avisos_spool[len(listos):]
+                if len(lecturas) < self.max_filas and self.spool.vacio():
+                    listos += self._avisos_spool
+                    self._avisos_spool = []
+                    self._desbordado = False
+            self._avisar(listos, True)
+            if not self._desbordado:
+                log.info("Spool vaciado: la base de datos vuelve a estar al día")
+                return
+
+    def _escribir_lote(self, conn, lote):
+        t0 = time.monotonic()
+        try:
+            filas, resumen = self.dispositivos.asignar(conn, lote)  # Nombre -> id
+            if self.particiones is None:
+                conn.execute("BEGIN")
+                conn.executemany(INSERTAR_LECTURA, filas)
+            else:
+                grupos = self.particiones.repartir(conn, filas)  # ATTACH antes de BEGIN
+                conn.execute("BEGIN")
+                self.particiones.insertar(conn, grupos)
+            self.dispositivos.anotar(conn, resumen)
+            agregados.actualizar(conn, filas)  # Agregados por dispositivo y minuto/hora/día en la misma transacción
+            conn.execute("COMMIT")
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            with self._lock:
+                self.errores += 1
+            if metricas.activas:
+                _ERRORES.sumar()
+            log.error("Error al guardar los datos en la base de datos: %s", e)
+            return False
+        duracion = time.monotonic() - t0
+
+        with self._lock:
+            self.filas_escritas += len(lote)
+            self.lotes_escritos += 1
+            self.latencia_flush_ultima = duracion
+            self.latencia_flush_max = max(self.latencia_flush_max, duracion)
+            self.tiempo_flush_total += duracion
+        if metricas.activas:
+            _COMMIT.observar(duracion)
+            _TAMANO_LOTE.observar(len(lote))
+            _FILAS.sumar(len(lote))
+        if self.al_escribir is not None:
+            try:
+                self.al_escribir(lote)
+            except Exception as e:
+                log.error("Error en al_escribir tras guardar el lote: %s", e)
+        if self.particiones is not None:
+            try:
+                self.particiones.cerrar_vencidas(conn)
+            except Exception as e:
+                log.error("Error al cerrar las particiones vencidas: %s", e)
+        return True
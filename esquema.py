@@ -0,0 +1,152 @@
+import logging
+import sqlite3
+import sys
+from datetime import datetime
+
+from lectura import CANALES, Lectura
+from parseo import Parser
+
+log = logging.getLogger(__name__)
+
+
+def sql_insertar(tabla="sensores", columnas=Lectura._fields):
+    return f'''
+        INSERT INTO {tabla} ({", ".join(columnas)})
+        VALUES ({", ".join("?" * len(columnas))})
+    '''
+
+
+INSERTAR_LECTURA = sql_insertar()
+
+
+def _crear_tabla(conn, nombre):
+    columnas = ",\n".join(f"            {canal} REAL" for canal in CANALES)
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {nombre} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER NOT NULL,
+{columnas},
+            datos TEXT,
+            dispositivo INTEGER
+        )
+    ''')
+
+
+def es_esquema_antiguo(conn):
+    # La tabla original guardaba timestamp TEXT y el mensaje crudo en datos
+    columnas = {fila[1]: fila[2] for fila in conn.execute("PRAGMA table_info(sensores)")}
+    return bool(columnas) and "temperatura" not in columnas
+
+
+def crear_tabla_sensores(conn):
+    # Tabla sensores e índices por tiempo y por dispositivo (también en cada
+    # archivo de particiones.py)
+    _crear_tabla(conn, "sensores")
+    columnas = {fila[1] for fila in conn.execute("PRAGMA table_info(sensores)")}
+    if "dispositivo" not in columnas:
+        # Tabla anterior al registro de dispositivos
+        conn.execute("ALTER TABLE sensores ADD COLUMN dispositivo INTEGER")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sensores_timestamp ON sensores(timestamp)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sensores_dispositivo ON sensores(dispositivo, timestamp)")
+
+
+def crear_esquema(conn):
+    # Crea (o migra) la tabla sensores con columnas tipadas e índice por tiempo.
+    # La migración de una base de datos antigua puede tardar; EscritorDB la
+    # hace en su hilo en lugar de llamar aquí con el esquema antiguo
+    if es_esquema_antiguo(conn):
+        migrar(conn)
+    crear_tabla_sensores(conn)
+    # Hasta dónde (ms) ha borrado retencion.py los datos de cada tabla
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS retencion (
+            tabla TEXT PRIMARY KEY,
+            podado_hasta INTEGER NOT NULL
+        )
+    ''')
+    # Registro de los ESP32 (ver dispositivos.py)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS dispositivos (
+            id INTEGER PRIMARY KEY,
+            nombre TEXT NOT NULL UNIQUE,
+            primera_vez INTEGER NOT NULL,
+            ultima_vez INTEGER NOT NULL,
+            lecturas INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    if conn.in_transaction:
+        conn.commit()
+
+
+def podado_hasta(conn, tabla="sensores"):
+    # Los datos de tabla anteriores a este instante (ms) ya se borraron por
+    # la política de retención; None si nunca se ha borrado nada
+    try:
+        fila = conn.execute("SELECT podado_hasta FROM retencion WHERE tabla = ?", (tabla,)).fetchone()
+    except sqlite3.OperationalError:  # Base de datos anterior a la tabla retencion
+        return None
+    return fila[0] if fila else None
+
+
+def _timestamp_ms(texto):
+    # None si el texto no es una fecha ISO válida
+    try:
+        return int(datetime.fromisoformat(texto).timestamp() * 1000)
+    except (TypeError, ValueError):
+        return None
+
+
+def migrar(conn, tamano_bloque=10000):
+    # Convierte en el mismo archivo la tabla antigua (timestamp TEXT, datos TEXT)
+    # a la tabla tipada. Se copia por bloques de ids en transacciones cortas a
+    # sensores_nueva; si se interrumpe, continúa desde el último id copiado.
+    # Las filas con un timestamp que no se puede interpretar se guardan con
+    # timestamp 0 y el texto original en datos, y se avisa de cuántas son.
+    _crear_tabla(conn, "sensores_nueva")
+    conn.commit()
+    ultimo = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sensores_nueva").fetchone()[0]
+    total = conn.execute("SELECT COUNT(*) FROM sensores WHERE id > ?", (ultimo,)).fetchone()[0]
+    copiadas = 0
+    insertar = sql_insertar("sensores_nueva", ("id",) + Lectura._fields)
+    parser = Parser()
+    invalidas = 0
+
+    while True:
+        filas = conn.execute(
+            "SELECT id, timestamp, datos FROM sensores WHERE id > ? ORDER BY id LIMIT ?",
+            (ultimo, tamano_bloque)).fetchall()
+        if not filas:
+            break
+        nuevas = []
+        for id_, timestamp, datos in filas:
+            ms = _timestamp_ms(timestamp)
+            lectura = parser.parsear(datos, 0 if ms is None else ms)
+            if ms is None:
+                invalidas += 1
+                lectura = lectura._replace(datos=f"timestamp={timestamp!r} datos={datos!r}")
+            nuevas.append((id_,) + lectura)
+        conn.execute("BEGIN")
+        conn.executemany(insertar, nuevas)
+        conn.commit()
+        ultimo = filas[-1][0]
+        copiadas += len(filas)
+        log.info("Migración de sensores: %d/%d filas", copiadas, total)
+    if invalidas:
+        log.warning("Migración de sensores: %d filas con un timestamp no válido, guardadas con "
+                    "timestamp 0 y el texto original en datos", invalidas)
+
+    # Sustituye la tabla antigua por la nueva en una sola transacción
+    conn.execute("BEGIN")
+    conn.execute("DROP TABLE sensores")
+    conn.execute("ALTER TABLE sensores_nueva RENAME TO sensores")
+    conn.commit()
+
+
+# Permite migrar una base de datos existente sin arrancar la interfaz:
+#   python esquema.py datos_sensores.db
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    conn = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else "datos_sensores.db",
+                           isolation_level=None)
+    crear_esquema(conn)
+    conn.close()
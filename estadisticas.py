@@ -0,0 +1,93 @@
+import math
+import time
+from collections import deque
+
+
+class VentanaDeslizante:
+    # Mínimo, máximo, media y varianza de las últimas muestras en O(1) por
+    # muestra. La ventana se limita por número de muestras (tamano), por
+    # antigüedad (segundos) o por ambos.
+    #  - mínimo/máximo: colas monótonas
+    #  - media y varianza: Welford, que también admite quitar muestras y no
+    #    pierde precisión con muchos valores parecidos (p. ej. 20 °C) como
+    #    la suma y la suma de cuadrados
+    def __init__(self, tamano=None, segundos=None):
+        if tamano is None and segundos is None:
+            raise ValueError("Hay que indicar tamano, segundos o ambos")
+        self.tamano = tamano
+        self.segundos = segundos
+        self._muestras = deque()   # (secuencia, t, valor)
+        self._minimos = deque()    # (secuencia, valor) con valores crecientes
+        self._maximos = deque()    # (secuencia, valor) con valores decrecientes
+        self._secuencia = 0
+        self._media = 0.0
+        self._m2 = 0.0
+
+    def __len__(self):
+        return len(self._muestras)
+
+    def agregar(self, valor, t=None):
+        if valor is None or math.isnan(valor):
+            return
+        if t is None:
+            t = time.monotonic()
+        secuencia = self._secuencia
+        self._secuencia += 1
+        self._muestras.append((secuencia, t, valor))
+
+        while self._minimos and self._minimos[-1][1] >= valor:
+            self._minimos.pop()
+        self._minimos.append((secuencia, valor))
+        while self._maximos and self._maximos[-1][1] <= valor:
+            self._maximos.pop()
+        self._maximos.append((secuencia, valor))
+
+        n = len(self._muestras)
+        delta = valor - self._media
+        self._media += delta / n
+        self._m2 += delta * (valor - self._media)
+
+        self._expirar(t)
+
+    def _expirar(self, t):
+        while self._muestras and (
+                (self.tamano is not None and len(self._muestras) > self.tamano)
+                or (self.segundos is not None and t - self._muestras[0][1] > self.segundos)):
+            self._quitar()
+
+    def _quitar(self):
+        secuencia, _, valor = self._muestras.popleft()
+        if self._minimos[0][0] == secuencia:
+            self._minimos.popleft()
+        if self._maximos[0][0] == secuencia:
+            self._maximos.popleft()
+
+        n = len(self._muestras)
+        if n == 0:
+            self._media = self._m2 = 0.0  # Sin error de redondeo acumulado
+            return
+        delta = valor - self._media
+        self._media -= delta / n
+        self._m2 = max(0.0, self._m2 - delta * (valor - self._media))
+
+    @property
+    def minimo(self):
+        return self._minimos[0][1] if self._minimos else None
+
+    @property
+    def maximo(self):
+        return self._maximos[0][1] if self._maximos else None
+
+    @property
+    def media(self):
+        return self._media if self._muestras else None
+
+    @property
+    def varianza(self):
+        n = len(self._muestras)
+        return self._m2 / (n - 1) if n > 1 else None
+
+    @property
+    def desviacion(self):
+        varianza = self.varianza
+        return math.sqrt(varianza) if varianza is not None else None
@@ -0,0 +1,212 @@
+import argparse
+import csv
+import heapq
+import os
+import sqlite3
+import time
+from datetime import datetime
+from itertools import islice
+from operator import itemgetter
+from pathlib import Path
+
+import dispositivos
+import parseo
+import particiones
+from lectura import CANALES, Lectura
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Solo hace falta para exportar a Parquet
+    pa = pq = None
+
+# Exportación del histórico de la tabla sensores a CSV o Parquet sin cargarlo
+# en memoria: la consulta se recorre con el cursor de SQLite por bloques de
+# tamano_bloque filas (ordenadas por el índice de timestamp) y cada bloque se
+# escribe en el archivo antes de leer el siguiente. Con particiones (ver
+# particiones.py) se leen todos los archivos a la vez y se mezclan por
+# timestamp, porque las filas que llegan tarde se guardan en la partición
+# en curso y no en la de su periodo. El archivo se escribe con extensión .tmp
+# y se renombra al terminar. La columna dispositivo lleva el nombre del ESP32
+# (ver dispositivos.py).
+
+COLUMNAS = Lectura._fields
+_DATOS = COLUMNAS.index("datos")
+_DISPOSITIVO = COLUMNAS.index("dispositivo")
+_CANALES = range(1, 1 + len(CANALES))
+
+
+def _conectar(db):
+    uri = Path(db).resolve().as_uri() + "?mode=ro"
+    return sqlite3.connect(uri, uri=True)
+
+
+def _reparsear(columnas, parser):
+    # Vuelve a interpretar las filas que se guardaron sin valores (mensajes
+    # que no se reconocieron al recibirlos); se rellenan en las columnas del bloque
+    datos = columnas[_DATOS]
+    pendientes = [i for i, texto in enumerate(datos) if texto is not None]
+    timestamps = columnas[0]
+    for i in pendientes:
+        lectura = parser.parsear(datos[i], timestamps[i])
+        if lectura.datos is None:
+            for c in _CANALES:
+                columnas[c][i] = lectura[c]
+            datos[i] = None
+    return len(pendientes)
+
+
+def _columnas(conn):
+    # Las tablas anteriores al registro de dispositivos no tienen esa columna
+    existentes = {fila[1] for fila in conn.execute("PRAGMA table_info(sensores)")}
+    return [columna if columna in existentes else f"NULL AS {columna}" for columna in COLUMNAS]
+
+
+def _filas(ruta, where, parametros, lista_dispositivos, tamano_bloque):
+    # Filas de un archivo, ordenadas por timestamp
+    conn = _conectar(ruta)
+    try:
+        columnas = _columnas(conn)
+        if lista_dispositivos is not None and columnas[_DISPOSITIVO] != "dispositivo":
+            return  # Filas sin dispositivo
+        sql = f"SELECT {', '.join(columnas)} FROM sensores{where} ORDER BY timestamp"
+        cursor = conn.execute(sql, parametros)
+        while True:
+            filas = cursor.fetchmany(tamano_bloque)
+            if not filas:
+                break
+            yield from filas
+    finally:
+        conn.close()
+
+
+def bloques(db, desde=None, hasta=None, tamano_bloque=50000, reparsear=True, lista_dispositivos=None):
+    # Genera los datos por bloques como listas de columnas (en el orden de
+    # COLUMNAS); lista_dispositivos limita la exportación a esos nombres
+    condiciones = []
+    parametros = []
+    if desde is not None:
+        condiciones.append("timestamp >= ?")
+        parametros.append(desde)
+    if hasta is not None:
+        condiciones.append("timestamp < ?")
+        parametros.append(hasta)
+
+    parser = parseo.Parser()
+    conn = _conectar(db)
+    try:
+        rutas = particiones.archivos(conn, desde, hasta)
+        nombres = dispositivos.nombres(conn)
+        if lista_dispositivos is not None:
+            ids = dispositivos.ids(conn, lista_dispositivos)
+            condiciones.append(f"dispositivo IN ({', '.join('?' * len(ids))})")
+            parametros.extend(ids)
+    finally:
+        conn.close()
+    where = " WHERE " + " AND ".join(condiciones) if condiciones else ""
+
+    archivos = [_filas(ruta, where, parametros, lista_dispositivos, tamano_bloque) for ruta in rutas]
+    filas = archivos[0] if len(archivos) == 1 else heapq.merge(*archivos, key=itemgetter(0))
+    while True:
+        lote = list(islice(filas, tamano_bloque))
+        if not lote:
+            break
+        bloque = [list(columna) for columna in zip(*lote)]
+        del lote
+        if reparsear:
+            _reparsear(bloque, parser)
+        bloque[_DISPOSITIVO] = [nombres.get(id_) for id_ in bloque[_DISPOSITIVO]]
+        yield bloque
+
+
+def _escribir_csv(archivo, iterador):
+    filas = 0
+    with open(archivo, "w", newline="", encoding="utf-8") as f:
+        escritor = csv.writer(f)
+        escritor.writerow(COLUMNAS)
+        for columnas in iterador:
+            escritor.writerows(zip(*columnas))
+            filas += len(columnas[0])
+            yield filas
+
+
+def _esquema_parquet():
+    campos = [pa.field("timestamp", pa.timestamp("ms", tz="UTC"), nullable=False)]
+    campos += [pa.field(canal, pa.float64()) for canal in CANALES]
+    campos.append(pa.field("datos", pa.string()))
+    campos.append(pa.field("dispositivo", pa.string()))
+    return pa.schema(campos)
+
+
+def _escribir_parquet(archivo, iterador, compresion="zstd"):
+    if pa is None:
+        raise RuntimeError("Para exportar a Parquet hay que instalar pyarrow (pip install pyarrow)")
+    esquema = _esquema_parquet()
+    filas = 0
+    # Cada bloque es un grupo de filas del archivo
+    with pq.ParquetWriter(archivo, esquema, compression=compresion) as escritor:
+        for columnas in iterador:
+            tabla = pa.Table.from_arrays(
+                [pa.array(columna, type=campo.type) for columna, campo in zip(columnas, esquema)],
+                schema=esquema)
+            escritor.write_table(tabla)
+            filas += len(columnas[0])
+            yield filas
+
+
+def exportar(db, destino, formato=None, desde=None, hasta=None, tamano_bloque=50000,
+             reparsear=True, progreso=None, lista_dispositivos=None):
+    # Exporta sensores a destino; formato "csv" o "parquet" (por defecto según
+    # la extensión). progreso(filas) se llama después de cada bloque.
+    # Devuelve el número de filas exportadas.
+    if formato is None:
+        formato = "parquet" if destino.lower().endswith((".parquet", ".pq")) else "csv"
+    escribir = {"csv": _escribir_csv, "parquet": _escribir_parquet}[formato]
+    temporal = destino + ".tmp"
+    filas = 0
+    try:
+        for filas in escribir(temporal, bloques(db, desde, hasta, tamano_bloque, reparsear,
+                                                  lista_dispositivos)):
+            if progreso is not None:
+                progreso(filas)
+        os.replace(temporal, destino)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
+    return filas
+
+
+def instante(texto):
+    # Milisegundos desde epoch o fecha ISO ("2024-05-01", "2024-05-01T12:00")
+    if texto.lstrip("-").isdigit():
+        return int(texto)
+    return int(datetime.fromisoformat(texto).timestamp() * 1000)
+
+
+# Exporta el histórico completo o un intervalo:
+#   python exportar.py datos_sensores.db sensores.csv
+#   python exportar.py datos_sensores.db sensores.parquet --desde 2024-05-01 --hasta 2024-06-01
+#   python exportar.py datos_sensores.db cocina.csv --dispositivo esp32-cocina
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta la tabla sensores a CSV o Parquet")
+    parser.add_argument("db", nargs="?", default="datos_sensores.db")
+    parser.add_argument("destino")
+    parser.add_argument("--formato", choices=("csv", "parquet"), help="Por defecto según la extensión")
+    parser.add_argument("--desde", type=instante, help="Inicio (ms desde epoch o fecha ISO)")
+    parser.add_argument("--hasta", type=instante, help="Fin, no incluido (ms desde epoch o fecha ISO)")
+    parser.add_argument("--dispositivo", action="append", dest="dispositivos", metavar="NOMBRE",
+                        help="Solo este dispositivo (se puede repetir)")
+    parser.add_argument("--bloque", type=int, default=50000, help="Filas por bloque")
+    parser.add_argument("--sin-reparsear", action="store_true",
+                        help="No reinterpreta las filas guardadas sin valores")
+    args = parser.parse_args()
+
+    t0 = time.monotonic()
+    try:
+        filas = exportar(args.db, args.destino, args.formato, args.desde, args.hasta, args.bloque,
+                         not args.sin_reparsear, lista_dispositivos=args.dispositivos,
+                         progreso=lambda n: print(f"Exportadas {n} filas", end="\r", flush=True))
+    except ValueError as e:  # p. ej. un --dispositivo que no existe
+        parser.error(str(e))
+    print(f"Exportadas {filas} filas a {args.destino} en {time.monotonic() - t0:.1f} s")
@@ -0,0 +1,273 @@
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+import agregados
+import dispositivos
+import particiones
+from diezmado import lttb, minmax
+from esquema import es_esquema_antiguo, podado_hasta
+
+
+log = logging.getLogger(__name__)
+
+# Reducción de las filas de cada página a puntos_por_pagina puntos: la
+# envolvente mínimo/máximo conserva todos los picos; LTTB da una línea más
+# limpia, más parecida a la original, pero puede saltarse picos aislados
+REDUCCIONES = {"minmax": minmax, "lttb": lttb}
+
+
+class HistorialSensores:
+    # Lectura perezosa del histórico de la tabla sensores para la gráfica.
+    # El tiempo se divide en páginas alineadas cuya duración depende del zoom
+    # (potencias de dos en milisegundos). Cada página se consulta por el índice
+    # de timestamp en un hilo de fondo, se reduce a puntos_por_pagina puntos y
+    # se guarda en una caché LRU. También se cargan las páginas vecinas para
+    # que desplazarse por la gráfica no tenga que esperar a la base de datos.
+    # La página que aún está recibiendo datos se vuelve a leer cada refresco segundos.
+    # Con zoom alejado las páginas se leen de las tablas de agregados
+    # (mínimo y máximo por intervalo) en lugar de las filas originales.
+    # Cada dispositivo tiene sus propias páginas, leídas por el índice
+    # (dispositivo, timestamp); el dispositivo None son las filas sin él.
+    def __init__(self, db_filename, max_paginas=256, puntos_por_pagina=1000, hilos=2,
+                 refresco=5.0, reduccion="minmax"):
+        if reduccion not in REDUCCIONES:
+            raise ValueError(f"Reducción desconocida: {reduccion!r}")
+        self.reducir = REDUCCIONES[reduccion]
+        self.uri = Path(db_filename).resolve().as_uri() + "?mode=ro"
+        self.max_paginas = max_paginas
+        self.puntos_por_pagina = puntos_por_pagina
+        self.refresco = refresco
+        self._cache = OrderedDict()
+        self._pendientes = set()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._ids = {}  # nombre -> id en la tabla dispositivos
+        self._ids_leidos = None
+        self._executor = ThreadPoolExecutor(hilos, thread_name_prefix="Historial")
+
+        # Contadores
+        self.aciertos = 0
+        self.fallos = 0
+        self.paginas_leidas = 0
+
+    def _conexion(self):
+        # Cada hilo usa su propia conexión de solo lectura
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.uri, uri=True)
+            self._local.conn = conn
+        return conn
+
+    def migrando(self):
+        # True mientras EscritorDB migra la base de datos del esquema antiguo
+        # (timestamp TEXT): hasta que termine no se puede leer el histórico
+        conn = sqlite3.connect(self.uri, uri=True)
+        try:
+            return es_esquema_antiguo(conn)
+        finally:
+            conn.close()
+
+    def rango_total(self):
+        # Primer y último timestamp (ms) guardados, o None si no hay datos
+        conn = sqlite3.connect(self.uri, uri=True)
+        try:
+            inicio, fin = conn.execute("SELECT MIN(timestamp), MAX(timestamp) FROM sensores").fetchone()
+            rango = particiones.rango(conn)
+            if rango is not None:
+                inicio = rango[0] if inicio is None else min(inicio, rango[0])
+                fin = rango[1] if fin is None else max(fin, rango[1])
+            # Los días más antiguos pueden quedar solo en los agregados (retencion.py)
+            if podado_hasta(conn) is not None:
+                grueso = agregados.tabla(list(agregados.NIVELES)[-1])
+                primero, ultimo = conn.execute(f"SELECT MIN(bucket), MAX(bucket) FROM {grueso}").fetchone()
+                if primero is not None:
+                    inicio = primero if inicio is None else min(inicio, primero)
+                    fin = ultimo if fin is None else fin
+        finally:
+            conn.close()
+        return None if inicio is None else (inicio, fin)
+
+    def dispositivos(self):
+        # Nombres de los dispositivos con datos guardados, más None si hay
+        # filas (o agregados) sin dispositivo
+        conn = sqlite3.connect(self.uri, uri=True)
+        try:
+            nombres = [nombre for _, nombre in sorted(dispositivos.nombres(conn).items())]
+            sin_dispositivo = conn.execute(
+                "SELECT 1 FROM sensores WHERE dispositivo IS NULL LIMIT 1").fetchone()
+            grueso = agregados.tabla(list(agregados.NIVELES)[-1])
+            if sin_dispositivo is None:
+                try:
+                    sin_dispositivo = conn.execute(f"SELECT 1 FROM {grueso} WHERE dispositivo = ? LIMIT 1",
+                                                   (agregados.SIN_DISPOSITIVO,)).fetchone()
+                except sqlite3.OperationalError:  # Sin tablas de agregados
+                    pass
+        finally:
+            conn.close()
+        return nombres + [None] if sin_dispositivo else nombres
+
+    def _id(self, nombre):
+        # id del dispositivo (SIN_DISPOSITIVO para None), o None si aún no
+        # está registrado; el registro se vuelve a leer como mucho cada refresco segundos
+        if nombre is None:
+            return agregados.SIN_DISPOSITIVO
+        if nombre not in self._ids and (self._ids_leidos is None
+                                        or time.monotonic() - self._ids_leidos > self.refresco):
+            self._ids_leidos = time.monotonic()
+            conn = sqlite3.connect(self.uri, uri=True)
+            try:
+                self._ids = {nombre: id_ for id_, nombre in dispositivos.nombres(conn).items()}
+            finally:
+                conn.close()
+        return self._ids.get(nombre)
+
+    @staticmethod
+    def duracion_pagina(intervalo_ms):
+        # Unas dos o tres páginas cubren el intervalo visible
+        return 2 ** math.ceil(math.log2(max(intervalo_ms / 2, 1000)))
+
+    def solicitar(self, inicio_ms, fin_ms, nombres, al_cargar=None):
+        # Devuelve lo que ya está en caché para el intervalo como
+        # {nombre: ((t_temp, temp), (t_hum, hum))}, con t en segundos, para
+        # cada dispositivo de nombres, y pide en segundo plano las páginas que
+        # faltan; al_cargar() se llama (desde otro hilo) cuando llega cada una
+        # de las páginas visibles
+        duracion = self.duracion_pagina(max(fin_ms - inicio_ms, 1))
+        primera = int(inicio_ms // duracion)
+        ultima = int((fin_ms - 1) // duracion)
+        datos = {}
+        for nombre in nombres:
+            id_ = self._id(nombre)
+            if id_ is not None:
+                datos[nombre] = self._solicitar(id_, duracion, primera, ultima, al_cargar)
+        return datos
+
+    def _solicitar(self, id_, duracion, primera, ultima, al_cargar):
+        paginas = []
+        for indice in range(primera - 1, ultima + 2):
+            clave = (duracion, indice, id_)
+            with self._lock:
+                entrada = self._cache.get(clave)
+                if entrada is not None:
+                    self._cache.move_to_end(clave)
+            visible = primera <= indice <= ultima
+            if entrada is not None:
+                pagina, leida = entrada
+                if visible:
+                    self.aciertos += 1
+                    paginas.append(pagina)
+                # Página abierta (aún recibe datos): se relee si está desactualizada
+                if leida is not None and time.monotonic() - leida > self.refresco:
+                    self._cargar(clave, al_cargar if visible else None)
+            else:
+                if visible:
+                    self.fallos += 1
+                self._cargar(clave, al_cargar if visible else None)
+
+        return tuple(self._unir([p[canal] for p in paginas]) for canal in range(2))
+
+    @staticmethod
+    def _unir(series):
+        if not series:
+            return np.empty(0), np.empty(0)
+        return (np.concatenate([s[0] for s in series]),
+                np.concatenate([s[1] for s in series]))
+
+    def _cargar(self, clave, al_cargar):
+        with self._lock:
+            if clave in self._pendientes:
+                return
+            self._pendientes.add(clave)
+        self._executor.submit(self._leer_pagina, clave, al_cargar)
+
+    def _nivel_agregado(self, duracion):
+        # Nivel de agregación más grueso que aún da puntos_por_pagina puntos
+        # (dos por intervalo), o None si hay que leer las filas originales
+        elegido = None
+        for nivel, intervalo in agregados.NIVELES.items():
+            if intervalo * self.puntos_por_pagina // 2 <= duracion:
+                elegido = nivel
+        return elegido
+
+    def _nivel_disponible(self, nivel, inicio):
+        # Si retencion.py ya borró los datos de la página en ese nivel, el
+        # siguiente nivel más grueso que aún los conserva
+        niveles = [None] + list(agregados.NIVELES)
+        for candidato in niveles[niveles.index(nivel):]:
+            tabla = "sensores" if candidato is None else agregados.tabla(candidato)
+            podado = podado_hasta(self._conexion(), tabla)
+            if podado is None or inicio >= podado:
+                return candidato
+        return niveles[-1]
+
+    def _leer_filas(self, id_, inicio, fin):
+        conn = self._conexion()
+        dispositivo = None if id_ == agregados.SIN_DISPOSITIVO else id_
+        with particiones.adjuntar(conn, inicio, fin) as sensores:
+            filas = conn.execute(f'''
+                SELECT timestamp, temperatura, humedad FROM {sensores}
+                WHERE dispositivo IS ? AND timestamp >= ? AND timestamp < ?
+                ORDER BY timestamp
+            ''', (dispositivo, inicio, fin)).fetchall()
+        datos = np.array(filas, dtype=np.float64).reshape(-1, 3)
+        t = datos[:, 0] / 1000.0
+        pagina = []
+        for canal in (1, 2):
+            valido = ~np.isnan(datos[:, canal])
+            pagina.append(self.reducir(t[valido], datos[valido, canal], self.puntos_por_pagina))
+        return pagina
+
+    def _leer_agregados(self, nivel, id_, inicio, fin):
+        # Envolvente a partir de los mínimos y máximos de cada intervalo
+        intervalo = agregados.NIVELES[nivel]
+        pagina = []
+        for canal in agregados.CANALES_AGREGADOS:
+            filas = self._conexion().execute(f'''
+                SELECT bucket, {canal}_min, {canal}_max FROM {agregados.tabla(nivel)}
+                WHERE dispositivo = ? AND bucket >= ? AND bucket < ? AND {canal}_n > 0
+                ORDER BY bucket
+            ''', (id_, inicio, fin)).fetchall()
+            datos = np.array(filas, dtype=np.float64).reshape(-1, 3)
+            t = np.repeat((datos[:, 0] + intervalo / 2) / 1000.0, 2)
+            pagina.append((t, datos[:, 1:].ravel()))
+        return pagina
+
+    def _leer_pagina(self, clave, al_cargar):
+        duracion, indice, id_ = clave
+        inicio, fin = indice * duracion, (indice + 1) * duracion
+        try:
+            nivel = self._nivel_disponible(self._nivel_agregado(duracion), inicio)
+            if nivel is None:
+                pagina = self._leer_filas(id_, inicio, fin)
+            else:
+                pagina = self._leer_agregados(nivel, id_, inicio, fin)
+            abierta = fin > time.time() * 1000
+        except Exception as e:
+            log.error("Error al leer el histórico: %s", e)
+            with self._lock:
+                self._pendientes.discard(clave)
+            return
+
+        with self._lock:
+            self._pendientes.discard(clave)
+            self._cache[clave] = (tuple(pagina), time.monotonic() if abierta else None)
+            while len(self._cache) > self.max_paginas:
+                self._cache.popitem(last=False)
+            self.paginas_leidas += 1
+        if al_cargar is not None:
+            al_cargar()
+
+    def limpiar(self):
+        with self._lock:
+            self._cache.clear()
+
+    def cerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
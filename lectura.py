@@ -0,0 +1,20 @@
+import time
+from collections import namedtuple
+
+# Canales numéricos almacenados en columnas REAL de la tabla sensores
+CANALES = (
+    "temperatura", "humedad",
+    "t_inst", "t_max", "t_min", "t_avg",
+    "h_inst", "h_max", "h_min", "h_avg",
+)
+
+# Lectura ya parseada; timestamp en milisegundos desde epoch (UTC).
+# datos solo guarda el texto original cuando no se pudo interpretar (o, en
+# una base de datos migrada, cuando su timestamp no era válido).
+# dispositivo es el nombre del ESP32 que la envió (en la tabla sensores, el id
+# de la tabla dispositivos; ver dispositivos.py).
+Lectura = namedtuple("Lectura", ("timestamp",) + CANALES + ("datos", "dispositivo"), defaults=(None,))
+
+
+def ahora_ms():
+    return int(time.time() * 1000)
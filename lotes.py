@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+
+import metricas
+
+log = logging.getLogger(__name__)
+
+_PENDIENTES = metricas.indicador("lotes_pendientes", "Elementos acumulados esperando el próximo lote")
+_LOTES = metricas.contador("lotes_entregados_total", "Lotes entregados")
+_TAMANO = metricas.histograma("lotes_elementos", "Elementos por lote",
+                              (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000))
+
+
+class AgrupadorLotes:
+    # Acumula elementos (p. ej. Lecturas) desde cualquier hilo y los entrega
+    # juntos a entregar(lista) desde un hilo propio, como mucho una vez cada
+    # intervalo segundos. Si no llega nada no se entrega nada; el primer
+    # elemento tras un periodo sin datos sale sin esperar.
+    def __init__(self, entregar, intervalo=0.03):
+        self.entregar = entregar
+        self.intervalo = intervalo
+        self._pendientes = []
+        self._lock = threading.Lock()
+        self._hay_datos = threading.Event()
+        self._detener = False
+        self._hilo = None
+        self._ultima = 0.0
+
+        # Contadores
+        self.elementos = 0
+        self.lotes = 0
+        self.max_lote = 0
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        self._detener = False
+        _PENDIENTES.funcion = lambda: len(self._pendientes)
+        self._hilo = threading.Thread(target=self._ejecutar, name="AgrupadorLotes", daemon=True)
+        self._hilo.start()
+
+    def agregar(self, elemento):
+        with self._lock:
+            self._pendientes.append(elemento)
+            if len(self._pendientes) == 1:
+                self._hay_datos.set()
+
+    def extender(self, elementos):
+        with self._lock:
+            vacio = not self._pendientes
+            self._pendientes.extend(elementos)
+            if vacio and self._pendientes:
+                self._hay_datos.set()
+
+    def detener(self, timeout=2.0):
+        # Entrega lo pendiente y termina el hilo
+        if self._hilo is None:
+            return
+        self._detener = True
+        self._hay_datos.set()
+        self._hilo.join(timeout)
+        self._hilo = None
+
+    def _ejecutar(self):
+        while True:
+            self._hay_datos.wait()
+            if not self._detener:
+                # Respeta el intervalo mínimo desde la entrega anterior
+                espera = self._ultima + self.intervalo - time.monotonic()
+                if espera > 0:
+                    time.sleep(espera)
+            with self._lock:
+                lote, self._pendientes = self._pendientes, []
+                self._hay_datos.clear()
+            if lote:
+                self._entregar(lote)
+            if self._detener:
+                return
+
+    def _entregar(self, lote):
+        self._ultima = time.monotonic()
+        self.elementos += len(lote)
+        self.lotes += 1
+        self.max_lote = max(self.max_lote, len(lote))
+        if metricas.activas:
+            _LOTES.sumar()
+            _TAMANO.observar(len(lote))
+        try:
+            self.entregar(lote)
+        except Exception:
+            log.exception("Error al entregar un lote de %d elementos", len(lote))
+
+    def estadisticas(self):
+        return {
+            "elementos": self.elementos,
+            "lotes": self.lotes,
+            "elementos_por_lote": self.elementos / self.lotes if self.lotes else 0.0,
+            "pendientes": len(self._pendientes),
+            "max_lote": self.max_lote,
+        }
@@ -1,3 +1,8 @@
+from estadisticas import VentanaDeslizante
+from parseo import temperatura_humedad
+
+VENTANA_ESTADISTICAS = 60  # Muestras usadas para los valores máximos y mínimos
+
 class MainWindow(QMainWindow):
     def __init__(self):
         super(MainWindow, self).__init__()
@@ -37,6 +42,10 @@ class MainWindow(QMainWindow):
         self.temp_data = []
         self.hum_data = []
 
+        # Máximos y mínimos calculados en el equipo sobre una ventana deslizante
+        self.temp_stats = VentanaDeslizante(VENTANA_ESTADISTICAS)
+        self.hum_stats = VentanaDeslizante(VENTANA_ESTADISTICAS)
+
         # Configurar el temporizador para actualizar los datos
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_graph)
@@ -76,10 +85,8 @@ class MainWindow(QMainWindow):
     def update_graph_and_data(self, data):
         # Parsear los datos recibidos
         try:
-            # Eliminar etiquetas y unidades
-            parsed_data = data.replace("Temperatura:", "").replace("Humedad:", "")
-            parsed_data = parsed_data.replace("Â°C", "").replace("%", "")
-            temp, hum = map(float, parsed_data.split(","))
+            # Cualquier formato de mensaje, también con "Â°C" (ver parseo.py)
+            temp, hum = temperatura_humedad(data)
 
             # Añadir los nuevos datos al gráfico
             self.temp_data.append(temp)
@@ -94,10 +101,12 @@ class MainWindow(QMainWindow):
             self.update_graph()
 
             # Actualizar los QLCDNumber con los nuevos valores
-            self.lcdTempMax.display(temp)  # Suponiendo que tienes un QLCDNumber llamado lcdTempMax
-            self.lcdTempMin.display(temp)  # Suponiendo que tienes un QLCDNumber llamado lcdTempMin
-            self.lcdHumMax.display(hum)   # Lo mismo para humedad
-            self.lcdHumMin.display(hum)
+            self.temp_stats.agregar(temp)
+            self.hum_stats.agregar(hum)
+            self.lcdTempMax.display(self.temp_stats.maximo)  # Suponiendo que tienes un QLCDNumber llamado lcdTempMax
+            self.lcdTempMin.display(self.temp_stats.minimo)  # Suponiendo que tienes un QLCDNumber llamado lcdTempMin
+            self.lcdHumMax.display(self.hum_stats.maximo)   # Lo mismo para humedad
+            self.lcdHumMin.display(self.hum_stats.minimo)
 
         except ValueError:
             print("Error al parsear los datos:", data)
@@ -0,0 +1,185 @@
+import bisect
+import os
+import socketserver
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Métricas de cada etapa de la ingesta (recepción, decodificación, parseo,
+# base de datos, señal Qt, dibujado) en formato de texto de Prometheus.
+#
+# Desactivadas por defecto: el código instrumentado comprueba metricas.activas
+# antes de medir nada, así el coste sin activarlas es una consulta de atributo.
+# Cada métrica se actualiza normalmente desde un solo hilo (el de su etapa);
+# no se usan locks para no frenar el camino caliente.
+
+activas = False
+
+# Límites de los histogramas de tiempo, en segundos (10 µs a 10 s)
+LIMITES_SEGUNDOS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_metricas = {}
+_lock = threading.Lock()
+
+
+def activar(valor=True):
+    global activas
+    activas = valor
+
+
+class Contador:
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.valor = 0
+
+    def sumar(self, n=1):
+        self.valor += n
+
+    def lineas(self):
+        yield f"{self.nombre} {self.valor}"
+
+
+class Indicador:
+    # Valor instantáneo; si se indica funcion se evalúa al leer las métricas
+    tipo = "gauge"
+
+    def __init__(self, nombre, ayuda, funcion=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.funcion = funcion
+        self.valor = 0
+
+    def fijar(self, valor):
+        self.valor = valor
+
+    def lineas(self):
+        valor = self.valor
+        if self.funcion is not None:
+            try:
+                valor = self.funcion()
+            except Exception:
+                valor = float("nan")
+        yield f"{self.nombre} {valor}"
+
+
+class Histograma:
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, limites=LIMITES_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.limites = tuple(limites)
+        self.cubos = [0] * (len(self.limites) + 1)  # El último es +Inf
+        self.suma = 0.0
+        self.n = 0
+
+    def observar(self, valor):
+        self.cubos[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.n += 1
+
+    def lineas(self):
+        acumulado = 0
+        for limite, cubo in zip(self.limites, self.cubos):
+            acumulado += cubo
+            yield f'{self.nombre}_bucket{{le="{limite:g}"}} {acumulado}'
+        yield f'{self.nombre}_bucket{{le="+Inf"}} {acumulado + self.cubos[-1]}'
+        yield f"{self.nombre}_sum {self.suma}"
+        yield f"{self.nombre}_count {self.n}"
+
+
+def _registrar(clase, nombre, *args):
+    # Devuelve la métrica ya registrada con ese nombre o crea una nueva
+    with _lock:
+        metrica = _metricas.get(nombre)
+        if metrica is None:
+            metrica = _metricas[nombre] = clase(nombre, *args)
+        return metrica
+
+
+def contador(nombre, ayuda):
+    return _registrar(Contador, nombre, ayuda)
+
+
+def histograma(nombre, ayuda, limites=LIMITES_SEGUNDOS):
+    return _registrar(Histograma, nombre, ayuda, limites)
+
+
+def indicador(nombre, ayuda, funcion=None):
+    metrica = _registrar(Indicador, nombre, ayuda)
+    if funcion is not None:
+        metrica.funcion = funcion
+    return metrica
+
+
+def texto():
+    # Todas las métricas en el formato de exposición de Prometheus
+    with _lock:
+        metricas = list(_metricas.values())
+    lineas = []
+    for metrica in metricas:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.lineas())
+    return "\n".join(lineas) + "\n"
+
+
+class _ManejadorHTTP(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        cuerpo = texto().encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, formato, *args):
+        pass  # Sin una línea por petición en la consola
+
+
+class _ManejadorUnix(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.wfile.write(texto().encode('utf-8'))
+
+
+def servir_http(puerto=9100, host="127.0.0.1"):
+    # Activa las métricas y las publica en http://host:puerto/metrics desde un
+    # hilo en segundo plano; devuelve el servidor (servidor.shutdown() lo detiene)
+    activar()
+    servidor = ThreadingHTTPServer((host, puerto), _ManejadorHTTP)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="Metricas", daemon=True).start()
+    print(f"Métricas en http://{host}:{servidor.server_address[1]}/metrics")
+    return servidor
+
+
+def servir_unix(ruta):
+    # Igual que servir_http, pero en un socket Unix: cada conexión recibe el
+    # texto de las métricas (p. ej. socat - UNIX-CONNECT:ruta)
+    activar()
+    if os.path.exists(ruta):
+        os.unlink(ruta)
+    servidor = socketserver.ThreadingUnixStreamServer(ruta, _ManejadorUnix)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="Metricas", daemon=True).start()
+    print("Métricas en el socket", ruta)
+    return servidor
+
+
+def publicar(destino):
+    # destino es un puerto TCP ("9100" o "host:9100") o la ruta de un socket Unix
+    if destino.isdigit():
+        return servir_http(int(destino))
+    host, _, puerto = destino.rpartition(":")
+    if puerto.isdigit() and "/" not in destino:
+        return servir_http(int(puerto), host or "127.0.0.1")
+    return servir_unix(destino)
@@ -0,0 +1,189 @@
+import re
+import sys
+import time
+
+from lectura import CANALES, Lectura, ahora_ms
+
+# Parseo de todos los formatos de mensaje de los ESP32:
+#   simple     "21.3,40.1"
+#   etiquetas  "Temperatura: 21.3°C, Humedad: 40.1%"
+#   claves     "T_Inst:21.3°C,T_Max:22.0°C,...,H_Avg:40.0%"
+# Un Parser detecta el formato con el primer mensaje de cada conexión y lo
+# recuerda (en claves, también el orden de las claves); solo vuelve a
+# detectarlo si un mensaje deja de encajar. Las unidades se ignoran, así que
+# da igual si el "°" llega bien, como "Â°" (UTF-8 leído como Latin-1) o como
+# carácter de reemplazo.
+
+SIMPLE = "simple"
+ETIQUETAS = "etiquetas"
+CLAVES = "claves"
+
+_NUM = r"([-+]?[\d.]+(?:[eE][-+]?\d+)?)"  # float() termina de validarlo
+_ETIQUETAS = re.compile(rf"\s*temperatura\s*:\s*{_NUM}[^,]*,\s*humedad\s*:\s*{_NUM}", re.I)
+_CLAVE = re.compile(r"\s*([A-Za-z_]+)\s*:")
+
+# Posición de cada campo dentro de Lectura (timestamp es el campo 0)
+_POSICION = {canal: 1 + i for i, canal in enumerate(CANALES)}
+_TEMPERATURA, _HUMEDAD = _POSICION["temperatura"], _POSICION["humedad"]
+_T_INST, _T_AVG = _POSICION["t_inst"], _POSICION["t_avg"]
+_H_INST, _H_AVG = _POSICION["h_inst"], _POSICION["h_avg"]
+
+_RESTO = (None,) * (len(Lectura._fields) - 4)  # Lo que sigue a temperatura y humedad, sin dispositivo
+_VACIA = (None,) * len(CANALES)
+_nueva = tuple.__new__
+
+# Diseños de mensajes con claves ya vistos: tupla de claves -> (patrón, posiciones, tramo)
+# tramo es el slice de Lectura cuando las claves ocupan posiciones seguidas.
+# Se comparte entre hilos: dos hilos pueden compilar el mismo diseño a la vez,
+# pero el resultado es idéntico y da igual cuál se quede
+_DISENOS = {}
+
+
+def reparar(texto):
+    # Deshace el texto UTF-8 que se decodificó como Latin-1 ("Â°C" -> "°C")
+    if "Ã" in texto or "Â" in texto:
+        try:
+            return texto.encode('latin-1').decode('utf-8')
+        except UnicodeError:
+            pass
+    return texto
+
+
+def _diseno(mensaje):
+    # Patrón precompilado para el orden de claves de este mensaje
+    claves = tuple(c.lower() for c in _CLAVE.findall(mensaje))
+    if not claves or len(claves) != mensaje.count(":") or any(c not in _POSICION for c in claves):
+        return None
+    diseno = _DISENOS.get(claves)
+    if diseno is None:
+        patron = r"[^,]*+,".join(rf"\s*{re.escape(c)}\s*:\s*{_NUM}" for c in claves)
+        posiciones = tuple(_POSICION[c] for c in claves)
+        tramo = None
+        if posiciones == tuple(range(posiciones[0], posiciones[0] + len(posiciones))):
+            tramo = slice(posiciones[0], posiciones[0] + len(posiciones))
+        diseno = _DISENOS[claves] = (re.compile(patron, re.I), posiciones, tramo)
+    return diseno
+
+
+def detectar(mensaje):
+    # Devuelve (formato, diseño) o (None, None) si no se reconoce
+    if ":" not in mensaje:
+        return (SIMPLE, None) if mensaje.count(",") == 1 else (None, None)
+    if _ETIQUETAS.match(mensaje):
+        return ETIQUETAS, None
+    diseno = _diseno(mensaje)
+    return (CLAVES, diseno) if diseno is not None else (None, None)
+
+
+class Parser:
+    # Un Parser por conexión (o por ESP32); no es necesario compartirlo entre hilos
+    def __init__(self, dispositivo=None):
+        self.formato = None
+        self._diseno = None
+        self.identificar(dispositivo)
+
+        # Contadores
+        self.mensajes = 0
+        self.detecciones = 0
+        self.errores = 0
+
+    def identificar(self, dispositivo):
+        # Nombre del dispositivo con el que se etiquetan las Lecturas
+        self.dispositivo = dispositivo
+        self._resto = _RESTO + (dispositivo,)
+
+    def parsear(self, mensaje, timestamp=None):
+        # Convierte un mensaje en una Lectura; si no se reconoce, la Lectura
+        # no tiene valores y datos guarda el texto original
+        if timestamp is None:
+            timestamp = ahora_ms()
+        self.mensajes += 1
+        if self.formato is not None:
+            lectura = self._parsear(self.formato, self._diseno, mensaje, timestamp)
+            if lectura is not None:
+                return lectura
+
+        # Primer mensaje o cambio de formato
+        formato, diseno = detectar(mensaje)
+        if formato is not None:
+            lectura = self._parsear(formato, diseno, mensaje, timestamp)
+            if lectura is not None:
+                self.formato, self._diseno = formato, diseno
+                self.detecciones += 1
+                return lectura
+        self.errores += 1
+        return _nueva(Lectura, (timestamp,) + _VACIA + (reparar(mensaje), self.dispositivo))
+
+    def _parsear(self, formato, diseno, mensaje, timestamp):
+        try:
+            if formato == SIMPLE:
+                temperatura, humedad = mensaje.split(",")
+                return _nueva(Lectura, (timestamp, float(temperatura), float(humedad)) + self._resto)
+
+            if formato == ETIQUETAS:
+                encontrado = _ETIQUETAS.match(mensaje)
+                if encontrado is None:
+                    return None
+                return _nueva(Lectura, (timestamp, float(encontrado[1]), float(encontrado[2])) + self._resto)
+
+            patron, posiciones, tramo = diseno
+            encontrado = patron.match(mensaje)
+            if encontrado is None or mensaje.count(":") != len(posiciones):
+                return None
+            campos = [timestamp, *_VACIA, None, self.dispositivo]
+            if tramo is not None:
+                campos[tramo] = map(float, encontrado.groups())
+            else:
+                for posicion, valor in zip(posiciones, encontrado.groups()):
+                    campos[posicion] = float(valor)
+            # Valor instantáneo o, en las placas antiguas, el promedio
+            if campos[_TEMPERATURA] is None:
+                campos[_TEMPERATURA] = campos[_T_INST] if campos[_T_INST] is not None else campos[_T_AVG]
+            if campos[_HUMEDAD] is None:
+                campos[_HUMEDAD] = campos[_H_INST] if campos[_H_INST] is not None else campos[_H_AVG]
+            return _nueva(Lectura, campos)
+        except ValueError:
+            return None
+
+    def estadisticas(self):
+        return {
+            "formato": self.formato,
+            "mensajes": self.mensajes,
+            "detecciones": self.detecciones,
+            "errores": self.errores,
+        }
+
+
+# Llamadas sueltas, sin conexión asociada: cada una usa su propio Parser
+# (detecta el formato en cada mensaje), así que se pueden hacer desde
+# cualquier hilo. Para un flujo de mensajes es más rápido un Parser propio.
+def parsear(mensaje, timestamp=None):
+    return Parser().parsear(mensaje, timestamp)
+
+
+def temperatura_humedad(mensaje):
+    # (temperatura, humedad) de cualquier formato; ValueError si no se reconoce
+    lectura = Parser().parsear(mensaje, 0)
+    if lectura.temperatura is None or lectura.humedad is None:
+        raise ValueError(f"Mensaje no reconocido: {mensaje!r}")
+    return lectura.temperatura, lectura.humedad
+
+
+# Mide la velocidad de parseo de cada formato:
+#   python parseo.py [mensajes]
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    ejemplos = {
+        SIMPLE: "21.37,40.12",
+        ETIQUETAS: "Temperatura: 21.37°C, Humedad: 40.12%",
+        ETIQUETAS + " (Â°C)": "Temperatura: 21.37Â°C, Humedad: 40.12%",
+        CLAVES: ("T_Inst:21.37°C,T_Max:22.00°C,T_Min:20.10°C,T_Avg:21.20°C,"
+                 "H_Inst:40.12%,H_Max:42.00%,H_Min:39.00%,H_Avg:40.50%"),
+    }
+    for nombre, mensaje in ejemplos.items():
+        parser = Parser()
+        t0 = time.perf_counter()
+        for _ in range(n):
+            parser.parsear(mensaje, 0)
+        segundos = time.perf_counter() - t0
+        print(f"{nombre:>18}: {n / segundos:10.0f} mensajes/s  {parser.parsear(mensaje, 0)[:4]}")
@@ -0,0 +1,253 @@
+import calendar
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from esquema import crear_tabla_sensores, sql_insertar
+from lectura import ahora_ms
+
+log = logging.getLogger(__name__)
+
+# Almacenamiento particionado por tiempo: las filas de sensores se guardan en
+# un archivo SQLite por día o por mes junto a la base de datos principal
+# (datos_sensores.db -> datos_sensores.2024-05.db). La principal conserva los
+# agregados, la tabla retencion y el catálogo de particiones, con el rango de
+# timestamps que contiene cada archivo.
+#
+# Pasado el periodo (más gracia), una partición se cierra: se vuelca su WAL y
+# no se vuelve a escribir en ella, así que se puede copiar, archivar o borrar
+# entera. Las filas que llegan tarde para una partición cerrada se guardan en
+# la partición actual; el catálogo registra su timestamp, de modo que las
+# consultas siguen encontrándolas.
+#
+# Las consultas adjuntan (ATTACH) solo las particiones que solapan el rango
+# pedido y leen la unión de sus tablas sensores y la de la base de datos
+# principal (filas anteriores a activar las particiones).
+
+PERIODOS = ("dia", "mes")
+DIA = 24 * 60 * 60 * 1000
+
+# SQLite admite 10 bases de datos adjuntas por conexión (SQLITE_MAX_ATTACHED)
+MAX_ADJUNTAS = 8
+
+
+def periodo(timestamp, tipo="mes"):
+    # (inicio, fin) en ms del día o mes UTC que contiene timestamp
+    if tipo == "dia":
+        inicio = timestamp - timestamp % DIA
+        return inicio, inicio + DIA
+    fecha = time.gmtime(timestamp / 1000)
+    anio, mes = fecha.tm_year, fecha.tm_mon
+    inicio = calendar.timegm((anio, mes, 1, 0, 0, 0)) * 1000
+    anio, mes = (anio + 1, 1) if mes == 12 else (anio, mes + 1)
+    return inicio, calendar.timegm((anio, mes, 1, 0, 0, 0)) * 1000
+
+
+def nombre_archivo(db_filename, inicio, tipo="mes"):
+    formato = "%Y-%m-%d" if tipo == "dia" else "%Y-%m"
+    ruta = Path(db_filename)
+    return f"{ruta.stem}.{time.strftime(formato, time.gmtime(inicio / 1000))}{ruta.suffix}"
+
+
+def ruta(db_filename, archivo):
+    # Los archivos del catálogo son relativos a la carpeta de la base de datos principal
+    return str(Path(db_filename).resolve().parent / archivo)
+
+
+def crear_catalogo(conn):
+    # desde/hasta: primer timestamp y último + 1 de las filas guardadas
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS particiones (
+            archivo TEXT PRIMARY KEY,
+            inicio INTEGER NOT NULL,
+            fin INTEGER NOT NULL,
+            desde INTEGER,
+            hasta INTEGER,
+            cerrada INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+
+def solapadas(conn, desde=None, hasta=None):
+    # [(archivo, desde, hasta, cerrada)] de las particiones con filas en
+    # [desde, hasta), por orden de periodo; [] si la base de datos no usa particiones
+    try:
+        return conn.execute('''
+            SELECT archivo, desde, hasta, cerrada FROM particiones
+            WHERE desde IS NOT NULL AND desde < ? AND hasta > ?
+            ORDER BY inicio
+        ''', (hasta if hasta is not None else 2 ** 62, desde if desde is not None else -2 ** 62)).fetchall()
+    except sqlite3.OperationalError:
+        return []
+
+
+def rango(conn):
+    # (primer timestamp, último timestamp) de todas las particiones, o None
+    try:
+        desde, hasta = conn.execute("SELECT MIN(desde), MAX(hasta) FROM particiones").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return None if desde is None else (desde, hasta - 1)
+
+
+def _principal(conn):
+    # Ruta de la base de datos principal de la conexión
+    for _, nombre, archivo in conn.execute("PRAGMA database_list"):
+        if nombre == "main":
+            return archivo
+
+
+@contextmanager
+def adjuntar(conn, desde=None, hasta=None):
+    # Adjunta las particiones que solapan [desde, hasta) y devuelve la
+    # expresión que sustituye a "sensores" en el FROM de una consulta.
+    # conn no debe tener una transacción abierta.
+    db_filename = _principal(conn)
+    archivos = [fila[0] for fila in solapadas(conn, desde, hasta)]
+    if len(archivos) > MAX_ADJUNTAS:
+        raise ValueError(f"El rango abarca {len(archivos)} particiones (máximo {MAX_ADJUNTAS}); "
+                         f"hay que consultarlo por partes")
+    adjuntas = []
+    try:
+        for i, archivo in enumerate(archivos):
+            if not os.path.exists(ruta(db_filename, archivo)):
+                continue  # Archivada o borrada fuera de retencion.py
+            conn.execute(f"ATTACH DATABASE ? AS p{i}", (ruta(db_filename, archivo),))
+            adjuntas.append(f"p{i}")
+        if not adjuntas:
+            yield "sensores"
+        else:
+            yield "(" + " UNION ALL ".join(
+                f"SELECT * FROM {esquema}.sensores" for esquema in ["main"] + adjuntas) + ")"
+    finally:
+        for esquema in adjuntas:
+            conn.execute(f"DETACH DATABASE {esquema}")
+
+
+def archivos(conn, desde=None, hasta=None):
+    # Rutas de la base de datos principal y de las particiones con filas en
+    # [desde, hasta), para recorrerlas una a una (p. ej. exportar.py)
+    db_filename = _principal(conn)
+    rutas = [db_filename]
+    for archivo, _, _, _ in solapadas(conn, desde, hasta):
+        if os.path.exists(ruta(db_filename, archivo)):
+            rutas.append(ruta(db_filename, archivo))
+    return rutas
+
+
+class EscrituraParticionada:
+    # Lado del escritor (EscritorDB): reparte cada lote entre las particiones
+    # adjuntas a su conexión. Solo la usa el hilo escritor.
+    def __init__(self, db_filename, tipo="mes", gracia=DIA, synchronous="NORMAL"):
+        if tipo not in PERIODOS:
+            raise ValueError(f"Periodo de partición desconocido: {tipo!r}")
+        self.db_filename = db_filename
+        self.tipo = tipo
+        self.gracia = gracia
+        self.synchronous = synchronous
+        self._adjuntas = {}  # inicio del periodo -> (esquema, archivo, fin)
+        self._revision = 0
+
+    def preparar(self, conn):
+        crear_catalogo(conn)
+        # Las particiones de versiones anteriores reciben las columnas e índices nuevos
+        for (archivo,) in conn.execute("SELECT archivo FROM particiones").fetchall():
+            destino = ruta(self.db_filename, archivo)
+            if os.path.exists(destino):
+                particion = sqlite3.connect(destino, isolation_level=None)
+                try:
+                    crear_tabla_sensores(particion)
+                finally:
+                    particion.close()
+        self.cerrar_vencidas(conn)
+
+    def repartir(self, conn, lote, ahora=None):
+        # Agrupa el lote por partición y adjunta las que falten; se llama
+        # antes de BEGIN (ATTACH no se puede ejecutar dentro de una transacción)
+        ahora = ahora_ms() if ahora is None else ahora
+        actual = None
+        grupos = {}
+        for lectura in lote:
+            inicio, fin = periodo(lectura.timestamp, self.tipo)
+            if fin + self.gracia <= ahora:
+                # Partición cerrada: la fila va a la actual
+                if actual is None:
+                    actual = periodo(ahora, self.tipo)
+                inicio, fin = actual
+            grupo = grupos.get(inicio)
+            if grupo is None:
+                grupo = grupos[inicio] = (fin, [])
+            grupo[1].append(lectura)
+        return [(self._adjuntar(conn, inicio, fin), inicio, fin, filas)
+                for inicio, (fin, filas) in grupos.items()]
+
+    def insertar(self, conn, grupos):
+        # Dentro de la transacción del lote: filas y rango en el catálogo
+        for (esquema, archivo), inicio, fin, filas in grupos:
+            conn.executemany(sql_insertar(f"{esquema}.sensores"), filas)
+            timestamps = [lectura.timestamp for lectura in filas]
+            conn.execute('''
+                INSERT INTO main.particiones (archivo, inicio, fin, desde, hasta) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(archivo) DO UPDATE SET
+                    desde = min(coalesce(desde, excluded.desde), excluded.desde),
+                    hasta = max(coalesce(hasta, excluded.hasta), excluded.hasta)
+            ''', (archivo, inicio, fin, min(timestamps), max(timestamps) + 1))
+
+    def _adjuntar(self, conn, inicio, fin):
+        adjunta = self._adjuntas.get(inicio)
+        if adjunta is not None:
+            return adjunta[:2]
+        archivo = nombre_archivo(self.db_filename, inicio, self.tipo)
+        nueva = sqlite3.connect(ruta(self.db_filename, archivo), isolation_level=None)
+        try:
+            nueva.execute("PRAGMA journal_mode=WAL")
+            crear_tabla_sensores(nueva)
+        finally:
+            nueva.close()
+        esquema = f"p{time.strftime('%Y%m%d', time.gmtime(inicio / 1000))}"
+        conn.execute(f"ATTACH DATABASE ? AS {esquema}", (ruta(self.db_filename, archivo),))
+        conn.execute(f"PRAGMA {esquema}.synchronous={self.synchronous}")
+        conn.execute('''
+            INSERT INTO main.particiones (archivo, inicio, fin) VALUES (?, ?, ?)
+            ON CONFLICT(archivo) DO UPDATE SET cerrada = 0
+        ''', (archivo, inicio, fin))
+        self._adjuntas[inicio] = (esquema, archivo, fin)
+        log.info("Partición %s abierta", archivo)
+        return esquema, archivo
+
+    def cerrar_vencidas(self, conn, ahora=None):
+        # Cierra las particiones cuyo periodo terminó hace más de gracia; se
+        # llama después del COMMIT, como mucho una vez por minuto
+        ahora = ahora_ms() if ahora is None else ahora
+        if ahora < self._revision:
+            return
+        self._revision = ahora + 60 * 1000
+        for inicio, (esquema, _, fin) in list(self._adjuntas.items()):
+            if fin + self.gracia <= ahora:
+                conn.execute(f"DETACH DATABASE {esquema}")
+                del self._adjuntas[inicio]
+        vencidas = conn.execute("SELECT archivo FROM particiones WHERE cerrada = 0 AND fin + ? <= ?",
+                                (self.gracia, ahora)).fetchall()
+        for (archivo,) in vencidas:
+            self._cerrar(conn, archivo)
+
+    def _cerrar(self, conn, archivo):
+        # Un solo archivo, sin WAL: se puede copiar o mover tal cual
+        destino = ruta(self.db_filename, archivo)
+        if os.path.exists(destino):
+            particion = sqlite3.connect(destino, isolation_level=None)
+            try:
+                particion.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                particion.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                particion.close()
+        conn.execute("UPDATE particiones SET cerrada = 1 WHERE archivo = ?", (archivo,))
+        log.info("Partición %s cerrada", archivo)
+
+    def cerrar(self, conn):
+        for esquema, _, _ in self._adjuntas.values():
+            conn.execute(f"DETACH DATABASE {esquema}")
+        self._adjuntas.clear()
@@ -0,0 +1,201 @@
+import re
+import struct
+
+import numpy as np
+
+from lectura import CANALES, Lectura, ahora_ms
+
+# Protocolo binario opcional para los ESP32 con muchas lecturas por segundo.
+#
+# El ESP32 lo pide con una línea de texto como primer mensaje de la conexión:
+#     HELLO BIN1 temperatura,humedad\n
+# y el servidor responde "OK BIN1\n" (o "ERR <motivo>\n" si no lo acepta, en
+# cuyo caso la conexión sigue en modo texto). A partir de la respuesta cada
+# lectura es un registro de tamaño fijo, little-endian y sin separadores:
+#     uint32 secuencia | uint32 timestamp del ESP32 (ms, millis()) | float32 x canales
+# Un canal sin valor se envía como NaN. Los ESP32 que no envían el saludo
+# siguen usando el formato de texto de siempre.
+#
+# El servidor no confirma cada registro: cuando los registros ya están
+# guardados en la base de datos responde "ACK <secuencia>\n" con la última
+# secuencia guardada (todas las anteriores también lo están), cada cierto
+# número de registros o de tiempo. El ESP32 puede tener muchas lecturas en
+# vuelo y reenviar desde el último ACK si se pierde la conexión. Si falta
+# algún registro, se descartan los posteriores: el servidor confirma lo
+# anterior al hueco y cierra la conexión, y el ESP32 reenvía desde ahí en la
+# siguiente (el primer registro de una conexión nunca se toma como hueco).
+#
+# En el saludo el ESP32 puede dar también su nombre, con el que se guardan
+# sus lecturas (ver dispositivos.py) en lugar de con su dirección IP:
+#     HELLO BIN1 temperatura,humedad esp32-cocina\n
+# Un ESP32 de texto puede identificarse sin cambiar de protocolo con
+#     HELLO ID esp32-cocina\n
+# y el servidor responde "OK ID\n".
+
+SALUDO = b"HELLO"
+VERSION = "BIN1"
+IDENTIFICACION = "ID"
+RESPUESTA_OK = f"OK {VERSION}\n".encode('utf-8')
+RESPUESTA_ID = f"OK {IDENTIFICACION}\n".encode('utf-8')
+_NOMBRE = re.compile(r"[\w.:-]{1,64}$")
+
+# Si el reloj del ESP32 retrocede más que esto (reinicio o desbordamiento de
+# millis()), se vuelve a calcular su desfase con el reloj del servidor
+_SALTO_RELOJ_MS = 1000
+
+# Posiciones dentro de Lectura (timestamp es el campo 0)
+_TEMPERATURA, _HUMEDAD = 1 + CANALES.index("temperatura"), 1 + CANALES.index("humedad")
+_T_INST, _H_INST = 1 + CANALES.index("t_inst"), 1 + CANALES.index("h_inst")
+
+
+def es_saludo(trama):
+    return bytes(trama[:len(SALUDO)]) == SALUDO
+
+
+def formato_registro(canales):
+    return struct.Struct("<II" + "f" * len(canales))
+
+
+def codificar(secuencia, timestamp, valores, formato):
+    # Empaqueta una lectura (para clientes de prueba y simuladores)
+    return formato.pack(secuencia & 0xFFFFFFFF, timestamp & 0xFFFFFFFF,
+                        *[float("nan") if v is None else v for v in valores])
+
+
+def saludo(canales, dispositivo=None):
+    nombre = f" {dispositivo}" if dispositivo else ""
+    return f"HELLO {VERSION} {','.join(canales)}{nombre}\n".encode('utf-8')
+
+
+def identificacion(dispositivo):
+    return f"HELLO {IDENTIFICACION} {dispositivo}\n".encode('utf-8')
+
+
+def _nombre(texto):
+    if not _NOMBRE.match(texto):
+        raise ValueError(f"nombre de dispositivo no válido: {texto}")
+    return texto
+
+
+def negociar(trama):
+    # Interpreta el saludo y devuelve (DecodificadorBinario de la conexión, o
+    # None si solo se identifica; nombre del dispositivo o None); lanza
+    # ValueError si la versión, los canales o el nombre no son válidos
+    partes = str(trama, 'utf-8', 'replace').split()
+    if len(partes) == 3 and partes[1] == IDENTIFICACION:
+        return None, _nombre(partes[2])
+    if len(partes) not in (3, 4) or partes[1] != VERSION:
+        raise ValueError(f"versión no soportada: {' '.join(partes[1:2])}")
+    canales = tuple(c.strip().lower() for c in partes[2].split(","))
+    desconocidos = [c for c in canales if c not in CANALES]
+    if desconocidos or len(set(canales)) != len(canales):
+        raise ValueError(f"canales no válidos: {partes[2]}")
+    nombre = _nombre(partes[3]) if len(partes) == 4 else None
+    return DecodificadorBinario(canales, nombre), nombre
+
+
+class DecodificadorBinario:
+    # Convierte bloques de registros binarios en Lecturas con NumPy, todos los
+    # registros de un bloque a la vez. El timestamp del ESP32 se traslada al
+    # reloj del servidor con el menor desfase observado (el de menor latencia).
+    def __init__(self, canales, dispositivo=None):
+        self.canales = canales
+        self.dispositivo = dispositivo  # Nombre con el que se etiquetan las Lecturas
+        self.formato = formato_registro(canales)
+        self.tamano_registro = self.formato.size
+        self.dtype = np.dtype([
+            ("secuencia", "<u4"),
+            ("timestamp", "<u4"),
+            ("valores", "<f4", (len(canales),)),
+        ])
+        # Posición de cada canal recibido dentro de los campos de Lectura
+        self._posiciones = [1 + CANALES.index(c) for c in canales]
+        self._desfase = None
+        self._ultimo_ts = None
+        self.ultima_secuencia = None  # Última recibida, aunque se haya descartado
+        # Última secuencia aceptada, sin huecos desde el inicio de la conexión.
+        # Tras un hueco no se aceptan más registros (decodificar devuelve [])
+        # y el ESP32 los reenvía en su próxima conexión.
+        self.contigua = None
+        self.hueco = False
+
+        # Contadores
+        self.registros = 0
+        self.perdidos = 0
+
+    def decodificar(self, bloque, recibido_ms=None):
+        registros = np.frombuffer(bloque, dtype=self.dtype)
+        if not len(registros):
+            return []
+        if self.hueco:
+            self.ultima_secuencia = int(registros["secuencia"][-1])
+            return []
+        registros = registros[:self._hasta_el_hueco(registros["secuencia"])]
+        if not len(registros):
+            return []
+        if recibido_ms is None:
+            recibido_ms = ahora_ms()
+
+        dispositivo = registros["timestamp"].astype(np.int64)
+        self.registros += len(registros)
+
+        # Reloj del ESP32 -> ms desde epoch del servidor
+        if self._ultimo_ts is not None and dispositivo[0] < self._ultimo_ts - _SALTO_RELOJ_MS:
+            self._desfase = None
+        desfase = recibido_ms - int(dispositivo[-1])
+        if self._desfase is None or desfase < self._desfase:
+            self._desfase = desfase
+        self._ultimo_ts = int(dispositivo[-1])
+        timestamps = (dispositivo + self._desfase).tolist()
+
+        # NaN -> None para que SQLite guarde NULL
+        valores = registros["valores"].astype(np.float64)
+        nulos = np.isnan(valores)
+        valores = valores.astype(object)
+        valores[nulos] = None
+
+        lecturas = []
+        vacia = [None] * len(Lectura._fields)
+        vacia[-1] = self.dispositivo
+        posiciones = self._posiciones
+        for timestamp, fila in zip(timestamps, valores.tolist()):
+            campos = vacia[:]
+            campos[0] = timestamp
+            for posicion, valor in zip(posiciones, fila):
+                campos[posicion] = valor
+            # Igual que en el texto, temperatura/humedad usan el valor instantáneo
+            if campos[_TEMPERATURA] is None:
+                campos[_TEMPERATURA] = campos[_T_INST]
+            if campos[_HUMEDAD] is None:
+                campos[_HUMEDAD] = campos[_H_INST]
+            lecturas.append(Lectura._make(campos))
+        return lecturas
+
+    def _hasta_el_hueco(self, secuencias):
+        # Devuelve cuántos registros del bloque van antes del primer hueco en
+        # la secuencia (uint32, con desbordamiento); saltos[i] es el salto
+        # hasta secuencias[i]
+        anterior = secuencias[0] if self.contigua is None else np.uint32(self.contigua)
+        self.ultima_secuencia = int(secuencias[-1])
+        saltos = np.diff(secuencias, prepend=anterior).astype(np.uint32)
+        es_hueco = (saltos > 1) & (saltos < 0x80000000)
+        if not es_hueco.any():
+            self.contigua = int(secuencias[-1])
+            return len(secuencias)
+        primero = int(np.argmax(es_hueco))
+        self.perdidos += int(saltos[primero]) - 1
+        self.hueco = True
+        if primero:
+            self.contigua = int(secuencias[primero - 1])
+        return primero
+
+    def estadisticas(self):
+        return {
+            "canales": self.canales,
+            "dispositivo": self.dispositivo,
+            "registros": self.registros,
+            "perdidos": self.perdidos,
+            "ultima_secuencia": self.ultima_secuencia,
+            "contigua": self.contigua,
+            "desfase_ms": self._desfase,
+        }
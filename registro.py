@@ -0,0 +1,143 @@
+import atexit
+import logging
+import queue
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+import metricas
+
+# Registro de mensajes sin bloquear la ingesta: los hilos que reciben datos
+# solo encolan el registro (sin formatearlo) en una cola acotada y un hilo en
+# segundo plano lo formatea y escribe en la consola o en un archivo. Si la
+# cola se llena, los mensajes se descartan en lugar de esperar. Cada tipo de
+# mensaje (logger + plantilla) tiene además un límite de tasa.
+
+FORMATO = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener = None
+_manejador = None
+_limitador = None
+
+
+class _ManejadorCola(QueueHandler):
+    def __init__(self, cola):
+        super(_ManejadorCola, self).__init__(cola)
+        self.descartados = 0
+
+    def prepare(self, record):
+        # Se formatea en el hilo de escritura, no en el que genera el mensaje
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.descartados += 1
+
+
+class LimitadorTasa(logging.Filter):
+    # Cubeta de fichas por tipo de mensaje: como mucho rafaga mensajes seguidos
+    # y por_segundo de media. Con muestreo > 1 solo pasa uno de cada muestreo
+    # mensajes de cada tipo antes de aplicar el límite. Los mensajes suprimidos
+    # se cuentan y se indican en el siguiente mensaje de ese tipo que pasa.
+    # Los mensajes de nivel nivel_exento o superior no se limitan.
+    def __init__(self, por_segundo=10.0, rafaga=20, muestreo=1, nivel_exento=logging.CRITICAL,
+                 max_tipos=1000):
+        super(LimitadorTasa, self).__init__()
+        self.por_segundo = por_segundo
+        self.rafaga = rafaga
+        self.muestreo = muestreo
+        self.nivel_exento = nivel_exento
+        self.max_tipos = max_tipos
+        self._tipos = {}  # (logger, plantilla) -> [fichas, último, suprimidos, vistos]
+        self._lock = threading.Lock()
+        self.suprimidos = 0
+
+    def filter(self, record):
+        if record.levelno >= self.nivel_exento:
+            return True
+        clave = (record.name, record.msg)
+        ahora = time.monotonic()
+        with self._lock:
+            estado = self._tipos.get(clave)
+            if estado is None:
+                if len(self._tipos) >= self.max_tipos:
+                    self._tipos.clear()
+                estado = self._tipos[clave] = [self.rafaga, ahora, 0, 0]
+            estado[3] += 1
+            fichas = min(self.rafaga, estado[0] + (ahora - estado[1]) * self.por_segundo)
+            estado[1] = ahora
+            if (self.muestreo > 1 and estado[3] % self.muestreo != 1) or fichas < 1:
+                estado[0] = fichas
+                estado[2] += 1
+                self.suprimidos += 1
+                return False
+            estado[0] = fichas - 1
+            record.suprimidos = estado[2]
+            estado[2] = 0
+        return True
+
+
+class _Formato(logging.Formatter):
+    def format(self, record):
+        texto = super(_Formato, self).format(record)
+        suprimidos = getattr(record, "suprimidos", 0)
+        if suprimidos:
+            texto += f" (+{suprimidos} mensajes similares suprimidos)"
+        return texto
+
+
+def configurar(nivel="INFO", por_segundo=10.0, rafaga=20, muestreo=1, max_cola=10000,
+               archivo=None):
+    # Configura el logger raíz; se puede llamar de nuevo para cambiar la configuración
+    global _listener, _manejador, _limitador
+    detener()
+
+    formato = _Formato(FORMATO)
+    destinos = [logging.StreamHandler(sys.stderr)]
+    if archivo:
+        destinos.append(logging.FileHandler(archivo, encoding='utf-8'))
+    for destino in destinos:
+        destino.setFormatter(formato)
+
+    _limitador = LimitadorTasa(por_segundo, rafaga, muestreo)
+    _manejador = _ManejadorCola(queue.Queue(max_cola))
+    _manejador.addFilter(_limitador)
+
+    raiz = logging.getLogger()
+    for manejador in list(raiz.handlers):
+        raiz.removeHandler(manejador)
+    raiz.addHandler(_manejador)
+    raiz.setLevel(nivel.upper() if isinstance(nivel, str) else nivel)
+
+    metricas.indicador("registro_descartados", "Mensajes de registro descartados por cola llena",
+                       lambda: _manejador.descartados)
+    metricas.indicador("registro_suprimidos", "Mensajes de registro suprimidos por el límite de tasa",
+                       lambda: _limitador.suprimidos)
+
+    _listener = QueueListener(_manejador.queue, *destinos)
+    _listener.start()
+    return _listener
+
+
+def detener():
+    # Escribe los mensajes pendientes y detiene el hilo de escritura
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for destino in _listener.handlers:
+            destino.close()
+        _listener = None
+
+
+def estadisticas():
+    return {
+        "descartados": _manejador.descartados if _manejador else 0,
+        "suprimidos": _limitador.suprimidos if _limitador else 0,
+        "pendientes": _manejador.queue.qsize() if _manejador else 0,
+    }
+
+
+atexit.register(detener)
@@ -0,0 +1,75 @@
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+
+import metricas
+
+_CUADRO = metricas.histograma("grafica_cuadro_segundos", "Dibujado de cada cuadro de la gráfica")
+
+
+class PlanificadorRender(QObject):
+    # Agrupa los redibujados de la gráfica: marcar_sucio() se llama con cada
+    # dato nuevo y dibujar() se ejecuta como máximo fps veces por segundo.
+    # Si no llegan datos nuevos no se redibuja nada.
+    def __init__(self, dibujar, fps=30, parent=None):
+        super(PlanificadorRender, self).__init__(parent)
+        self._dibujar = dibujar
+        self._sucio = False
+        self._ultimo = 0.0
+        self._temporizador = QTimer(self)
+        self._temporizador.setSingleShot(True)
+        self._temporizador.timeout.connect(self._render)
+        self.set_fps(fps)
+
+        # Tiempos medidos de cada cuadro
+        self.cuadros = 0
+        self.tiempo_cuadro_ms = 0.0     # Media móvil exponencial
+        self.tiempo_cuadro_max_ms = 0.0
+        self._cuadros_previos = 0
+        self._inicio_periodo = time.monotonic()
+
+    def set_fps(self, fps):
+        self.fps = fps
+        self._intervalo = 1.0 / fps
+
+    def marcar_sucio(self):
+        # Indica que hay datos nuevos; programa un cuadro si no hay uno pendiente
+        if self._sucio:
+            return
+        self._sucio = True
+        espera = self._intervalo - (time.monotonic() - self._ultimo)
+        self._temporizador.start(max(0, int(espera * 1000)))
+
+    def forzar(self):
+        # Redibuja inmediatamente (p. ej. tras cambiar el rango visible)
+        self._temporizador.stop()
+        self._sucio = True
+        self._render()
+
+    def _render(self):
+        if not self._sucio:
+            return
+        self._sucio = False
+        t0 = time.monotonic()
+        self._dibujar()
+        self._ultimo = time.monotonic()
+
+        if metricas.activas:
+            _CUADRO.observar(self._ultimo - t0)
+        duracion = (self._ultimo - t0) * 1000
+        self.cuadros += 1
+        self.tiempo_cuadro_ms = duracion if self.cuadros == 1 else 0.9 * self.tiempo_cuadro_ms + 0.1 * duracion
+        self.tiempo_cuadro_max_ms = max(self.tiempo_cuadro_max_ms, duracion)
+
+    def fps_medidos(self):
+        # Cuadros por segundo desde la última llamada
+        ahora = time.monotonic()
+        transcurrido = ahora - self._inicio_periodo
+        fps = (self.cuadros - self._cuadros_previos) / transcurrido if transcurrido > 0 else 0.0
+        self._cuadros_previos = self.cuadros
+        self._inicio_periodo = ahora
+        return fps
+
+    def resumen(self):
+        return (f"Gráfica: {self.fps_medidos():.0f} fps (máx. {self.fps}), "
+                f"cuadro {self.tiempo_cuadro_ms:.1f} ms, pico {self.tiempo_cuadro_max_ms:.1f} ms")
@@ -0,0 +1,318 @@
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+import agregados
+import metricas
+import particiones
+from esquema import crear_esquema, es_esquema_antiguo, podado_hasta
+from lectura import ahora_ms
+
+log = logging.getLogger(__name__)
+
+# Política de retención: cuánto tiempo (ms) se conserva cada tabla; None es
+# para siempre. "sensores" son las filas originales y el resto los niveles de
+# agregados.py, que se mantienen al insertar cada lote. Cada nivel debe
+# conservarse al menos tanto como el anterior, más fino.
+DIA = agregados.NIVELES["1d"]
+POLITICA = {
+    "sensores": 7 * DIA,
+    "1m": 90 * DIA,
+    "1h": None,
+    "1d": None,
+}
+_NIVEL_FINO = next(iter(agregados.NIVELES))
+
+_BORRADAS = metricas.contador("retencion_filas_borradas_total", "Filas borradas por la política de retención")
+_LIBERADAS = metricas.contador("retencion_paginas_liberadas_total", "Páginas devueltas al sistema por incremental_vacuum")
+_PASADA = metricas.histograma("retencion_pasada_segundos", "Duración de cada pasada de retención")
+
+
+def tabla(nivel):
+    return "sensores" if nivel == "sensores" else agregados.tabla(nivel)
+
+
+def _columna(nivel):
+    return "timestamp" if nivel == "sensores" else "bucket"
+
+
+def validar(politica):
+    anterior = 0
+    for nivel in ("sensores",) + tuple(agregados.NIVELES):
+        duracion = politica.get(nivel)
+        duracion = float("inf") if duracion is None else duracion
+        if duracion < anterior:
+            raise ValueError(f"El nivel {nivel} debe conservarse al menos tanto como el anterior")
+        anterior = duracion
+
+
+class Retencion:
+    # Aplica la política en un hilo en segundo plano, una pasada cada
+    # intervalo segundos. En cada pasada, por días completos y del más antiguo
+    # al más reciente:
+    #  1. Comprueba que los agregados del día cuentan todas sus filas
+    #     originales (si no, los recalcula) y anota el día como podado.
+    #  2. Borra las filas del día en transacciones de como mucho lote filas,
+    #     con una pausa entre ellas para no retener el bloqueo de escritura.
+    # Después hace lo mismo (sin el paso 1) con los niveles de agregados y
+    # devuelve al sistema las páginas libres con incremental_vacuum.
+    # Las particiones cerradas (ver particiones.py) cuyas filas son todas
+    # anteriores al corte se borran enteras, o se mueven a archivar_en; con
+    # particiones las filas originales se conservan hasta que lo es la
+    # partición completa, no día a día.
+    def __init__(self, db_filename, politica=None, intervalo=3600.0, espera_inicial=60.0,
+                 lote=5000, pausa=0.05, paginas_vacuum=1000, archivar_en=None):
+        self.db_filename = db_filename
+        self.archivar_en = archivar_en
+        self.politica = dict(POLITICA if politica is None else politica)
+        validar(self.politica)
+        self.intervalo = intervalo
+        self.espera_inicial = espera_inicial
+        self.lote = lote
+        self.pausa = pausa
+        self.paginas_vacuum = paginas_vacuum
+        self._detener = threading.Event()
+        self._hilo = None
+        self._aviso_vacuum = False
+
+        # Contadores
+        self.pasadas = 0
+        self.filas_borradas = 0
+        self.dias_recalculados = 0
+        self.paginas_liberadas = 0
+        self.particiones_retiradas = 0
+
+    def iniciar(self):
+        if self._hilo is not None:
+            return
+        log.info("Retención activa en %s: %s", self.db_filename, describir(self.politica))
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._ejecutar, name="Retencion", daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=5.0):
+        # Interrumpe la pasada en curso entre dos lotes
+        if self._hilo is None:
+            return
+        self._detener.set()
+        self._hilo.join(timeout)
+        self._hilo = None
+
+    def _ejecutar(self):
+        espera = self.espera_inicial
+        while not self._detener.wait(espera):
+            try:
+                self.pasada()
+            except Exception:
+                log.exception("Error al aplicar la política de retención")
+            espera = self.intervalo
+
+    def _conectar(self):
+        conn = sqlite3.connect(self.db_filename, isolation_level=None)
+        conn.execute("PRAGMA busy_timeout=5000")
+        if es_esquema_antiguo(conn):
+            conn.close()
+            return None  # La migra EscritorDB en su hilo
+        crear_esquema(conn)
+        agregados.crear_tablas(conn)
+        return conn
+
+    def pasada(self, ahora=None):
+        # Aplica la política una vez; ahora en ms (por defecto la hora actual)
+        ahora = ahora_ms() if ahora is None else ahora
+        t0 = time.perf_counter()
+        conn = self._conectar()
+        if conn is None:
+            log.info("%s aún tiene el esquema antiguo; retención aplazada", self.db_filename)
+            return
+        try:
+            for nivel, duracion in self.politica.items():
+                if duracion is None:
+                    continue
+                corte = ahora - duracion
+                corte -= corte % DIA
+                self._podar(conn, nivel, corte)
+                if nivel == "sensores":
+                    self._retirar_particiones(conn, corte)
+                if self._detener.is_set():
+                    return
+            self._vacuum(conn)
+        finally:
+            conn.close()
+        self.pasadas += 1
+        if metricas.activas:
+            _PASADA.observar(time.perf_counter() - t0)
+
+    def _podar(self, conn, nivel, corte):
+        nombre, columna = tabla(nivel), _columna(nivel)
+        podado = podado_hasta(conn, nombre)
+        if podado is not None and podado >= corte:
+            # Solo filas que llegaron tarde (con timestamp ya podado)
+            self._borrar(conn, nombre, columna, podado)
+            return
+        primero = conn.execute(f"SELECT MIN({columna}) FROM {nombre}").fetchone()[0]
+        if primero is None or primero >= corte:
+            self._anotar(conn, nombre, corte)
+            return
+        inicio = primero - primero % DIA
+        if podado is not None:
+            self._borrar(conn, nombre, columna, podado)
+            inicio = max(inicio, podado)
+
+        for dia in range(inicio, corte, DIA):
+            # Los agregados también cuentan las filas del día guardadas en particiones
+            with particiones.adjuntar(conn, dia, dia + DIA) as sensores:
+                conn.execute("BEGIN IMMEDIATE")
+                if nivel == "sensores":
+                    self._asegurar_agregados(conn, dia, dia + DIA, sensores)
+                self._anotar(conn, nombre, dia + DIA)
+                conn.execute("COMMIT")
+            if not self._borrar(conn, nombre, columna, dia + DIA):
+                return
+        log.info("Retención: %s podada hasta %s", nombre, time.strftime("%Y-%m-%d", time.gmtime(corte / 1000)))
+
+    def _asegurar_agregados(self, conn, inicio, fin, sensores="sensores"):
+        # Los agregados se actualizan al insertar, pero una base de datos
+        # anterior a ellos (o un fallo) puede dejarlos incompletos
+        filas = conn.execute(f"SELECT COUNT(*) FROM {sensores} WHERE timestamp >= ? AND timestamp < ?",
+                             (inicio, fin)).fetchone()[0]
+        contadas = conn.execute(
+            f"SELECT COALESCE(SUM(n), 0) FROM {agregados.tabla(_NIVEL_FINO)} WHERE bucket >= ? AND bucket < ?",
+            (inicio, fin)).fetchone()[0]
+        if filas != contadas:
+            agregados.reconstruir_intervalo(conn, inicio, fin, sensores)
+            self.dias_recalculados += 1
+
+    def _retirar_particiones(self, conn, corte):
+        for archivo, _, hasta, cerrada in particiones.solapadas(conn, None, corte):
+            if not cerrada or hasta > corte:
+                continue
+            ruta = particiones.ruta(self.db_filename, archivo)
+            if os.path.exists(ruta):
+                if self.archivar_en is not None:
+                    os.makedirs(self.archivar_en, exist_ok=True)
+                    shutil.move(ruta, os.path.join(self.archivar_en, archivo))
+                else:
+                    os.remove(ruta)
+            for sufijo in ("-wal", "-shm"):
+                if os.path.exists(ruta + sufijo):
+                    os.remove(ruta + sufijo)
+            conn.execute("DELETE FROM particiones WHERE archivo = ?", (archivo,))
+            self.particiones_retiradas += 1
+            log.info("Retención: partición %s %s", archivo,
+                     "archivada" if self.archivar_en is not None else "borrada")
+
+    @staticmethod
+    def _anotar(conn, nombre, hasta):
+        conn.execute('''
+            INSERT INTO retencion (tabla, podado_hasta) VALUES (?, ?)
+            ON CONFLICT(tabla) DO UPDATE SET podado_hasta = max(podado_hasta, excluded.podado_hasta)
+        ''', (nombre, hasta))
+
+    def _borrar(self, conn, nombre, columna, hasta):
+        # Borra por lotes las filas anteriores a hasta; False si se pidió detener
+        clave = "id" if nombre == "sensores" else "rowid"
+        sql = f'''
+            DELETE FROM {nombre} WHERE {clave} IN (
+                SELECT {clave} FROM {nombre} WHERE {columna} < ? ORDER BY {columna} LIMIT ?)
+        '''
+        while True:
+            borradas = conn.execute(sql, (hasta, self.lote)).rowcount
+            self.filas_borradas += borradas
+            if metricas.activas:
+                _BORRADAS.sumar(borradas)
+            if borradas < self.lote:
+                return True
+            if self._detener.wait(self.pausa):
+                return False
+
+    def _vacuum(self, conn):
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if not self._aviso_vacuum:
+                log.warning("%s no usa auto_vacuum=INCREMENTAL: el archivo no se reduce al borrar "
+                            "(python retencion.py %s --convertir)", self.db_filename, self.db_filename)
+                self._aviso_vacuum = True
+            return
+        libres = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while libres and not self._detener.is_set():
+            # executescript recorre todos los pasos del PRAGMA (execute solo el primero)
+            conn.executescript(f"PRAGMA incremental_vacuum({self.paginas_vacuum});")
+            quedan = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            paginas, libres = libres - quedan, quedan
+            if paginas <= 0:
+                return
+            self.paginas_liberadas += paginas
+            if metricas.activas:
+                _LIBERADAS.sumar(paginas)
+            self._detener.wait(self.pausa)
+
+    def estadisticas(self):
+        return {
+            "pasadas": self.pasadas,
+            "filas_borradas": self.filas_borradas,
+            "dias_recalculados": self.dias_recalculados,
+            "paginas_liberadas": self.paginas_liberadas,
+            "particiones_retiradas": self.particiones_retiradas,
+        }
+
+
+def convertir(db_filename):
+    # Activa auto_vacuum=INCREMENTAL en una base de datos existente; necesita
+    # un VACUUM completo, que bloquea la base de datos mientras dura
+    conn = sqlite3.connect(db_filename, isolation_level=None)
+    try:
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def _duracion(texto):
+    # "7d", "12h", "30m" o "para-siempre"
+    if texto in ("para-siempre", "none"):
+        return None
+    unidades = {"d": DIA, "h": agregados.NIVELES["1h"], "m": agregados.NIVELES["1m"]}
+    return int(float(texto[:-1]) * unidades[texto[-1]])
+
+
+def describir(politica):
+    # "sensores 7d, 1m 90d, 1h para-siempre, ..."
+    partes = []
+    for nivel, duracion in politica.items():
+        if duracion is None:
+            texto = "para-siempre"
+        elif duracion % DIA == 0:
+            texto = f"{duracion // DIA}d"
+        else:
+            texto = f"{duracion / agregados.NIVELES['1h']:g}h"
+        partes.append(f"{nivel} {texto}")
+    return ", ".join(partes)
+
+
+# Aplica la política una vez sin esperar al colector:
+#   python retencion.py datos_sensores.db [--sensores 7d] [--1m 90d] [--convertir]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aplica la política de retención a sensores")
+    parser.add_argument("db", nargs="?", default="datos_sensores.db")
+    for nivel in POLITICA:
+        parser.add_argument(f"--{nivel}", dest=nivel, type=_duracion,
+                            default=POLITICA[nivel], help="Duración (7d, 12h, 30m) o para-siempre")
+    parser.add_argument("--archivar-en", metavar="CARPETA",
+                        help="Mueve las particiones antiguas a esta carpeta en lugar de borrarlas")
+    parser.add_argument("--convertir", action="store_true",
+                        help="Activa auto_vacuum=INCREMENTAL con un VACUUM completo")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.convertir:
+        t0 = time.monotonic()
+        convertir(args.db)
+        print(f"auto_vacuum=INCREMENTAL activado en {time.monotonic() - t0:.1f} s")
+    retencion = Retencion(args.db, {nivel: getattr(args, nivel) for nivel in POLITICA},
+                          archivar_en=args.archivar_en)
+    retencion.pasada()
+    print(retencion.estadisticas())
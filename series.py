@@ -0,0 +1,169 @@
+from PyQt5.QtCore import Qt
+from PyQt5.QtWidgets import QAbstractItemView, QAction
+from pyqtgraph import intColor, mkPen
+
+from buffer_circular import BufferCircular
+from diezmado import DiezmadorMinMax
+
+SIN_NOMBRE = "(sin identificar)"  # Lecturas sin dispositivo (p. ej. en modo visor)
+
+
+class _Serie:
+    # Ventana de datos, diezmado y curvas de un dispositivo
+    # (canal 0: temperatura, canal 1: humedad)
+    def __init__(self, nombre, color, ventana):
+        self.nombre = nombre
+        self.color = color
+        self.buffer = BufferCircular(ventana, canales=2)
+        self.temp_lod = DiezmadorMinMax()
+        self.hum_lod = DiezmadorMinMax()
+        self.curvas = None  # (temperatura, humedad); se crean al mostrarla
+        self.curvas_historial = None  # Las mismas para el histórico
+        self.visible = False
+        self.sucia = False
+
+
+class SeriesDispositivos:
+    # Una curva de temperatura (continua) y otra de humedad (discontinua) por
+    # dispositivo en la gráfica en vivo, y una lista con casillas para mostrar
+    # u ocultar cada uno. Los primeros max_visibles dispositivos se muestran
+    # al aparecer y el resto queda oculto. Un dispositivo oculto sigue
+    # acumulando datos en su ventana, pero no se diezma ni se redibuja; sus
+    # curvas no se crean hasta que se muestra por primera vez. En el
+    # histórico cada dispositivo visible tiene otras dos curvas del mismo color.
+    def __init__(self, grafica, lista, ventana, max_visibles=16, al_cambiar=None):
+        self.grafica = grafica
+        self.lista = lista
+        self.ventana = ventana
+        self.max_visibles = max_visibles
+        self.al_cambiar = al_cambiar
+        self.activas = True
+        self.dibujadas = []  # Series redibujadas en el último cuadro
+        self._series = {}    # nombre -> _Serie
+        self._items = {}     # nombre -> elemento de la lista
+        self._visibles = 0
+
+        self.lista.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.lista.itemChanged.connect(self._al_marcar)
+        self.lista.setContextMenuPolicy(Qt.ActionsContextMenu)
+        for texto, visible in (("Mostrar todos", True), ("Ocultar todos", False)):
+            accion = QAction(texto, self.lista)
+            accion.triggered.connect(lambda _, visible=visible: self.mostrar_todos(visible))
+            self.lista.addAction(accion)
+
+    def extender(self, por_dispositivo):
+        # por_dispositivo: {nombre: (temperaturas, humedades)}. Devuelve True
+        # si alguna serie visible ha cambiado y hay que redibujar
+        redibujar = False
+        for nombre, valores in por_dispositivo.items():
+            serie = self._series.get(nombre)
+            if serie is None:
+                serie = self._nueva(nombre)
+            serie.buffer.extender(valores)
+            if serie.visible:
+                serie.sucia = redibujar = True
+        return redibujar
+
+    def registrar(self, nombres):
+        # Añade a la lista los dispositivos que aún no tienen serie (p. ej.
+        # los que solo tienen datos guardados, para el histórico)
+        for nombre in nombres:
+            if nombre not in self._series:
+                self._nueva(nombre)
+
+    def visibles(self):
+        return [nombre for nombre, serie in self._series.items() if serie.visible]
+
+    def _nueva(self, nombre):
+        color = intColor(len(self._series), hues=9, values=3)
+        serie = self._series[nombre] = _Serie(nombre, color, self.ventana)
+        self.lista.blockSignals(True)
+        try:
+            self.lista.addItem(nombre if nombre is not None else SIN_NOMBRE)
+            item = self._items[nombre] = self.lista.item(self.lista.count() - 1)
+            item.setData(Qt.UserRole, nombre)
+            item.setForeground(color)
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            visible = self._visibles < self.max_visibles
+            item.setCheckState(Qt.Checked if visible else Qt.Unchecked)
+        finally:
+            self.lista.blockSignals(False)
+        self._mostrar(serie, visible)
+        return serie
+
+    def _al_marcar(self, item):
+        serie = self._series.get(item.data(Qt.UserRole))
+        if serie is not None and serie.visible != (item.checkState() == Qt.Checked):
+            self._mostrar(serie, not serie.visible)
+            if self.al_cambiar is not None:
+                self.al_cambiar()
+
+    def _mostrar(self, serie, visible):
+        if visible == serie.visible:
+            return
+        self._visibles += 1 if visible else -1
+        serie.visible = serie.sucia = visible
+        if visible and serie.curvas is None:
+            serie.curvas = (self.grafica.plot(pen=mkPen(serie.color)),
+                            self.grafica.plot(pen=mkPen(serie.color, style=Qt.DashLine)))
+        if serie.curvas is not None:
+            for curva in serie.curvas:
+                curva.setVisible(visible and self.activas)
+
+    def seleccionados(self):
+        # Nombres de los dispositivos seleccionados en la lista
+        return [item.data(Qt.UserRole) for item in self.lista.selectedItems()
+                if item.data(Qt.UserRole) is not None]
+
+    def mostrar_todos(self, visible):
+        self.lista.blockSignals(True)
+        try:
+            for nombre, serie in self._series.items():
+                self._items[nombre].setCheckState(Qt.Checked if visible else Qt.Unchecked)
+                self._mostrar(serie, visible)
+        finally:
+            self.lista.blockSignals(False)
+        if self.al_cambiar is not None:
+            self.al_cambiar()
+
+    def activar(self, activas):
+        # Con la gráfica en otro modo (p. ej. el histórico) se ocultan todas
+        # las curvas; al volver se redibujan las visibles
+        self.activas = activas
+        for serie in self._series.values():
+            if serie.curvas is not None:
+                for curva in serie.curvas:
+                    curva.setVisible(activas and serie.visible)
+            serie.sucia = serie.visible
+
+    def dibujar_historial(self, datos):
+        # datos: {nombre: ((t_temp, temp), (t_hum, hum))} de HistorialSensores;
+        # las curvas del histórico de los demás dispositivos se vacían
+        for nombre, serie in self._series.items():
+            valores = datos.get(nombre) if serie.visible else None
+            if valores is None:
+                if serie.curvas_historial is not None:
+                    for curva in serie.curvas_historial:
+                        curva.setData([], [])
+                continue
+            if serie.curvas_historial is None:
+                serie.curvas_historial = (self.grafica.plot(pen=mkPen(serie.color)),
+                                          self.grafica.plot(pen=mkPen(serie.color, style=Qt.DashLine)))
+            for curva, (t, v) in zip(serie.curvas_historial, valores):
+                curva.setData(t, v)
+
+    def dibujar(self, ancho):
+        # Actualiza solo las curvas visibles que tienen datos nuevos
+        self.dibujadas = []
+        if not self.activas:
+            return
+        for serie in self._series.values():
+            if not serie.sucia:
+                continue
+            serie.sucia = False
+            serie.temp_lod.ajustar_ancho(ancho)
+            serie.hum_lod.ajustar_ancho(ancho)
+            temperatura, humedad = serie.curvas
+            temperatura.setData(*serie.temp_lod.actualizar(serie.buffer, 0))
+            humedad.setData(*serie.hum_lod.actualizar(serie.buffer, 1))
+            self.dibujadas.append(serie)
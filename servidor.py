@@ -0,0 +1,349 @@
+import asyncio
+import logging
+import time
+
+import comandos
+import metricas
+import protocolo
+from tramas import DecodificadorTramas, MODO_FIJO, MODO_LINEA
+
+log = logging.getLogger(__name__)
+
+# Bytes sin enviar a partir de los cuales un ESP32 se considera atascado y
+# Conexion.escribir no le envía nada más
+MAX_PENDIENTE = 64 * 1024
+
+_BYTES = metricas.contador("ingesta_bytes_recibidos_total", "Bytes recibidos de los ESP32")
+_RECEPCION = metricas.histograma(
+    "ingesta_recepcion_segundos", "Proceso de cada bloque recibido del socket, con todas sus tramas")
+_MENSAJES = metricas.contador("ingesta_mensajes_texto_total", "Mensajes de texto recibidos")
+_REGISTROS = metricas.contador("ingesta_registros_binarios_total", "Registros binarios recibidos")
+_DECODIFICAR = metricas.histograma(
+    "ingesta_decodificar_segundos", "Decodificación de cada bloque de registros binarios")
+
+
+class Conexion:
+    # Estado y estadísticas de una conexión con un ESP32
+    def __init__(self, servidor, transporte, direccion):
+        self.servidor = servidor
+        self.transporte = transporte
+        self.direccion = direccion
+        # Nombre del ESP32 (ver protocolo.py); hasta que se identifique, su IP
+        self.dispositivo = str(direccion[0]) if direccion else None
+        self.conectado_desde = time.time()
+        self.ultimo_mensaje = None
+        self.mensajes = 0
+        self.bytes_recibidos = 0
+        self.bytes_enviados = 0
+        self.decodificador = None
+        self.binario = None  # DecodificadorBinario si se negoció el protocolo binario
+        self.cerrada = False
+        self.confirmada = None   # Última secuencia guardada en la base de datos
+        self.ack_enviado = None  # Última secuencia confirmada al ESP32
+        self.acks_enviados = 0
+        self.cerrar_tras_ack = False  # Hueco en la secuencia (ver _procesar_binario)
+        self._temporizador_ack = None
+
+    def sendall(self, datos):
+        # Envía datos al ESP32; se puede llamar desde cualquier hilo
+        if self.cerrada:
+            raise ConnectionError(f"La conexión con {self.direccion} está cerrada")
+        self.servidor.loop.call_soon_threadsafe(self._escribir, datos)
+
+    def escribir(self, datos):
+        # Desde el bucle del servidor (p. ej. comandos.py). ConnectionError si
+        # la conexión está cerrada o si el ESP32 no lee lo que se le envía
+        # (más de MAX_PENDIENTE bytes sin enviar): así un ESP32 atascado no
+        # acumula comandos sin límite
+        if self.cerrada:
+            raise ConnectionError(f"{self.dispositivo} no está conectado")
+        if self.transporte.get_write_buffer_size() > MAX_PENDIENTE:
+            raise ConnectionError(f"{self.dispositivo} no lee lo que se le envía")
+        self._escribir(datos)
+
+    def _escribir(self, datos):
+        if not self.cerrada:
+            self.bytes_enviados += len(datos)
+            self.transporte.write(datos)
+
+    def cerrar(self):
+        self.servidor.loop.call_soon_threadsafe(self.transporte.close)
+
+    def confirmar(self, secuencia, ok=True):
+        # Indica que todo hasta secuencia ya está guardado (o que falló, ok=False);
+        # se puede llamar desde cualquier hilo, p. ej. el del escritor de la base de datos
+        self.servidor.loop.call_soon_threadsafe(self._confirmar, secuencia, ok)
+
+    def _confirmar(self, secuencia, ok):
+        if self.cerrada:
+            return
+        if not ok:
+            # Se cierra la conexión para que el ESP32 reenvíe desde su último ACK
+            log.error("No se pudieron guardar los datos de %s - cerrando la conexión", self.direccion)
+            self.transporte.close()
+            return
+        if secuencia is not None and secuencia != self.confirmada:
+            self.confirmada = secuencia
+            # ACK acumulado: cada ack_cada registros o, como mucho, tras ack_intervalo segundos
+            if self.ack_enviado is None or (secuencia - self.ack_enviado) & 0xFFFFFFFF >= self.servidor.ack_cada:
+                self._enviar_ack()
+            elif self._temporizador_ack is None:
+                self._temporizador_ack = self.servidor.loop.call_later(
+                    self.servidor.ack_intervalo, self._enviar_ack)
+        if self.cerrar_tras_ack and self.confirmada == self.binario.contigua:
+            # Todo lo anterior al hueco está guardado: el ESP32 reenviará el
+            # resto desde este ACK en su próxima conexión
+            self._enviar_ack()
+            self.transporte.close()
+
+    def _enviar_ack(self):
+        if self._temporizador_ack is not None:
+            self._temporizador_ack.cancel()
+            self._temporizador_ack = None
+        if self.cerrada or self.confirmada == self.ack_enviado:
+            return
+        self.ack_enviado = self.confirmada
+        self.acks_enviados += 1
+        self._escribir(f"ACK {self.confirmada}\n".encode('utf-8'))
+
+    def estadisticas(self):
+        return {
+            "direccion": self.direccion,
+            "dispositivo": self.dispositivo,
+            "conectado_desde": self.conectado_desde,
+            "ultimo_mensaje": self.ultimo_mensaje,
+            "mensajes": self.mensajes,
+            "bytes_recibidos": self.bytes_recibidos,
+            "bytes_enviados": self.bytes_enviados,
+            "tramas": self.decodificador.estadisticas(),
+            "binario": self.binario.estadisticas() if self.binario else None,
+            "confirmada": self.confirmada,
+            "acks_enviados": self.acks_enviados,
+        }
+
+
+class _ProtocoloESP32(asyncio.BufferedProtocol):
+    # Recibe directamente en el buffer del decodificador (equivalente a
+    # recv_into) y procesa cada trama completa por separado
+    def __init__(self, servidor):
+        self.servidor = servidor
+        self.conexion = None
+        self.decodificador = DecodificadorTramas(
+            servidor.modo_trama, max_trama=servidor.max_trama)
+        self._temporizador = None
+
+    def connection_made(self, transporte):
+        direccion = transporte.get_extra_info("peername")
+        servidor = self.servidor
+
+        # Rechaza la conexión si se alcanzó el límite configurado
+        if servidor.max_conexiones is not None and len(servidor.conexiones) >= servidor.max_conexiones:
+            servidor.rechazadas += 1
+            log.warning("Conexión rechazada (límite alcanzado): %s", direccion)
+            transporte.close()
+            return
+
+        self.conexion = Conexion(servidor, transporte, direccion)
+        self.conexion.decodificador = self.decodificador
+        servidor.conexiones.add(self.conexion)
+        servidor.total_conexiones += 1
+        log.info("Conectado por %s", direccion)
+        if servidor.al_conectar:
+            servidor.al_conectar(self.conexion)
+
+    def get_buffer(self, sizehint):
+        return self.decodificador.buffer_libre()
+
+    def buffer_updated(self, nbytes):
+        if self.conexion is None:
+            return
+        t0 = time.perf_counter() if metricas.activas else None
+        self.conexion.bytes_recibidos += nbytes
+        for trama in self.decodificador.recibidos(nbytes):
+            self._procesar(trama)
+        if t0 is not None:
+            _BYTES.sumar(nbytes)
+            _RECEPCION.observar(time.perf_counter() - t0)
+
+        # Si queda un mensaje sin separador, se entrega tras un tiempo sin
+        # datos nuevos (ESP32 que no terminan sus mensajes con salto de línea)
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        if (self.decodificador.pendiente() and self.servidor.espera_parcial is not None
+                and self.decodificador.modo != MODO_FIJO):
+            self._temporizador = self.servidor.loop.call_later(
+                self.servidor.espera_parcial, self._vaciar_parcial)
+
+    def _vaciar_parcial(self):
+        self._temporizador = None
+        trama = self.decodificador.finalizar()
+        if trama is not None:
+            self._procesar(trama)
+
+    def _procesar(self, trama):
+        conexion = self.conexion
+        if conexion.binario is not None:
+            self._procesar_binario(trama)
+            return
+        if conexion.mensajes == 0 and protocolo.es_saludo(trama):
+            self._negociar(trama)
+            return
+        if comandos.es_respuesta(trama):
+            self.servidor.comandos.respuesta(conexion, trama)
+            return
+        conexion.mensajes += 1
+        conexion.ultimo_mensaje = time.time()
+        if metricas.activas:
+            _MENSAJES.sumar()
+
+        mensaje = str(trama, 'utf-8', 'replace')
+        try:
+            self.servidor.al_recibir(conexion, mensaje)
+        except Exception as e:
+            log.error("Error al procesar los datos recibidos: %s", e)
+
+        # Enviar una respuesta de confirmación al ESP32. En el protocolo de
+        # texto el "ACK" solo indica que el mensaje se ha recibido: se envía
+        # antes de que el escritor lo guarde, así que no garantiza que esté en
+        # la base de datos (para eso, el protocolo binario y su ACK acumulado)
+        conexion._escribir("ACK".encode('utf-8'))
+
+    def _negociar(self, trama):
+        # Primer mensaje "HELLO BIN1 ...": el resto de la conexión usa registros
+        # binarios; con "HELLO ID ..." solo se anota el nombre del dispositivo
+        conexion = self.conexion
+        try:
+            binario, nombre = protocolo.negociar(trama)
+            if binario is not None and self.servidor.al_recibir_lecturas is None:
+                raise ValueError("el servidor solo acepta texto")
+        except ValueError as e:
+            log.warning("Saludo rechazado para %s - %s", conexion.direccion, e)
+            conexion._escribir(f"ERR {e}\n".encode('utf-8'))
+            return
+        if nombre is not None:
+            conexion.dispositivo = nombre
+            log.info("%s se identifica como %s", conexion.direccion, nombre)
+        if binario is None:
+            conexion._escribir(protocolo.RESPUESTA_ID)
+            return
+        binario.dispositivo = conexion.dispositivo
+        conexion.binario = binario
+        self.decodificador.cambiar_modo(MODO_FIJO, binario.tamano_registro)
+        log.info("Protocolo binario %s con %s %s", protocolo.VERSION, conexion.direccion, binario.canales)
+        conexion._escribir(protocolo.RESPUESTA_OK)
+
+    def _procesar_binario(self, bloque):
+        # Todos los registros completos recibidos llegan en un solo bloque.
+        # No se responde aquí: al_recibir_lecturas llama a conexion.confirmar()
+        # cuando los registros están guardados y entonces se envía "ACK <secuencia>"
+        conexion = self.conexion
+        try:
+            t0 = time.perf_counter() if metricas.activas else None
+            hueco = conexion.binario.hueco
+            lecturas = conexion.binario.decodificar(bloque)
+            if conexion.binario.hueco and not hueco:
+                # Los registros posteriores al hueco se descartan: se deja de
+                # leer y se cierra la conexión al confirmar lo anterior
+                log.warning("Faltan registros de %s después de la secuencia %s - cerrando la conexión",
+                            conexion.dispositivo, conexion.binario.contigua)
+                conexion.transporte.pause_reading()
+                conexion.cerrar_tras_ack = True
+            if t0 is not None:
+                _DECODIFICAR.observar(time.perf_counter() - t0)
+                _REGISTROS.sumar(len(lecturas))
+            conexion.mensajes += len(lecturas)
+            conexion.ultimo_mensaje = time.time()
+            self.servidor.al_recibir_lecturas(conexion, lecturas)
+        except Exception as e:
+            log.error("Error al procesar los datos recibidos: %s", e)
+
+    def connection_lost(self, exc):
+        conexion = self.conexion
+        if conexion is None:
+            return
+        conexion.cerrada = True
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+        if conexion._temporizador_ack is not None:
+            conexion._temporizador_ack.cancel()
+        self._vaciar_parcial()
+        self.servidor.conexiones.discard(conexion)
+        self.servidor.comandos.desconectado(conexion)
+        log.info("Desconectado %s", conexion.direccion)
+        if self.servidor.al_desconectar:
+            self.servidor.al_desconectar(conexion)
+
+
+class ServidorIngesta:
+    # Servidor TCP asyncio que acepta cualquier número de ESP32 a la vez
+    # (hasta max_conexiones, si se indica) y entrega cada mensaje recibido
+    # a al_recibir(conexion, mensaje). Los mensajes se separan según
+    # modo_trama (ver tramas.py); espera_parcial es el tiempo en segundos tras
+    # el que un mensaje sin separador se entrega igualmente (None lo desactiva).
+    # Si se indica al_recibir_lecturas(conexion, lecturas), los ESP32 pueden
+    # negociar el protocolo binario (ver protocolo.py) y sus registros llegan
+    # ya convertidos en Lecturas, por bloques. A esas conexiones se les
+    # confirma con "ACK <secuencia>" acumulado (ver Conexion.confirmar) cada
+    # ack_cada registros o ack_intervalo segundos, en lugar de un ACK por mensaje;
+    # tras un hueco en la secuencia se confirma lo anterior y se cierra la
+    # conexión (ver protocolo.py). Las conexiones de texto
+    # reciben un "ACK" por mensaje que solo confirma la recepción.
+    # Los comandos a los ESP32 se envían con comandos (ver comandos.py).
+    def __init__(self, host, port, al_recibir, al_conectar=None, al_desconectar=None,
+                 max_conexiones=None, modo_trama=MODO_LINEA, max_trama=4096,
+                 espera_parcial=0.05, al_recibir_lecturas=None, ack_cada=100,
+                 ack_intervalo=0.2):
+        self.host = host
+        self.port = port
+        self.al_recibir = al_recibir
+        self.al_recibir_lecturas = al_recibir_lecturas
+        self.ack_cada = ack_cada
+        self.ack_intervalo = ack_intervalo
+        self.al_conectar = al_conectar
+        self.al_desconectar = al_desconectar
+        self.max_conexiones = max_conexiones
+        self.modo_trama = modo_trama
+        self.max_trama = max_trama
+        self.espera_parcial = espera_parcial
+        self.conexiones = set()
+        self.comandos = comandos.DespachadorComandos(self)
+        self.total_conexiones = 0
+        self.rechazadas = 0
+        self.loop = None
+        self._servidor = None
+        self._detener = None
+        self._detenido = False
+
+    async def servir(self):
+        self.loop = asyncio.get_running_loop()
+        self._detener = asyncio.Event()
+        metricas.indicador("ingesta_conexiones_activas", "ESP32 conectados",
+                           lambda: len(self.conexiones))
+        if self._detenido:
+            return
+        self._servidor = await self.loop.create_server(
+            lambda: _ProtocoloESP32(self), self.host, self.port, reuse_address=True)
+        log.info("El servidor está esperando conexiones en el puerto %s", self.port)
+        async with self._servidor:
+            await self._detener.wait()
+        for conexion in list(self.conexiones):
+            conexion.transporte.close()
+
+    def ejecutar(self):
+        # Bloquea el hilo actual hasta que se llame a detener()
+        asyncio.run(self.servir())
+
+    def detener(self):
+        self._detenido = True
+        if self.loop is not None and self._detener is not None:
+            self.loop.call_soon_threadsafe(self._detener.set)
+
+    def estadisticas(self):
+        return {
+            "activas": len(self.conexiones),
+            "total_conexiones": self.total_conexiones,
+            "rechazadas": self.rechazadas,
+            "comandos": self.comandos.estadisticas(),
+            "conexiones": [c.estadisticas() for c in list(self.conexiones)],
+        }
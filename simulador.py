@@ -0,0 +1,186 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import resource
+import time
+
+import protocolo
+
+ESP32_HOST = "127.0.0.1"
+ESP32_PORT = 1234
+
+# Formatos de mensaje que aceptan los distintos scripts
+FORMATOS = ("simple", "etiquetas", "claves", "binario")
+CANALES_BINARIO = ("temperatura", "humedad")
+
+# Con marcar_tiempo la temperatura lleva la hora de envío (segundos módulo
+# PERIODO_MARCA) para medir la latencia en el receptor; el periodo es corto
+# para no perder precisión en el float32 del protocolo binario
+PERIODO_MARCA = 1000.0
+
+
+def reloj_marca():
+    return time.time() % PERIODO_MARCA
+
+
+def latencia_marca(valor):
+    # Segundos desde que se envió un mensaje marcado con reloj_marca()
+    return (reloj_marca() - valor) % PERIODO_MARCA
+
+
+def mensaje(formato, temperatura, humedad):
+    if formato == "simple":
+        return f"{temperatura:.6f},{humedad:.2f}"
+    if formato == "etiquetas":
+        return f"Temperatura: {temperatura:.6f}°C, Humedad: {humedad:.2f}%"
+    if formato == "claves":
+        return (f"T_Inst:{temperatura:.6f}°C,T_Max:{temperatura + 0.5:.2f}°C,"
+                f"T_Min:{temperatura - 0.5:.2f}°C,T_Avg:{temperatura:.2f}°C,"
+                f"H_Inst:{humedad:.2f}%,H_Max:{humedad + 1:.2f}%,"
+                f"H_Min:{humedad - 1:.2f}%,H_Avg:{humedad:.2f}%")
+    raise ValueError(f"Formato desconocido: {formato}")
+
+
+class ClienteSimulado:
+    # Un ESP32 simulado: envía tasa mensajes por segundo en el formato indicado
+    # (agrupando los que tocan en cada tick) y lee las confirmaciones del servidor
+    def __init__(self, numero, formato, tasa, marcar_tiempo=False, tick=0.01):
+        self.numero = numero
+        self.formato = formato
+        self.tasa = tasa
+        self.marcar_tiempo = marcar_tiempo
+        self.tick = max(tick, 1.0 / tasa) if tasa > 0 else tick
+        self.enviados = 0
+        self.acks = 0
+        self.ultimo_ack = None
+        self.errores = 0
+        self._fase = random.uniform(0, 2 * math.pi)
+
+    def _valores(self, t):
+        if self.marcar_tiempo:
+            temperatura = reloj_marca()
+        else:
+            temperatura = 22 + 3 * math.sin(t / 60 + self._fase) + random.gauss(0, 0.1)
+        humedad = 45 + 10 * math.sin(t / 300 + self._fase) + random.gauss(0, 0.5)
+        return temperatura, humedad
+
+    async def ejecutar(self, host, port, duracion):
+        try:
+            lector, escritor = await asyncio.open_connection(host, port)
+        except OSError as e:
+            print(f"Cliente {self.numero}: no se pudo conectar:", e)
+            self.errores += 1
+            return
+
+        # Cada cliente se identifica para que sus lecturas vayan a su propia serie
+        nombre = f"sim-{self.numero}"
+        formato = None
+        if self.formato == "binario":
+            formato = protocolo.formato_registro(CANALES_BINARIO)
+            escritor.write(protocolo.saludo(CANALES_BINARIO, nombre))
+            respuesta = await lector.readline()
+            if respuesta != protocolo.RESPUESTA_OK:
+                print(f"Cliente {self.numero}: protocolo binario rechazado:", respuesta)
+                self.errores += 1
+                escritor.close()
+                return
+        else:
+            escritor.write(protocolo.identificacion(nombre))
+
+        confirmaciones = asyncio.ensure_future(self._leer_acks(lector))
+        inicio = time.monotonic()
+        try:
+            while True:
+                ahora = time.monotonic()
+                transcurrido = ahora - inicio
+                if transcurrido >= duracion:
+                    break
+                pendientes = int(transcurrido * self.tasa) - self.enviados
+                if pendientes > 0:
+                    if formato is not None:
+                        datos = b"".join(
+                            protocolo.codificar(self.enviados + i, int(transcurrido * 1000),
+                                                self._valores(transcurrido), formato)
+                            for i in range(pendientes))
+                    else:
+                        datos = "".join(
+                            mensaje(self.formato, *self._valores(transcurrido)) + "\n"
+                            for _ in range(pendientes)).encode('utf-8')
+                    escritor.write(datos)
+                    self.enviados += pendientes
+                    await escritor.drain()
+                await asyncio.sleep(self.tick)
+            # Deja un momento para recibir las últimas confirmaciones
+            await asyncio.sleep(0.5)
+        except OSError as e:
+            print(f"Cliente {self.numero}: conexión perdida:", e)
+            self.errores += 1
+        finally:
+            confirmaciones.cancel()
+            escritor.close()
+
+    async def _leer_acks(self, lector):
+        while True:
+            try:
+                linea = await lector.readline() if self.formato == "binario" else await lector.read(4096)
+            except ConnectionError:
+                return
+            if not linea:
+                return
+            if self.formato == "binario":
+                self.ultimo_ack = int(linea.split()[1])
+                self.acks += 1
+            else:
+                self.acks += linea.count(b"ACK")
+
+
+async def simular(host, port, clientes, formato, tasa, duracion, marcar_tiempo=False):
+    # formato "mixto" reparte los clientes entre todos los formatos
+    simulados = [
+        ClienteSimulado(i, FORMATOS[i % len(FORMATOS)] if formato == "mixto" else formato,
+                        tasa, marcar_tiempo)
+        for i in range(clientes)
+    ]
+    await asyncio.gather(*(c.ejecutar(host, port, duracion) for c in simulados))
+    return simulados
+
+
+def resumen(simulados, segundos):
+    uso = resource.getrusage(resource.RUSAGE_SELF)
+    enviados = sum(c.enviados for c in simulados)
+    return {
+        "clientes": len(simulados),
+        "enviados": enviados,
+        "acks": sum(c.acks for c in simulados),
+        "errores": sum(c.errores for c in simulados),
+        "segundos": segundos,
+        "mensajes_por_segundo": enviados / segundos if segundos else 0.0,
+        "cpu_s": uso.ru_utime + uso.ru_stime,
+    }
+
+
+# Simula varios ESP32 contra un servidor en marcha:
+#   python simulador.py --clientes 8 --tasa 100 --formato etiquetas --duracion 30
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulador de ESP32 para pruebas de carga")
+    parser.add_argument("--host", default=ESP32_HOST)
+    parser.add_argument("--puerto", type=int, default=ESP32_PORT)
+    parser.add_argument("--clientes", type=int, default=4)
+    parser.add_argument("--tasa", type=float, default=10.0, help="Mensajes por segundo por cliente")
+    parser.add_argument("--formato", choices=FORMATOS + ("mixto",), default="etiquetas")
+    parser.add_argument("--duracion", type=float, default=10.0, help="Segundos")
+    parser.add_argument("--marcar-tiempo", action="store_true",
+                        help="Envía la hora de envío como temperatura para medir latencias")
+    parser.add_argument("--json", action="store_true", help="Imprime el resumen como JSON")
+    args = parser.parse_args()
+
+    simulados = asyncio.run(simular(args.host, args.puerto, args.clientes, args.formato,
+                                    args.tasa, args.duracion, args.marcar_tiempo))
+    datos = resumen(simulados, args.duracion)
+    if args.json:
+        print(json.dumps(datos))
+    else:
+        for clave, valor in datos.items():
+            print(f"{clave}: {valor}")
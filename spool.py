@@ -0,0 +1,233 @@
+import json
+import logging
+import os
+import re
+import threading
+
+import metricas
+from lectura import Lectura
+
+log = logging.getLogger(__name__)
+
+# Spool en disco para las Lecturas que no caben en la cola del escritor de la
+# base de datos (p. ej. mientras otra consulta la tiene bloqueada). Se añaden
+# al final de archivos de segmento numerados (una Lectura JSON por línea) y el
+# escritor las vuelve a leer en el mismo orden cuando la base de datos se
+# recupera. La posición de lectura se guarda en el archivo "posicion" después
+# de cada lote confirmado; si el proceso muere entre el COMMIT y ese guardado,
+# el último lote se inserta dos veces (nunca se pierde). Una línea incompleta
+# al final de un segmento (caída a mitad de escritura) se ignora.
+
+_SEGMENTO = re.compile(r"spool\.(\d+)\.jsonl$")
+_PRIMERO = 1000000000  # Deja sitio para anteponer segmentos (ver anteponer)
+
+_BYTES = metricas.indicador("spool_bytes_pendientes", "Bytes del spool en disco pendientes de guardar")
+_ESCRITAS = metricas.contador("spool_lecturas_escritas_total", "Lecturas desviadas al spool en disco")
+_LLENO = metricas.contador("spool_lleno_total", "Lecturas rechazadas con el spool lleno")
+
+
+class SpoolLleno(Exception):
+    # La cola y el spool están llenos: el que envía debe esperar (contrapresión)
+    pass
+
+
+class Spool:
+    def __init__(self, directorio, max_bytes=1 << 30, max_segmento=64 << 20):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.max_segmento = max_segmento
+        self._lock = threading.Lock()
+        os.makedirs(directorio, exist_ok=True)
+
+        segmentos = self._segmentos()
+        lectura = self._leer_posicion()
+        if lectura is None or (segmentos and lectura[0] < segmentos[0]):
+            lectura = (segmentos[0] if segmentos else _PRIMERO, 0)
+        for numero in segmentos:
+            if numero < lectura[0]:
+                os.remove(self._ruta(numero))  # Ya guardado antes de cerrar
+        self._lectura = lectura
+        self._escritura = max(segmentos[-1] if segmentos else lectura[0], lectura[0])
+        self._archivo = open(self._ruta(self._escritura), "ab")
+        if self._termina_a_medias(self._escritura):
+            self._rotar()  # Para no pegar líneas nuevas a una incompleta
+        self.bytes = sum(os.path.getsize(self._ruta(n)) for n in self._segmentos()) - lectura[1]
+        _BYTES.funcion = lambda: self.bytes
+
+        # Contadores
+        self.escritas = 0
+        self.rechazadas = 0
+        if self.bytes:
+            log.warning("Spool con %d bytes pendientes de una ejecución anterior", self.bytes)
+
+    def _ruta(self, numero):
+        return os.path.join(self.directorio, f"spool.{numero:010d}.jsonl")
+
+    def _segmentos(self):
+        numeros = []
+        for nombre in os.listdir(self.directorio):
+            encontrado = _SEGMENTO.match(nombre)
+            if encontrado:
+                numeros.append(int(encontrado[1]))
+        return sorted(numeros)
+
+    def _termina_a_medias(self, numero):
+        with open(self._ruta(numero), "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def _leer_posicion(self):
+        try:
+            with open(os.path.join(self.directorio, "posicion")) as f:
+                segmento, desplazamiento = json.load(f)
+            return segmento, desplazamiento
+        except (OSError, ValueError):
+            return None
+
+    def _guardar_posicion(self, posicion):
+        ruta = os.path.join(self.directorio, "posicion")
+        with open(ruta + ".tmp", "w") as f:
+            json.dump(list(posicion), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(ruta + ".tmp", ruta)
+
+    @staticmethod
+    def _codificar(lecturas):
+        return b"".join(json.dumps(lectura, separators=(",", ":")).encode('utf-8') + b"\n"
+                        for lectura in lecturas)
+
+    def agregar(self, lecturas, sincronizar=False):
+        # Añade las Lecturas al final; SpoolLleno si superarían max_bytes
+        datos = self._codificar(lecturas)
+        with self._lock:
+            if self.bytes + len(datos) > self.max_bytes:
+                self.rechazadas += len(lecturas)
+                if metricas.activas:
+                    _LLENO.sumar(len(lecturas))
+                raise SpoolLleno(f"Spool lleno ({self.bytes} bytes en {self.directorio})")
+            if self._archivo.tell() >= self.max_segmento:
+                self._rotar()
+            self._archivo.write(datos)
+            self._archivo.flush()
+            if sincronizar:
+                os.fsync(self._archivo.fileno())
+            self.bytes += len(datos)
+            self.escritas += len(lecturas)
+        if metricas.activas:
+            _ESCRITAS.sumar(len(lecturas))
+
+    def _rotar(self):
+        self._archivo.close()
+        self._escritura += 1
+        self._archivo = open(self._ruta(self._escritura), "ab")
+
+    def vacio(self):
+        return self.bytes <= 0
+
+    def fin(self):
+        # Posición tras la última Lectura añadida (comparable con la de leer)
+        with self._lock:
+            return self._escritura, self._archivo.tell()
+
+    def leer(self, max_filas):
+        # Devuelve (lecturas, posición tras ellas) sin avanzar la posición
+        # guardada; confirmar(posición) lo hace cuando ya están en la base de datos
+        with self._lock:
+            self._archivo.flush()
+            segmento, desplazamiento = self._lectura
+            escritura = self._escritura
+        lecturas = []
+        while len(lecturas) < max_filas:
+            try:
+                with open(self._ruta(segmento), "rb") as f:
+                    f.seek(desplazamiento)
+                    for linea in f:
+                        if not linea.endswith(b"\n"):
+                            break  # Escritura a medias (o en curso)
+                        desplazamiento += len(linea)
+                        try:
+                            lecturas.append(Lectura(*json.loads(linea)))
+                        except (ValueError, TypeError):
+                            log.warning("Línea dañada en el spool %s ignorada", self._ruta(segmento))
+                        if len(lecturas) >= max_filas:
+                            break
+            except FileNotFoundError:
+                pass
+            if len(lecturas) >= max_filas or segmento >= escritura:
+                break
+            segmento, desplazamiento = segmento + 1, 0
+        return lecturas, (segmento, desplazamiento)
+
+    def confirmar(self, posicion):
+        # Las Lecturas hasta posicion ya están guardadas: se anota la posición
+        # y se borran los segmentos terminados
+        self._guardar_posicion(posicion)
+        with self._lock:
+            anterior = self._lectura
+            self._lectura = posicion
+            leido = 0
+            for numero in range(anterior[0], posicion[0]):
+                ruta = self._ruta(numero)
+                if os.path.exists(ruta):
+                    leido += os.path.getsize(ruta)
+                    os.remove(ruta)
+            self.bytes -= leido - anterior[1] + posicion[1]
+            # Todo leído: se empieza un segmento nuevo para poder borrar este
+            if self.bytes <= 0 and posicion[0] == self._escritura and self._archivo.tell() > 0:
+                self._rotar()
+                self._lectura = (self._escritura, 0)
+                os.remove(self._ruta(posicion[0]))
+                self._guardar_posicion(self._lectura)
+
+    def anteponer(self, lecturas):
+        # Guarda Lecturas anteriores a todo lo que hay en el spool (p. ej. un
+        # lote que no se pudo escribir al cerrar): se copian a un segmento
+        # nuevo, delante de lo que queda por leer, y se sincroniza en disco
+        if not lecturas:
+            return
+        with self._lock:
+            segmento, desplazamiento = self._lectura
+            numero = segmento - 1
+            with open(self._ruta(numero), "wb") as f:
+                f.write(self._codificar(lecturas))
+                # Lo que faltaba por leer del segmento actual pasa al nuevo
+                if segmento == self._escritura:
+                    self._archivo.flush()
+                try:
+                    with open(self._ruta(segmento), "rb") as actual:
+                        actual.seek(desplazamiento)
+                        resto = actual.read()
+                    f.write(resto)
+                except FileNotFoundError:
+                    resto = b""
+                f.flush()
+                os.fsync(f.fileno())
+                tamano = f.tell()
+            if segmento == self._escritura:
+                self._archivo.close()
+                self._escritura = numero
+            self._guardar_posicion((numero, 0))
+            self._lectura = (numero, 0)
+            if os.path.exists(self._ruta(segmento)):
+                os.remove(self._ruta(segmento))
+            if self._escritura == numero:
+                self._archivo = open(self._ruta(numero), "ab")
+            self.bytes += tamano - len(resto)
+            self.escritas += len(lecturas)
+
+    def cerrar(self):
+        with self._lock:
+            self._archivo.flush()
+            os.fsync(self._archivo.fileno())
+            self._archivo.close()
+
+    def estadisticas(self):
+        return {
+            "bytes_pendientes": self.bytes,
+            "escritas": self.escritas,
+            "rechazadas": self.rechazadas,
+        }
@@ -1,107 +1,150 @@
-import socket
-import sqlite3
-from datetime import datetime
-from PyQt5.QtWidgets import QApplication, QMainWindow
+from PyQt5.QtWidgets import QApplication, QListWidget, QMainWindow
 from PyQt5.QtCore import QTimer, QThread, pyqtSignal
 import sys
+import argparse
+import logging
+import threading
+import time
 from PyQt5.uic import loadUi
-from pyqtgraph import PlotWidget
+from pyqtgraph import PlotWidget, AxisItem, DateAxisItem
+import metricas
+import registro
+from escritor_db import EscritorDB
+from retencion import Retencion
+from render import PlanificadorRender
+from series import SeriesDispositivos
+from historial import HistorialSensores
+from colector import Colector, leer_visor
+from parseo import Parser
+from lotes import AgrupadorLotes
 
 ESP32_HOST = "0.0.0.0"  # Cambia esto por la IP del ESP32
 ESP32_PORT = 1234        # Puerto usado por el ESP32
+MAX_CONEXIONES = 64      # Número máximo de ESP32 conectados a la vez
 db_filename = "datos_sensores.db"
+PARTICIONES = None      # "dia" o "mes": un archivo de filas por periodo (ver particiones.py)
+REDUCCION_HISTORIAL = "minmax"  # "minmax" o "lttb": puntos del histórico (ver historial.REDUCCIONES)
+VENTANA_GRAFICA = 100   # Número de muestras visibles en la gráfica (por dispositivo)
+MAX_VISIBLES = 16       # Dispositivos que se muestran al aparecer; el resto, desde la lista
+FPS_GRAFICA = 30        # Máximo de redibujados por segundo
+INTERVALO_LOTES = 0.03  # Segundos entre lotes de lecturas enviados a la interfaz (0.016-0.05)
+RETENCION = False       # True (o --retencion): borra los datos antiguos según retencion.POLITICA
+
+# Escritor de la base de datos (conexión persistente con escrituras por lotes)
+escritor = EscritorDB(db_filename, particiones=PARTICIONES)
+
+# Borrado periódico de los datos antiguos (ver retencion.POLITICA); desactivado
+# por defecto, porque borra filas de forma irreversible
+retencion = Retencion(db_filename) if RETENCION else None
 
 # Función para inicializar la base de datos
 def inicializar_db():
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sensores (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            datos TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
-
-# Función para guardar los datos en la base de datos
-def guardar_datos(datos):
-    conn = sqlite3.connect(db_filename)
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO sensores (timestamp, datos) 
-        VALUES (?, ?)
-    ''', (datetime.now().isoformat(), datos))
-    conn.commit()
-    conn.close()
+    escritor.iniciar()
+    if retencion is not None:
+        retencion.iniciar()
+
+log = logging.getLogger(__name__)
+
+_EMITIR = metricas.histograma("qt_emitir_segundos", "Emisión de cada lote de lecturas hacia la interfaz")
 
 class ServerThread(QThread):
-    new_data_signal = pyqtSignal(str)
-    connection_signal = pyqtSignal(object)  # Nueva señal para pasar la conexión
+    new_data_signal = pyqtSignal(object)  # Lista de Lecturas ya parseadas (ver lectura.py)
+
+    def __init__(self):
+        super(ServerThread, self).__init__()
+        # El colector (servidor TCP, parseo y base de datos) no depende de Qt;
+        # este hilo solo lo ejecuta y reenvía los mensajes a la interfaz
+        self.colector = Colector(
+            ESP32_HOST, ESP32_PORT, escritor=escritor,
+            max_conexiones=MAX_CONEXIONES)
+        self.colector.suscribir(self.procesar_mensaje)
+        # Una señal por lote en lugar de una por mensaje
+        self.lotes = AgrupadorLotes(self.emitir_lote, INTERVALO_LOTES)
+
+    def run(self):
+        self.lotes.iniciar()
+        try:
+            self.colector.ejecutar()
+        finally:
+            self.lotes.detener()
+
+    def stop(self):
+        # Detiene el servidor y espera a que termine el hilo
+        self.colector.detener()
+        self.wait(2000)
+
+    def procesar_mensaje(self, conexion, lectura):
+        # El parseo ya se hizo en este hilo; la Lectura espera al próximo lote
+        self.lotes.agregar(lectura)
+
+    def emitir_lote(self, lecturas):
+        # Emitir los datos para actualizar la interfaz
+        t0 = time.perf_counter() if metricas.activas else None
+        self.new_data_signal.emit(lecturas)
+        if t0 is not None:
+            _EMITIR.observar(time.perf_counter() - t0)
+
+class ViewerThread(QThread):
+    # Modo visor: recibe los mensajes de un colector independiente
+    # (python colector.py) en lugar de abrir el servidor en este proceso
+    new_data_signal = pyqtSignal(object)
+
+    def __init__(self, direccion):
+        super(ViewerThread, self).__init__()
+        host, _, puerto = direccion.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(puerto)
+        self.detener = threading.Event()
+        self.parsers = {}  # Un Parser por dispositivo, que recuerda su formato
+        self.lotes = AgrupadorLotes(self.new_data_signal.emit, INTERVALO_LOTES)
 
     def run(self):
-        # Configuración del servidor TCP
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.bind((ESP32_HOST, ESP32_PORT))
-            s.listen()
-            print("El servidor está esperando conexiones en el puerto", ESP32_PORT)
-
-            conn, addr = s.accept()  # Acepta una conexión
-            with conn:
-                print('Conectado por', addr)
-                
-                # Emitir la conexión al MainWindow
-                self.connection_signal.emit(conn)
-
-                while True:
-                    data = conn.recv(1024)  # Recibe hasta 1024 bytes del cliente
-                    if not data:
-                        break  # Sale del bucle si no hay datos (conexión cerrada)
-                    mensaje = data.decode('utf-8')
-                    print("Datos recibidos:", mensaje)  # Muestra el mensaje recibido
-
-                    # Intenta guardar el mensaje recibido en la base de datos
-                    try:
-                        guardar_datos(mensaje)  # Guarda los datos en la base de datos SQLite
-                    except Exception as e:
-                        print("Error al guardar los datos en la base de datos:", e)
-
-                    # Emitir los datos para actualizar la interfaz
-                    self.new_data_signal.emit(mensaje)
-
-                    # Enviar una respuesta de confirmación al ESP32
-                    respuesta = "ACK"
-                    conn.sendall(respuesta.encode('utf-8'))
+        self.lotes.iniciar()
+        try:
+            leer_visor(self.host, self.port, self.procesar_mensaje, self.detener)
+        finally:
+            self.lotes.detener()
+
+    def procesar_mensaje(self, dispositivo, mensaje):
+        # También aquí se parsea fuera del hilo de la interfaz
+        parser = self.parsers.get(dispositivo)
+        if parser is None:
+            parser = self.parsers[dispositivo] = Parser(dispositivo)
+        self.lotes.agregar(parser.parsear(mensaje))
+
+    def stop(self):
+        self.detener.set()
+        self.wait(2000)
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    history_signal = pyqtSignal()  # Llega una página del histórico (desde otro hilo)
+    START_COMMAND = "start"  # Texto de los botones de inicio y parada para el firmware
+    STOP_COMMAND = "stop"
+
+    def __init__(self, collector_address=None):
         super(MainWindow, self).__init__()
         loadUi("interfaz.ui", self)
 
         print("Interfaz cargada correctamente.")
         self.socket = None
         self.monitoring = False
-        self.esp32_connection = None
         self.initUI()
 
         # Renombrar botones
         self.rename_buttons()
 
-        # Inicializa la base de datos
-        inicializar_db()
+        if collector_address is None:
+            # Inicializa la base de datos
+            inicializar_db()
 
-        # Crea el hilo para el servidor
-        self.server_thread = ServerThread()
+            # Crea el hilo para el servidor
+            self.server_thread = ServerThread()
+        else:
+            # Solo visor: los datos los recibe y guarda un colector independiente
+            self.server_thread = ViewerThread(collector_address)
         self.server_thread.new_data_signal.connect(self.update_graph_and_data)
-        self.server_thread.connection_signal.connect(self.set_esp32_connection)  # Conectar para obtener la conexión
         self.server_thread.start()
 
-    def set_esp32_connection(self, conn):
-        # Almacenar la conexión de la ESP32
-        self.esp32_connection = conn
-        print("Conexión con ESP32 establecida.")
-
     def initUI(self):
         # Crear el PlotWidget dinámicamente
         self.graphWidget = PlotWidget(self.centralwidget)
@@ -109,19 +152,29 @@ class MainWindow(QMainWindow):
         self.graphWidget.setGeometry(10, 10, 400, 300)  # Ajusta según el diseño
         self.graphWidget.setTitle("Temperatura y Humedad")
         self.graphWidget.setBackground("w")
-        self.graphWidget.addLegend()
-
-        # Configurar gráficos
-        self.temp_plot = self.graphWidget.plot(pen="r", name="Temperatura (C)")
-        self.hum_plot = self.graphWidget.plot(pen="b", name="Humedad (%)")
-
-        # Variables para almacenar datos
-        self.temp_data = []
-        self.hum_data = []
 
-        # Configurar el temporizador para actualizar los datos
+        # Redibuja la gráfica solo cuando hay datos nuevos, como máximo a FPS_GRAFICA
+        self.render = PlanificadorRender(self.update_graph, fps=FPS_GRAFICA, parent=self)
+
+        # Series de cada dispositivo (en vivo y en el histórico); la lista
+        # permite mostrarlas u ocultarlas
+        self.deviceList = QListWidget(self.centralwidget)
+        self.deviceList.setObjectName("deviceList")
+        self.deviceList.setGeometry(420, 10, 250, 300)
+        self.series = SeriesDispositivos(self.graphWidget, self.deviceList, VENTANA_GRAFICA,
+                                         max_visibles=MAX_VISIBLES, al_cambiar=self.on_series_changed)
+
+        # Histórico guardado: se lee por páginas al desplazar o hacer zoom en la gráfica
+        self.history_mode = False
+        self.historial = HistorialSensores(db_filename, reduccion=REDUCCION_HISTORIAL)
+        self.history_signal.connect(self.update_history)
+        self.graphWidget.sigXRangeChanged.connect(self.on_range_changed)
+        self.pushButton_3.clicked.connect(self.toggle_history)
+        self.pushButton_3.setText("Historial")
+
+        # Configurar el temporizador para mostrar los tiempos de dibujo en la barra de estado
         self.timer = QTimer()
-        self.timer.timeout.connect(self.update_graph)
+        self.timer.timeout.connect(self.update_status)
 
         # Conectar los botones a sus funciones
         self.pushButton.clicked.connect(self.start_monitoring)
@@ -142,6 +195,7 @@ class MainWindow(QMainWindow):
         if not self.monitoring:
             self.monitoring = True
             self.timer.start(1000)  # Actualiza cada segundo
+            self.update_status()
 
     def stop_monitoring(self):
         # Detiene el monitoreo
@@ -152,51 +206,161 @@ class MainWindow(QMainWindow):
 
     def update_graph(self):
         # Actualiza el gráfico
-        self.temp_plot.setData(self.temp_data)
-        self.hum_plot.setData(self.hum_data)
-
-    def update_graph_and_data(self, data):
-        # Parsear los datos recibidos
-        try:
-            # Eliminar etiquetas y unidades
-            parsed_data = data.replace("Temperatura:", "").replace("Humedad:", "")
-            parsed_data = parsed_data.replace("Â°C", "").replace("%", "")
-            temp, hum = map(float, parsed_data.split(","))
-
-            self.temp_data.append(temp)
-            self.hum_data.append(hum)
-
-            # Limitar la cantidad de datos mostrados
-            if len(self.temp_data) > 100:
-                self.temp_data.pop(0)
-                self.hum_data.pop(0)
-
-            # Actualizar el gráfico
-            self.update_graph()
-        except ValueError:
-            print("Error al parsear los datos:", data)
+        if self.history_mode:
+            return
+        self.series.dibujar(self.graphWidget.width())
+
+    def toggle_history(self):
+        # Alterna entre la gráfica en vivo y el histórico guardado
+        if not self.history_mode:
+            # Es un slot de Qt: ninguna excepción debe salir de aquí
+            try:
+                if self.historial.migrando():
+                    self.statusbar.showMessage(
+                        "Migrando la base de datos al esquema nuevo; el histórico estará disponible al terminar", 5000)
+                    return
+                rango = self.historial.rango_total()
+                if rango is None:
+                    print("No hay datos guardados para mostrar.")
+                    return
+                fin = rango[1] / 1000
+                inicio = max(rango[0] / 1000, fin - 24 * 3600)  # Último día
+                # También los dispositivos que solo tienen datos guardados
+                self.series.registrar(self.historial.dispositivos())
+            except Exception as e:
+                print("Error al leer el histórico:", e)
+                return
+            self.history_mode = True
+            self.series.activar(False)
+            self.graphWidget.setAxisItems({"bottom": DateAxisItem()})
+            self.graphWidget.enableAutoRange(x=False)
+            self.graphWidget.setXRange(inicio, fin, padding=0)
+            self.pushButton_3.setText("En vivo")
+            self.update_history()
+        else:
+            self.history_mode = False
+            self.series.dibujar_historial({})
+            self.series.activar(True)
+            self.graphWidget.setAxisItems({"bottom": AxisItem("bottom")})
+            self.graphWidget.enableAutoRange()
+            self.pushButton_3.setText("Historial")
+            self.render.forzar()
+
+    def on_range_changed(self):
+        if self.history_mode:
+            self.update_history()
+
+    def on_series_changed(self):
+        # Se ha mostrado u ocultado algún dispositivo en la lista
+        if self.history_mode:
+            self.update_history()
+        else:
+            self.render.forzar()
+
+    def update_history(self):
+        # Dibuja las páginas del histórico ya cargadas para el rango visible;
+        # las que faltan se piden en segundo plano y llegan por history_signal
+        if not self.history_mode:
+            return
+        inicio, fin = self.graphWidget.viewRange()[0]
+        datos = self.historial.solicitar(inicio * 1000, fin * 1000, self.series.visibles(),
+                                         self.history_signal.emit)
+        self.series.dibujar_historial(datos)
+
+    def update_status(self):
+        # Muestra los tiempos de dibujo medidos en la barra de estado
+        self.statusbar.showMessage(self.render.resumen())
+
+    def update_graph_and_data(self, lecturas):
+        # Las Lecturas llegan ya parseadas y agrupadas desde el hilo de
+        # ingesta: aquí solo se reparten por dispositivo, se añaden a cada
+        # serie de una vez y se marca la gráfica
+        por_dispositivo = {}
+        for lectura in lecturas:
+            if lectura.temperatura is None or lectura.humedad is None:
+                log.warning("Error al parsear los datos: %s", lectura.datos)
+                continue
+            valores = por_dispositivo.get(lectura.dispositivo)
+            if valores is None:
+                valores = por_dispositivo[lectura.dispositivo] = ([], [])
+            valores[0].append(lectura.temperatura)
+            valores[1].append(lectura.humedad)
+
+        # Marcar la gráfica para redibujarla en el próximo cuadro (solo si
+        # ha cambiado algún dispositivo visible)
+        if self.series.extender(por_dispositivo):
+            self.render.marcar_sucio()
 
     def send_start_command(self):
         # Enviar comando de inicio a la ESP32
-        self.send_command_to_esp32("start")
+        self.send_command_to_esp32(self.START_COMMAND)
 
     def send_stop_command(self):
         # Enviar comando de parada a la ESP32
-        self.send_command_to_esp32("stop")
+        self.send_command_to_esp32(self.STOP_COMMAND)
 
     def send_command_to_esp32(self, command):
-        if self.esp32_connection:
-            try:
-                self.esp32_connection.sendall(command.encode('utf-8'))
-                print(f"Comando enviado a la ESP32: {command}")
-            except Exception as e:
-                print(f"Error al enviar el comando a la ESP32: {e}")
-        else:
+        # El envío lo hace el servidor de ingesta en su hilo, así que la
+        # interfaz no se bloquea aunque un ESP32 no lea. Va a los dispositivos
+        # seleccionados en la lista o, si no hay ninguno, a todos.
+        colector = getattr(self.server_thread, "colector", None)
+        if colector is None:
+            print("No hay conexión con la ESP32 para enviar comandos.")  # Modo visor
+            return
+        try:
+            futuro = colector.servidor.comandos.enviar(command, self.series.seleccionados() or None)
+        except ConnectionError as e:
+            print(f"Error al enviar el comando a la ESP32: {e}")
+            return
+        futuro.add_done_callback(lambda futuro: self.report_command(command, futuro))
+
+    def report_command(self, command, future):
+        # Se llama desde el hilo del servidor cuando el comando ha salido hacia todos
+        try:
+            resultados = future.result()
+        except Exception as e:
+            print(f"Error al enviar el comando a la ESP32: {e}")
+            return
+        if not resultados:
             print("No hay conexión con la ESP32 para enviar comandos.")
+        for dispositivo, resultado in resultados.items():
+            if isinstance(resultado, Exception):
+                print(f"Error al enviar el comando a {dispositivo}: {resultado}")
+            else:
+                print(f"Comando enviado a {dispositivo}: {command}")
+
+# Inicializa la aplicación con la ventana indicada (ver bancachat.py)
+def main(ventana=MainWindow):
+    global retencion, INTERVALO_LOTES
+    # Con --conectar HOST:PUERTO la interfaz solo muestra los datos de un
+    # colector ya en marcha (python colector.py)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--conectar", metavar="HOST:PUERTO")
+    parser.add_argument("--metricas", metavar="PUERTO|RUTA")  # Endpoint local de Prometheus
+    parser.add_argument("--log", default="INFO")  # Nivel de registro de la ingesta
+    parser.add_argument("--lotes-ms", type=float, default=INTERVALO_LOTES * 1000)  # Cadencia de envío a la interfaz
+    parser.add_argument("--retencion", action="store_true")  # Borra los datos antiguos (ver retencion.POLITICA)
+    args, argumentos_qt = parser.parse_known_args()
+    if args.retencion and retencion is None:
+        retencion = Retencion(db_filename)
+    INTERVALO_LOTES = args.lotes_ms / 1000
+
+    registro.configurar(args.log)
+
+    if args.metricas:
+        metricas.publicar(args.metricas)
+
+    app = QApplication(sys.argv[:1] + argumentos_qt)
+    window = ventana(args.conectar)
+    window.show()
+    codigo = app.exec_()
+    window.server_thread.stop()
+    window.historial.cerrar()
+    if retencion is not None:
+        retencion.detener()
+    escritor.detener()  # Escribe las filas pendientes antes de salir
+    sys.exit(codigo)
+
 
-# Inicializa la aplicación
 if __name__ == "__main__":
-    app = QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
-    sys.exit(app.exec_())
+    main()
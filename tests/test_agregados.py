@@ -0,0 +1,148 @@
+import sqlite3
+import threading
+import time
+
+import agregados
+from escritor_db import EscritorDB
+from historial import HistorialSensores
+from lectura import Lectura
+
+MINUTO = agregados.NIVELES["1m"]
+INICIO = 1_700_000_000_000 - 1_700_000_000_000 % agregados.NIVELES["1d"]
+
+
+def lectura(timestamp, temperatura, dispositivo, humedad=50.0):
+    return Lectura(timestamp, temperatura, humedad, *[None] * 8, None, dispositivo)
+
+
+def guardar(db, lecturas):
+    escritor = EscritorDB(db, spool=False)
+    escritor.iniciar()
+    for l in lecturas:
+        escritor.guardar(l)
+    escritor.detener()
+
+
+def dos_placas(db):
+    # Dos placas con temperaturas muy distintas, intercaladas en los mismos
+    # minutos; la placa b no mide humedad
+    guardar(db, [lectura(INICIO + i * 1000, 10.0 + i % 3, "a") if i % 2 else
+                 lectura(INICIO + i * 1000, 30.0, "b", humedad=None)
+                 for i in range(240)])
+
+
+def filas(db, sql, *parametros):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute(sql, parametros).fetchall()
+    finally:
+        conn.close()
+
+
+def test_agregados_por_dispositivo(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    dos_placas(db)
+    ids = dict(filas(db, "SELECT nombre, id FROM dispositivos"))
+    por_dispositivo = filas(db, '''
+        SELECT dispositivo, COUNT(*), SUM(n), MIN(temperatura_min), MAX(temperatura_max)
+        FROM sensores_1m GROUP BY dispositivo ORDER BY dispositivo''')
+    assert por_dispositivo == sorted([(ids["a"], 4, 120, 10.0, 12.0), (ids["b"], 4, 120, 30.0, 30.0)])
+    assert sorted(filas(db, "SELECT dispositivo, n, temperatura_min, temperatura_max FROM sensores_1d")) == \
+        sorted([(ids["a"], 120, 10.0, 12.0), (ids["b"], 120, 30.0, 30.0)])
+
+
+def test_reconstruir_da_las_mismas_filas(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    dos_placas(db)
+    tablas = [agregados.tabla(nivel) for nivel in agregados.NIVELES]
+    antes = [filas(db, f"SELECT * FROM {t} ORDER BY dispositivo, bucket") for t in tablas]
+    conn = sqlite3.connect(db, isolation_level=None)
+    agregados.reconstruir(conn)
+    conn.close()
+    assert [filas(db, f"SELECT * FROM {t} ORDER BY dispositivo, bucket") for t in tablas] == antes
+
+
+def test_consultar_todos_los_dispositivos(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    dos_placas(db)
+    conn = sqlite3.connect(db)
+    bucket, n, minimo, maximo, media, ultimo = agregados.consultar(conn, "1d", INICIO, INICIO + MINUTO * 10)[0]
+    conn.close()
+    assert (bucket, n, minimo, maximo) == (INICIO, 240, 10.0, 30.0)
+    assert ultimo == 10.0 + 239 % 3  # La última lectura es de la placa a
+
+
+def test_tablas_anteriores_se_conservan_sin_dispositivo(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    conn = sqlite3.connect(db, isolation_level=None)
+    columnas = ", ".join(f"{c} REAL" for c in agregados._columnas())
+    for nivel in agregados.NIVELES:
+        conn.execute(f"CREATE TABLE {agregados.tabla(nivel)} "
+                     f"(bucket INTEGER PRIMARY KEY, n INTEGER NOT NULL, ts_last INTEGER NOT NULL, {columnas})")
+    conn.execute("INSERT INTO sensores_1d (bucket, n, ts_last, temperatura_n, temperatura_min) "
+                 "VALUES (?, 5, ?, 5, 19.5)", (INICIO, INICIO))
+    agregados.crear_tablas(conn)
+    assert conn.execute("SELECT dispositivo, bucket, n, temperatura_min FROM sensores_1d").fetchall() == [
+        (agregados.SIN_DISPOSITIVO, INICIO, 5, 19.5)]
+    conn.close()
+
+
+def test_historial_por_dispositivo(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    dos_placas(db)
+    historial = HistorialSensores(db)
+    try:
+        assert sorted(historial.dispositivos()) == ["a", "b"]
+        for fin in (INICIO + 4 * MINUTO, INICIO + 30 * 24 * 3600_000):  # Filas y agregados
+            cargada = threading.Event()
+            for _ in range(50):
+                datos = historial.solicitar(INICIO, fin, ["a", "b", "desconocida"], cargada.set)
+                if all(len(datos[nombre][0][0]) for nombre in ("a", "b")):
+                    break
+                cargada.wait(0.1)
+                cargada.clear()
+            assert set(datos) == {"a", "b"}
+            (_, temperatura_a), _ = datos["a"]
+            (_, temperatura_b), _ = datos["b"]
+            assert len(temperatura_a) and set(temperatura_a) <= {10.0, 11.0, 12.0}
+            assert len(temperatura_b) and set(temperatura_b) == {30.0}
+    finally:
+        historial.cerrar()
+
+
+def test_historial_no_disponible_durante_la_migracion(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE sensores (id INTEGER PRIMARY KEY, timestamp TEXT, datos TEXT)")
+    conn.close()
+    historial = HistorialSensores(db)
+    try:
+        assert historial.migrando()
+        dos_placas(db)  # EscritorDB migra al iniciar
+        assert not historial.migrando()
+    finally:
+        historial.cerrar()
+
+
+def test_agregados_tras_migrar_el_esquema_antiguo(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE sensores (id INTEGER PRIMARY KEY, timestamp TEXT, datos TEXT)")
+    conn.executemany("INSERT INTO sensores (timestamp, datos) VALUES (?, ?)",
+                     [(f"2023-11-15T10:{i:02d}:00", f"{20.0 + i},40.0") for i in range(5)])
+    conn.commit()
+    conn.close()
+    escritor = EscritorDB(db, spool=False)
+    escritor.iniciar()
+    try:
+        # Los agregados de las filas migradas se calculan en segundo plano
+        for _ in range(100):
+            if filas(db, "SELECT name FROM sqlite_master WHERE name = 'sensores_1d'") and \
+                    filas(db, "SELECT 1 FROM sensores_1d"):
+                break
+            time.sleep(0.05)
+    finally:
+        escritor.detener()
+    assert filas(db, "SELECT dispositivo, n, temperatura_n, humedad_n, temperatura_min, temperatura_max "
+                     "FROM sensores_1d") == [(agregados.SIN_DISPOSITIVO, 5, 5, 5, 20.0, 24.0)]
+    assert filas(db, "SELECT COUNT(*), SUM(n) FROM sensores_1m") == [(5, 5)]
@@ -0,0 +1,88 @@
+import socket
+import threading
+import time
+
+import pytest
+
+import protocolo
+from colector import Colector
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def colector(tmp_path):
+    puerto = puerto_libre()
+    colector = Colector("127.0.0.1", puerto, db=str(tmp_path / "sensores.db"))
+    hilo = threading.Thread(target=colector.ejecutar)
+    hilo.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", puerto), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.02)
+    yield colector.servidor.comandos, puerto
+    colector.detener()
+    hilo.join(5)
+
+
+def conectar(puerto, nombre):
+    # ESP32 en protocolo de texto identificado con su nombre
+    s = socket.create_connection(("127.0.0.1", puerto))
+    s.settimeout(3)
+    s.sendall(protocolo.identificacion(nombre))
+    recibido = b""
+    while protocolo.RESPUESTA_ID not in recibido:
+        recibido += s.recv(4096)
+    return s
+
+
+def leer_comando(s):
+    # "CMD <id> <comando>" -> (id, comando)
+    recibido = b""
+    while not recibido.endswith(b"\n"):
+        recibido += s.recv(4096)
+    _, id_, comando = recibido.decode().split(None, 2)
+    return int(id_), comando.strip()
+
+
+def test_respuestas_por_id(colector):
+    comandos, puerto = colector
+    with conectar(puerto, "placa1") as uno, conectar(puerto, "placa2") as dos:
+        futuro = comandos.enviar("LEER", ["placa1", "placa2"], esperar=True, timeout=3)
+        id_uno, comando = leer_comando(uno)
+        id_dos, _ = leer_comando(dos)
+        assert comando == "LEER" and id_uno != id_dos
+        # Un id de otra conexión no se acepta; las respuestas llegan en otro orden
+        uno.sendall(f"RESP {id_dos} falsa\n".encode())
+        dos.sendall(f"RESP {id_dos} 22.5\n".encode())
+        uno.sendall(f"RESP {id_uno} 21.0\n".encode())
+        assert futuro.result(5) == {"placa1": "21.0", "placa2": "22.5"}
+    assert comandos.estadisticas() == {"enviados": 2, "respondidos": 2, "fallidos": 0, "pendientes": 0}
+
+
+def test_sin_respuesta_a_tiempo(colector):
+    comandos, puerto = colector
+    with conectar(puerto, "placa1") as s:
+        resultado = comandos.enviar("LEER", "placa1", esperar=True, timeout=0.2).result(5)
+        assert isinstance(resultado["placa1"], TimeoutError)
+        # La respuesta tardía se ignora
+        id_, _ = leer_comando(s)
+        s.sendall(f"RESP {id_} 21.0\n".encode())
+        assert comandos.enviar("STOP", "placa1").result(5) == {"placa1": None}
+    assert comandos.estadisticas() == {"enviados": 2, "respondidos": 0, "fallidos": 1, "pendientes": 0}
+
+
+def test_dispositivo_desconocido(colector):
+    comandos, puerto = colector
+    with conectar(puerto, "placa1") as s:
+        resultado = comandos.enviar("STOP", ["placa1", "nadie"]).result(5)
+        assert resultado["placa1"] is None
+        assert isinstance(resultado["nadie"], ConnectionError)
+        assert s.recv(4096) == b"STOP"
+    assert comandos.estadisticas()["fallidos"] == 1
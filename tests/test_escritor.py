@@ -0,0 +1,95 @@
+import sqlite3
+import threading
+import time
+
+import escritor_db
+from escritor_db import EscritorDB
+from lectura import Lectura
+from spool import Spool
+
+
+def lecturas(desde, hasta):
+    return [Lectura(i, float(i), 50.0, *[None] * 9) for i in range(desde, hasta)]
+
+
+def contar(db):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM sensores").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_lotes_limitados_por_filas(tmp_path):
+    tamanos = []
+    escritor = EscritorDB(str(tmp_path / "sensores.db"), max_filas=50, max_latencia=1.0,
+                          al_escribir=lambda lote: tamanos.append(len(lote)))
+    escritor.iniciar()
+    for lectura in lecturas(0, 1000):
+        escritor.guardar(lectura)
+    escritor.detener()
+    assert sum(tamanos) == 1000
+    assert max(tamanos) == 50
+
+
+def test_lote_incompleto_se_guarda_tras_max_latencia(tmp_path):
+    guardado = threading.Event()
+    escritor = EscritorDB(str(tmp_path / "sensores.db"), max_filas=500, max_latencia=0.05,
+                          al_escribir=lambda lote: guardado.set())
+    escritor.iniciar()
+    try:
+        t0 = time.monotonic()
+        escritor.guardar(lecturas(0, 1)[0])
+        assert guardado.wait(2)
+        assert time.monotonic() - t0 < 0.5
+    finally:
+        escritor.detener()
+
+
+def test_error_en_al_escribir_no_detiene_el_escritor(tmp_path):
+    db = str(tmp_path / "sensores.db")
+
+    def falla(lote):
+        raise RuntimeError("fallo en el callback")
+
+    escritor = EscritorDB(db, max_filas=10, al_escribir=falla)
+    escritor.iniciar()
+    for lectura in lecturas(0, 100):
+        escritor.guardar(lectura)
+    escritor.detener()
+    assert contar(db) == 100
+    assert escritor.error is None
+
+
+def test_fallo_al_migrar_no_bloquea_detener(tmp_path, monkeypatch):
+    db = str(tmp_path / "sensores.db")
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE sensores (id INTEGER PRIMARY KEY, timestamp TEXT, datos TEXT)")
+    conn.close()
+
+    def falla(conn):
+        raise sqlite3.DatabaseError("migración imposible")
+
+    monkeypatch.setattr(escritor_db, "migrar", falla)
+    escritor = EscritorDB(db, max_cola=10)
+    escritor.iniciar()
+    for lectura in lecturas(0, 50):
+        escritor.guardar(lectura)  # La cola se llena y el resto va al spool
+    errores = []
+
+    def detener():
+        try:
+            escritor.detener()
+        except sqlite3.DatabaseError as e:
+            errores.append(e)
+
+    hilo = threading.Thread(target=detener)
+    hilo.start()
+    hilo.join(5)
+    assert not hilo.is_alive()
+    assert errores == [escritor.error]
+
+    # Ninguna lectura se pierde: todas quedan en el spool, en orden
+    spool = Spool(escritor.directorio_spool)
+    assert [l.timestamp for l in spool.leer(100)[0]] == list(range(50))
+    spool.cerrar()
@@ -0,0 +1,50 @@
+import math
+import random
+import statistics
+
+import pytest
+
+from estadisticas import VentanaDeslizante
+
+
+def test_igual_que_recalcular_la_ventana():
+    aleatorio = random.Random(1)
+    ventana = VentanaDeslizante(tamano=50)
+    valores = []
+    for _ in range(2000):
+        valor = aleatorio.uniform(-10, 40)
+        ventana.agregar(valor)
+        valores = (valores + [valor])[-50:]
+        assert (ventana.minimo, ventana.maximo) == (min(valores), max(valores))
+        assert ventana.media == pytest.approx(statistics.fmean(valores))
+        if len(valores) > 1:
+            assert ventana.varianza == pytest.approx(statistics.variance(valores))
+
+
+def test_precision_con_valores_parecidos():
+    # Muchas temperaturas alrededor de 20 °C: la varianza real es 1e-6
+    ventana = VentanaDeslizante(tamano=1000)
+    for i in range(200000):
+        ventana.agregar(20.0 + (0.001 if i % 2 else -0.001))
+    assert ventana.media == pytest.approx(20.0, abs=1e-12)
+    assert ventana.varianza == pytest.approx(1e-6 * 1000 / 999, rel=1e-6)
+    assert ventana.desviacion == pytest.approx(math.sqrt(ventana.varianza))
+
+
+def test_ventana_por_tiempo():
+    ventana = VentanaDeslizante(segundos=10)
+    for t, valor in enumerate([5.0, 1.0, 9.0, 3.0]):
+        ventana.agregar(valor, t=t * 5)
+    # En t=15 quedan las muestras de t=5, 10 y 15
+    assert len(ventana) == 3
+    assert (ventana.minimo, ventana.maximo, ventana.media) == (1.0, 9.0, pytest.approx(13 / 3))
+
+
+def test_ignora_valores_que_faltan():
+    ventana = VentanaDeslizante(tamano=3)
+    ventana.agregar(None)
+    ventana.agregar(float("nan"))
+    assert len(ventana) == 0
+    assert (ventana.minimo, ventana.media, ventana.varianza) == (None, None, None)
+    ventana.agregar(2.0)
+    assert (ventana.media, ventana.varianza) == (2.0, None)
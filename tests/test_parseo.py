@@ -0,0 +1,93 @@
+import pytest
+
+import parseo
+from parseo import CLAVES, ETIQUETAS, SIMPLE, Parser, detectar, reparar
+
+CLAVES_COMPLETAS = ("T_Inst:21.37°C,T_Max:22.00°C,T_Min:20.10°C,T_Avg:21.20°C,"
+                    "H_Inst:40.12%,H_Max:42.00%,H_Min:39.00%,H_Avg:40.50%")
+
+
+@pytest.mark.parametrize("mensaje, formato", [
+    ("21.3,40.1", SIMPLE),
+    ("Temperatura: 21.3°C, Humedad: 40.1%", ETIQUETAS),
+    ("temperatura:21.3,humedad:40.1", ETIQUETAS),
+    (CLAVES_COMPLETAS, CLAVES),
+    ("T_Avg:21.2°C,H_Avg:40.5%", CLAVES),
+    ("hola", None),
+    ("1,2,3", None),
+    ("X_Raro:1,H_Avg:2", None),
+])
+def test_detectar(mensaje, formato):
+    assert detectar(mensaje)[0] == formato
+
+
+@pytest.mark.parametrize("texto, esperado", [
+    ("21.3Â°C", "21.3°C"),
+    ("TÃ©rmica", "Térmica"),
+    ("21.3°C", "21.3°C"),
+    ("Â sin arreglo €", "Â sin arreglo €"),  # No es Latin-1: se deja igual
+])
+def test_reparar(texto, esperado):
+    assert reparar(texto) == esperado
+
+
+@pytest.mark.parametrize("mensaje", [
+    "Temperatura: 21.3°C, Humedad: 40.1%",
+    "Temperatura: 21.3Â°C, Humedad: 40.1%",      # UTF-8 leído como Latin-1
+    "Temperatura: 21.3�C, Humedad: 40.1%",  # Carácter de reemplazo
+])
+def test_unidades_mal_codificadas_no_impiden_el_parseo(mensaje):
+    lectura = Parser().parsear(mensaje, 0)
+    assert (lectura.temperatura, lectura.humedad, lectura.datos) == (21.3, 40.1, None)
+
+
+def test_claves_rellenan_todos_los_canales():
+    lectura = Parser("placa").parsear(CLAVES_COMPLETAS, 5)
+    assert lectura.timestamp == 5
+    assert lectura.dispositivo == "placa"
+    assert (lectura.temperatura, lectura.humedad) == (21.37, 40.12)  # Valores instantáneos
+    assert (lectura.t_max, lectura.t_min, lectura.t_avg) == (22.0, 20.1, 21.2)
+    assert (lectura.h_max, lectura.h_min, lectura.h_avg) == (42.0, 39.0, 40.5)
+
+
+def test_claves_en_otro_orden_y_placas_antiguas():
+    lectura = Parser().parsear("H_Avg:40.5%,T_Avg:21.2°C", 0)
+    # Sin valor instantáneo se usa el promedio
+    assert (lectura.temperatura, lectura.humedad) == (21.2, 40.5)
+    assert lectura.t_inst is None
+
+
+def test_recuerda_el_formato_y_lo_detecta_de_nuevo_si_cambia():
+    parser = Parser()
+    for mensaje in ("21.0,40.0", "22.0,41.0"):
+        parser.parsear(mensaje, 0)
+    assert (parser.formato, parser.detecciones) == (SIMPLE, 1)
+    lectura = parser.parsear("Temperatura: 23.0°C, Humedad: 42.0%", 0)
+    assert (lectura.temperatura, lectura.humedad) == (23.0, 42.0)
+    assert (parser.formato, parser.detecciones, parser.errores) == (ETIQUETAS, 2, 0)
+
+
+def test_mensaje_no_reconocido_guarda_el_texto_reparado():
+    parser = Parser("placa")
+    lectura = parser.parsear("Error del sensor: 50Â°C", 7)
+    assert lectura.temperatura is None and lectura.humedad is None
+    assert lectura.datos == "Error del sensor: 50°C"
+    assert lectura.dispositivo == "placa"
+    assert parser.errores == 1
+
+
+def test_identificar_cambia_el_dispositivo():
+    parser = Parser("127.0.0.1")
+    parser.parsear("21.0,40.0", 0)
+    parser.identificar("esp32-cocina")
+    assert parser.parsear("21.0,40.0", 0).dispositivo == "esp32-cocina"
+
+
+def test_funciones_sueltas_sin_estado_compartido():
+    assert parseo.parsear("21.0,40.0", 0).temperatura == 21.0
+    assert parseo.temperatura_humedad("Temperatura: 21.3Â°C, Humedad: 40.1%") == (21.3, 40.1)
+    with pytest.raises(ValueError):
+        parseo.temperatura_humedad("hola")
+    # Un mensaje de otro formato no cambia cómo se interpreta el siguiente
+    assert parseo.parsear("T_Avg:1,H_Avg:2", 0).temperatura == 1.0
+    assert parseo.temperatura_humedad("3,4") == (3.0, 4.0)
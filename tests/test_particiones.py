@@ -0,0 +1,100 @@
+import calendar
+import os
+import sqlite3
+
+import pytest
+
+import particiones
+from esquema import crear_esquema
+from lectura import Lectura
+from particiones import DIA, EscrituraParticionada, periodo
+
+MARZO = calendar.timegm((2024, 3, 1, 0, 0, 0)) * 1000
+ABRIL = calendar.timegm((2024, 4, 1, 0, 0, 0)) * 1000
+
+
+def lectura(timestamp):
+    return Lectura(timestamp, 20.0, 50.0, *[None] * 9)
+
+
+@pytest.fixture
+def conexion(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    conn = sqlite3.connect(db, isolation_level=None)
+    crear_esquema(conn)
+    yield db, conn
+    conn.close()
+
+
+def guardar(escritura, conn, lote, ahora):
+    grupos = escritura.repartir(conn, lote, ahora)
+    conn.execute("BEGIN")
+    escritura.insertar(conn, grupos)
+    conn.execute("COMMIT")
+    return {archivo: len(filas) for (_, archivo), _, _, filas in grupos}
+
+
+def test_periodo():
+    assert periodo(MARZO + 5 * DIA + 1, "dia") == (MARZO + 5 * DIA, MARZO + 6 * DIA)
+    assert periodo(MARZO + 5 * DIA, "mes") == (MARZO, ABRIL)
+    diciembre = calendar.timegm((2023, 12, 31, 23, 0, 0)) * 1000
+    assert periodo(diciembre, "mes")[1] == calendar.timegm((2024, 1, 1, 0, 0, 0)) * 1000
+
+
+def test_nombre_archivo():
+    assert particiones.nombre_archivo("/datos/sensores.db", MARZO) == "sensores.2024-03.db"
+    assert particiones.nombre_archivo("sensores.db", MARZO + DIA, "dia") == "sensores.2024-03-02.db"
+
+
+def test_cada_fila_va_a_la_particion_de_su_periodo(conexion):
+    db, conn = conexion
+    escritura = EscrituraParticionada(db, "mes")
+    escritura.preparar(conn)
+    # Dentro de la gracia, una fila del mes anterior aún va a su partición
+    ahora = ABRIL + DIA // 2
+    repartidas = guardar(escritura, conn, [lectura(ABRIL - 1000), lectura(ABRIL + 1000)], ahora)
+    assert repartidas == {"sensores.2024-03.db": 1, "sensores.2024-04.db": 1}
+    for archivo in repartidas:
+        assert os.path.exists(particiones.ruta(db, archivo))
+    assert conn.execute("SELECT COUNT(*) FROM main.sensores").fetchone()[0] == 0
+
+
+def test_fila_tardia_va_a_la_particion_actual(conexion):
+    db, conn = conexion
+    escritura = EscrituraParticionada(db, "mes")
+    escritura.preparar(conn)
+    ahora = ABRIL + 10 * DIA
+    tardia = MARZO + DIA
+    assert guardar(escritura, conn, [lectura(tardia)], ahora) == {"sensores.2024-04.db": 1}
+    # El catálogo registra su timestamp, así que las consultas de marzo la encuentran
+    assert particiones.solapadas(conn, MARZO, ABRIL) == [("sensores.2024-04.db", tardia, tardia + 1, 0)]
+    with particiones.adjuntar(conn, MARZO, ABRIL) as sensores:
+        assert conn.execute(f"SELECT timestamp FROM {sensores}").fetchall() == [(tardia,)]
+    assert particiones.archivos(conn, MARZO, ABRIL) == [db, particiones.ruta(db, "sensores.2024-04.db")]
+
+
+def test_cerrar_particiones_vencidas(conexion, monkeypatch):
+    db, conn = conexion
+    monkeypatch.setattr(particiones, "ahora_ms", lambda: MARZO)
+    escritura = EscrituraParticionada(db, "dia", gracia=DIA)
+    escritura.preparar(conn)
+    guardar(escritura, conn, [lectura(MARZO + 1000)], MARZO + 1000)
+    escritura.cerrar_vencidas(conn, MARZO + 2 * DIA)
+    assert conn.execute("SELECT archivo, cerrada FROM particiones").fetchall() == [("sensores.2024-03-01.db", 1)]
+    particion = sqlite3.connect(particiones.ruta(db, "sensores.2024-03-01.db"))
+    assert particion.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    particion.close()
+    escritura.cerrar(conn)
+
+
+def test_sin_particiones_se_consulta_la_tabla_principal(conexion):
+    _, conn = conexion
+    assert particiones.solapadas(conn) == []
+    with particiones.adjuntar(conn) as sensores:
+        assert sensores == "sensores"
+
+
+def test_periodo_desconocido(conexion):
+    db, _ = conexion
+    with pytest.raises(ValueError):
+        EscrituraParticionada(db, "semana")
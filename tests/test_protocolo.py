@@ -0,0 +1,104 @@
+import math
+
+import pytest
+
+import protocolo
+from protocolo import DecodificadorBinario, codificar, formato_registro, negociar
+
+CANALES = ("temperatura", "humedad")
+FORMATO = formato_registro(CANALES)
+
+
+def bloque(secuencias, timestamp=1000, valores=(21.5, 40.0)):
+    return b"".join(codificar(s, timestamp + i, valores, FORMATO) for i, s in enumerate(secuencias))
+
+
+def test_negociar():
+    dec, nombre = negociar(b"HELLO BIN1 temperatura,humedad esp32-cocina")
+    assert dec.canales == CANALES
+    assert nombre == dec.dispositivo == "esp32-cocina"
+    assert dec.tamano_registro == FORMATO.size
+    assert negociar(b"HELLO ID esp32-sala") == (None, "esp32-sala")
+
+
+@pytest.mark.parametrize("saludo", [
+    b"HELLO BIN9 temperatura",
+    b"HELLO BIN1 temperatura,presion",
+    b"HELLO BIN1 temperatura,temperatura",
+    b"HELLO BIN1 temperatura nombre/raro",
+])
+def test_negociar_rechaza_saludos_no_validos(saludo):
+    with pytest.raises(ValueError):
+        negociar(saludo)
+
+
+def test_decodificar_lecturas():
+    dec = DecodificadorBinario(CANALES, "placa")
+    lecturas = dec.decodificar(bloque([1, 2]), recibido_ms=50000)
+    assert [(l.temperatura, l.humedad, l.dispositivo) for l in lecturas] == [(21.5, 40.0, "placa")] * 2
+    # El último registro se sitúa en el instante de recepción
+    assert [l.timestamp for l in lecturas] == [49999, 50000]
+
+
+def test_canal_sin_valor_se_guarda_como_none():
+    dec = DecodificadorBinario(CANALES)
+    lectura, = dec.decodificar(bloque([1], valores=(None, 40.0)), recibido_ms=0)
+    assert lectura.temperatura is None
+    assert lectura.humedad == 40.0
+
+
+def test_valor_instantaneo_rellena_temperatura_y_humedad():
+    canales = ("t_inst", "h_inst")
+    dec = DecodificadorBinario(canales)
+    datos = codificar(1, 0, (20.0, 30.0), formato_registro(canales))
+    lectura, = dec.decodificar(datos, recibido_ms=0)
+    assert (lectura.temperatura, lectura.humedad) == (20.0, 30.0)
+    assert not any(isinstance(v, float) and math.isnan(v) for v in lectura)
+
+
+def test_cuenta_los_registros_perdidos_entre_bloques():
+    dec = DecodificadorBinario(CANALES)
+    dec.decodificar(bloque([1, 2, 3]), recibido_ms=0)
+    assert dec.decodificar(bloque([6, 7, 10]), recibido_ms=0) == []
+    assert dec.perdidos == 2
+    assert dec.registros == 3
+    assert dec.ultima_secuencia == 10
+
+
+def test_secuencia_con_desbordamiento_no_es_un_hueco():
+    dec = DecodificadorBinario(CANALES)
+    dec.decodificar(bloque([0xFFFFFFFE, 0xFFFFFFFF]), recibido_ms=0)
+    dec.decodificar(bloque([0, 1]), recibido_ms=0)
+    assert dec.perdidos == 0
+
+
+def test_reinicio_del_reloj_del_esp32():
+    dec = DecodificadorBinario(CANALES)
+    dec.decodificar(bloque([1], timestamp=100000), recibido_ms=500000)
+    # millis() vuelve a empezar: se recalcula el desfase
+    lectura, = dec.decodificar(bloque([2], timestamp=10), recibido_ms=600000)
+    assert lectura.timestamp == 600000
+
+
+def test_saludo_e_identificacion():
+    assert protocolo.saludo(CANALES, "placa") == b"HELLO BIN1 temperatura,humedad placa\n"
+    assert protocolo.identificacion("placa") == b"HELLO ID placa\n"
+    assert protocolo.es_saludo(memoryview(b"HELLO ID placa"))
+
+
+def test_se_descarta_desde_el_hueco():
+    dec = DecodificadorBinario(CANALES)
+    dec.decodificar(bloque([5, 6, 7]), recibido_ms=0)
+    assert (dec.contigua, dec.hueco) == (7, False)
+    assert len(dec.decodificar(bloque([8, 10, 11]), recibido_ms=0)) == 1
+    assert (dec.contigua, dec.hueco) == (8, True)
+    # Tras el hueco no se acepta nada más en esta conexión
+    assert dec.decodificar(bloque([9, 10]), recibido_ms=0) == []
+    assert (dec.contigua, dec.registros) == (8, 4)
+
+
+def test_hueco_antes_del_primer_registro_del_bloque():
+    dec = DecodificadorBinario(CANALES)
+    dec.decodificar(bloque([1]), recibido_ms=0)
+    dec.decodificar(bloque([3, 4]), recibido_ms=0)
+    assert (dec.contigua, dec.hueco) == (1, True)
@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+
+import agregados
+import retencion
+from escritor_db import EscritorDB
+from esquema import INSERTAR_LECTURA, crear_esquema
+from lectura import Lectura
+from retencion import DIA, Retencion
+
+AHORA = 1_700_000_000_000 - 1_700_000_000_000 % DIA  # Medianoche UTC
+POLITICA = {"sensores": 7 * DIA, "1m": 30 * DIA, "1h": None, "1d": None}
+
+
+def lectura(timestamp, temperatura=20.0):
+    return Lectura(timestamp, temperatura, 50.0, *[None] * 9)
+
+
+def lecturas_por_hora(dias):
+    # Una lectura por hora durante los últimos dias días
+    return [lectura(AHORA - dias * DIA + h * 3600_000, 20.0 + h % 5) for h in range(dias * 24)]
+
+
+def contar(db, sql, *parametros):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute(sql, parametros).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_recalcula_los_agregados_antes_de_borrar(tmp_path):
+    # Base de datos con filas pero sin agregados (p. ej. anterior a ellos)
+    db = str(tmp_path / "sensores.db")
+    conn = sqlite3.connect(db)
+    crear_esquema(conn)
+    conn.executemany(INSERTAR_LECTURA, lecturas_por_hora(10))
+    conn.commit()
+    conn.close()
+
+    r = Retencion(db, POLITICA, pausa=0, lote=7)
+    r.pasada(AHORA)
+
+    corte = AHORA - 7 * DIA
+    assert r.dias_recalculados == 3
+    assert r.filas_borradas == 3 * 24
+    assert contar(db, "SELECT COUNT(*) FROM sensores WHERE timestamp < ?", corte) == 0
+    assert contar(db, "SELECT COUNT(*) FROM sensores") == 7 * 24
+    # Las filas borradas siguen contadas en los agregados
+    minutos = agregados.tabla("1m")
+    assert contar(db, f"SELECT SUM(n) FROM {minutos} WHERE bucket < ?", corte) == 3 * 24
+    assert contar(db, f"SELECT MAX(temperatura_max) FROM {minutos} WHERE bucket < ?", corte) == 24.0
+    assert contar(db, "SELECT podado_hasta FROM retencion WHERE tabla = 'sensores'") == corte
+
+
+def test_no_recalcula_agregados_completos(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    escritor = EscritorDB(db, spool=False)
+    escritor.iniciar()
+    for l in lecturas_por_hora(10):
+        escritor.guardar(l)
+    escritor.detener()
+
+    r = Retencion(db, POLITICA, pausa=0)
+    r.pasada(AHORA)
+    assert r.dias_recalculados == 0
+    assert r.filas_borradas == 3 * 24
+    # Una segunda pasada no vuelve a tocar los días ya podados
+    r.pasada(AHORA)
+    assert r.filas_borradas == 3 * 24
+
+
+def test_filas_que_llegan_tarde_a_un_dia_podado(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    conn = sqlite3.connect(db)
+    crear_esquema(conn)
+    conn.executemany(INSERTAR_LECTURA, lecturas_por_hora(10))
+    conn.commit()
+    r = Retencion(db, POLITICA, pausa=0)
+    r.pasada(AHORA)
+    conn.execute(INSERTAR_LECTURA, lectura(AHORA - 9 * DIA))
+    conn.commit()
+    r.pasada(AHORA)
+    assert contar(db, "SELECT COUNT(*) FROM sensores WHERE timestamp < ?", AHORA - 7 * DIA) == 0
+    conn.close()
+
+
+def test_validar_politica():
+    retencion.validar(POLITICA)
+    with pytest.raises(ValueError):
+        retencion.validar({"sensores": 30 * DIA, "1m": 7 * DIA, "1h": None, "1d": None})
+    with pytest.raises(ValueError):
+        Retencion("no_se_usa.db", {"sensores": None, "1m": DIA, "1h": None, "1d": None})
+
+
+def test_describir_politica():
+    assert retencion.describir(POLITICA) == "sensores 7d, 1m 30d, 1h para-siempre, 1d para-siempre"
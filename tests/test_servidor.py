@@ -0,0 +1,118 @@
+import socket
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import protocolo
+from colector import Colector
+
+CANALES = ("temperatura", "humedad")
+FORMATO = protocolo.formato_registro(CANALES)
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def colector(tmp_path):
+    puerto = puerto_libre()
+    colector = Colector("127.0.0.1", puerto, db=str(tmp_path / "sensores.db"))
+    colector.servidor.ack_intervalo = 0.05
+    hilo = threading.Thread(target=colector.ejecutar)
+    hilo.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", puerto), timeout=1).close()
+            break
+        except OSError:
+            time.sleep(0.02)
+    yield colector, puerto, tmp_path / "sensores.db"
+    colector.detener()
+    hilo.join(5)
+
+
+def leer_hasta(s, texto, timeout=3.0):
+    s.settimeout(timeout)
+    recibido = b""
+    while texto not in recibido:
+        datos = s.recv(4096)
+        if not datos:
+            break
+        recibido += datos
+    return recibido
+
+
+def leer_acks(s, espera=0.5):
+    s.settimeout(espera)
+    recibido = b""
+    try:
+        while True:
+            datos = s.recv(4096)
+            if not datos:
+                break
+            recibido += datos
+    except socket.timeout:
+        pass
+    return [int(linea.split()[1]) for linea in recibido.decode().splitlines() if linea.startswith("ACK ")]
+
+
+def registros(secuencias):
+    return b"".join(protocolo.codificar(s, s, (20.0 + s, 40.0), FORMATO) for s in secuencias)
+
+
+def temperaturas(db):
+    conn = sqlite3.connect(db)
+    try:
+        return [fila[0] - 20.0 for fila in conn.execute("SELECT temperatura FROM sensores ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def conectar(puerto):
+    s = socket.create_connection(("127.0.0.1", puerto))
+    s.sendall(protocolo.saludo(CANALES, "placa"))
+    assert protocolo.RESPUESTA_OK in leer_hasta(s, protocolo.RESPUESTA_OK)
+    return s
+
+
+def test_hueco_cierra_la_conexion_y_el_reenvio_no_duplica(colector):
+    _, puerto, db = colector
+    with conectar(puerto) as s:
+        s.sendall(registros(range(1, 6)))
+        assert leer_acks(s)[-1] == 5
+        s.sendall(registros([6, 8, 9]))  # Falta 7
+        # Se confirma lo anterior al hueco y se cierra la conexión
+        assert leer_acks(s) == [6]
+        assert s.recv(1) == b""
+    assert temperaturas(db) == [1, 2, 3, 4, 5, 6]
+
+    # El ESP32 reenvía desde su último ACK
+    with conectar(puerto) as s:
+        s.sendall(registros(range(7, 10)))
+        assert leer_acks(s)[-1] == 9
+    assert temperaturas(db) == list(range(1, 10))
+
+
+def test_registros_perdidos_en_el_esp32(colector):
+    # Si el ESP32 ya no tiene los registros que faltan, la nueva conexión
+    # empieza en el siguiente que tenga
+    _, puerto, db = colector
+    with conectar(puerto) as s:
+        s.sendall(registros([1, 2, 5]))
+        assert leer_acks(s) == [2]
+    with conectar(puerto) as s:
+        s.sendall(registros([5, 6]))
+        assert leer_acks(s)[-1] == 6
+    assert temperaturas(db) == [1, 2, 5, 6]
+
+
+def test_ack_de_texto_por_mensaje(colector):
+    _, puerto, _ = colector
+    with socket.create_connection(("127.0.0.1", puerto)) as s:
+        s.sendall(b"21.5,40.0\n")
+        assert leer_hasta(s, b"ACK") == b"ACK"
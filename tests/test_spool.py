@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+
+import pytest
+
+from escritor_db import EscritorDB
+from lectura import Lectura
+from spool import Spool, SpoolLleno
+
+
+def lecturas(desde, hasta):
+    return [Lectura(i, float(i), 50.0, *[None] * 9) for i in range(desde, hasta)]
+
+
+def timestamps(lista):
+    return [lectura.timestamp for lectura in lista]
+
+
+def test_lee_en_orden_entre_segmentos(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), max_segmento=200)
+    for i in range(0, 30, 3):
+        spool.agregar(lecturas(i, i + 3))
+    leidas = []
+    while not spool.vacio():
+        lote, posicion = spool.leer(7)
+        leidas += lote
+        spool.confirmar(posicion)
+    assert timestamps(leidas) == list(range(30))
+    assert spool.bytes == 0
+    spool.cerrar()
+
+
+def test_sin_confirmar_se_vuelve_a_entregar(tmp_path):
+    # Al menos una vez: lo leído y no confirmado se relee tras reiniciar
+    directorio = str(tmp_path / "spool")
+    spool = Spool(directorio)
+    spool.agregar(lecturas(0, 10))
+    lote, posicion = spool.leer(4)
+    spool.confirmar(posicion)
+    assert timestamps(spool.leer(4)[0]) == [4, 5, 6, 7]
+    spool.cerrar()
+
+    spool = Spool(directorio)
+    assert timestamps(spool.leer(100)[0]) == list(range(4, 10))
+    spool.cerrar()
+
+
+def test_linea_a_medias_se_ignora(tmp_path):
+    directorio = str(tmp_path / "spool")
+    spool = Spool(directorio)
+    spool.agregar(lecturas(0, 2))
+    spool.cerrar()
+    # Caída a mitad de escritura
+    segmento = [n for n in os.listdir(directorio) if n.endswith(".jsonl")][0]
+    with open(os.path.join(directorio, segmento), "ab") as f:
+        f.write(b'[2,2.0,50')
+
+    spool = Spool(directorio)
+    spool.agregar(lecturas(3, 4))
+    assert timestamps(spool.leer(100)[0]) == [0, 1, 3]
+    spool.cerrar()
+
+
+def test_lleno(tmp_path):
+    spool = Spool(str(tmp_path / "spool"), max_bytes=300)
+    with pytest.raises(SpoolLleno):
+        for i in range(100):
+            spool.agregar(lecturas(i, i + 1))
+    assert spool.rechazadas == 1
+    assert 0 < spool.bytes <= 300
+    spool.cerrar()
+
+
+def test_anteponer_va_delante_de_lo_pendiente(tmp_path):
+    spool = Spool(str(tmp_path / "spool"))
+    spool.agregar(lecturas(0, 6))
+    _, posicion = spool.leer(2)
+    spool.confirmar(posicion)
+    spool.anteponer(lecturas(100, 102))
+    assert timestamps(spool.leer(100)[0]) == [100, 101, 2, 3, 4, 5]
+    spool.cerrar()
+
+
+def filas(db):
+    conn = sqlite3.connect(db)
+    try:
+        return [fila[0] for fila in conn.execute("SELECT timestamp FROM sensores ORDER BY id")]
+    finally:
+        conn.close()
+
+
+def test_escritor_desborda_al_spool_y_conserva_el_orden(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    escritor = EscritorDB(db, max_cola=50, max_filas=20)
+    escritor.iniciar()
+    # Otra conexión bloquea la base de datos mientras llegan las lecturas
+    bloqueo = sqlite3.connect(db, isolation_level=None)
+    bloqueo.execute("BEGIN IMMEDIATE")
+    for lectura in lecturas(0, 2000):
+        escritor.guardar(lectura)
+    guardado = threading.Event()
+    escritor.confirmar(lambda ok: ok and guardado.set())
+    assert escritor.spool.escritas > 0
+    bloqueo.execute("COMMIT")
+    bloqueo.close()
+
+    assert guardado.wait(10)
+    escritor.detener()
+    assert filas(db) == list(range(2000))
+    assert Spool(escritor.directorio_spool).vacio()
+
+
+def test_spool_pendiente_se_guarda_al_iniciar(tmp_path):
+    db = str(tmp_path / "sensores.db")
+    # Lo que quedó en el spool de una ejecución anterior va antes que lo nuevo
+    spool = Spool(f"{db}.spool")
+    spool.agregar(lecturas(0, 100))
+    spool.cerrar()
+
+    escritor = EscritorDB(db)
+    escritor.iniciar()
+    for lectura in lecturas(100, 150):
+        escritor.guardar(lectura)
+    guardado = threading.Event()
+    escritor.confirmar(lambda ok: ok and guardado.set())
+    assert guardado.wait(10)
+    escritor.detener()
+    assert filas(db) == list(range(150))
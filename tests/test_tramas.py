@@ -0,0 +1,95 @@
+import pytest
+
+from tramas import MODO_FIJO, MODO_LINEA, MODO_LONGITUD, DecodificadorTramas
+
+
+def alimentar(decodificador, datos):
+    # Simula los recv_into() necesarios para recibir datos (cada uno llena
+    # como mucho el espacio libre) y devuelve las tramas completas
+    tramas = []
+    while datos:
+        libre = decodificador.buffer_libre()
+        n = min(len(libre), len(datos))
+        libre[:n] = datos[:n]
+        datos = datos[n:]
+        tramas += [bytes(trama) for trama in decodificador.recibidos(n)]
+    return tramas
+
+
+def test_lineas_partidas_entre_lecturas():
+    dec = DecodificadorTramas()
+    assert alimentar(dec, b"21.5,4") == []
+    assert dec.pendiente() == 6
+    assert alimentar(dec, b"0.1\r\n\n22.0,41.0\n23") == [b"21.5,40.1", b"22.0,41.0"]
+    assert alimentar(dec, b".0,42.0\n") == [b"23.0,42.0"]
+    assert dec.pendiente() == 0
+    assert dec.tramas == 3
+
+
+def test_linea_sobredimensionada_se_descarta_hasta_el_separador():
+    dec = DecodificadorTramas(tamano_buffer=64, max_trama=8)
+    assert alimentar(dec, b"x" * 20) == []
+    assert alimentar(dec, b"yyy\nok\n") == [b"ok"]
+    assert dec.sobredimensionadas == 1
+
+
+def test_compacta_el_buffer_al_llenarse():
+    # Trozos que casi nunca terminan en el separador: el buffer rara vez
+    # queda vacío y hay que mover la trama a medias al principio
+    dec = DecodificadorTramas(tamano_buffer=32, max_trama=8)
+    datos = b"1.5,40\n" * 50
+    recibidas = []
+    for i in range(0, len(datos), 5):
+        recibidas += alimentar(dec, datos[i:i + 5])
+    assert recibidas == [b"1.5,40"] * 50
+    assert dec.compactaciones > 0
+
+
+def test_finalizar_entrega_el_mensaje_sin_separador():
+    dec = DecodificadorTramas()
+    alimentar(dec, b"21.5,40.1")
+    assert dec.finalizar() == b"21.5,40.1"
+    assert dec.finalizar() is None
+    assert dec.parciales == 1
+
+
+def test_modo_longitud():
+    dec = DecodificadorTramas(MODO_LONGITUD, tamano_buffer=64, max_trama=8)
+    assert alimentar(dec, b"\x00\x03abc\x00") == [b"abc"]
+    assert alimentar(dec, b"\x02de") == [b"de"]
+    # Una trama mayor que max_trama se salta entera, aunque llegue por partes
+    assert alimentar(dec, b"\x00\x0a01234") == []
+    assert alimentar(dec, b"56789\x00\x01z") == [b"z"]
+    assert dec.sobredimensionadas == 1
+
+
+def test_modo_fijo_entrega_los_registros_completos_juntos():
+    dec = DecodificadorTramas(MODO_FIJO, tamano_registro=4)
+    assert alimentar(dec, b"aaaabbbbcc") == [b"aaaabbbb"]
+    assert alimentar(dec, b"cc") == [b"cccc"]
+    assert dec.tramas == 3
+    assert dec.finalizar() is None
+
+
+def test_cambio_de_modo_a_mitad_de_bloque():
+    # Como tras el saludo binario: los registros llegan en la misma lectura
+    dec = DecodificadorTramas()
+    tramas = []
+    libre = dec.buffer_libre()
+    datos = b"HELLO BIN1 t\nAAAABBBB"
+    libre[:len(datos)] = datos
+    for trama in dec.recibidos(len(datos)):
+        tramas.append(bytes(trama))
+        if trama == b"HELLO BIN1 t":
+            dec.cambiar_modo(MODO_FIJO, 4)
+    assert tramas == [b"HELLO BIN1 t", b"AAAABBBB"]
+    assert dec.modo == MODO_FIJO
+
+
+def test_parametros_no_validos():
+    with pytest.raises(ValueError):
+        DecodificadorTramas(tamano_buffer=16, max_trama=16)
+    with pytest.raises(ValueError):
+        DecodificadorTramas("otro")
+    with pytest.raises(ValueError):
+        DecodificadorTramas(MODO_LINEA).cambiar_modo(MODO_FIJO)
@@ -0,0 +1,185 @@
+MODO_LINEA = "linea"
+MODO_LONGITUD = "longitud"
+MODO_FIJO = "fijo"
+
+
+class DecodificadorTramas:
+    # Separa un flujo TCP en tramas completas. Los datos se reciben
+    # directamente en un buffer preasignado (recv_into / BufferedProtocol) y
+    # las tramas se entregan como memoryview sobre ese buffer, sin copias.
+    #
+    # - modo "linea": tramas terminadas en separador (por defecto b"\n")
+    # - modo "longitud": cada trama va precedida de su longitud en
+    #   bytes_longitud bytes big-endian
+    # - modo "fijo": registros de tamano_registro bytes; se entregan todos los
+    #   registros completos recibidos en una sola trama (para decodificarlos en bloque)
+    #
+    # El modo se puede cambiar a mitad de flujo con cambiar_modo() (p. ej. tras
+    # negociar el protocolo binario); las tramas siguientes ya usan el nuevo modo.
+    #
+    # Las memoryview entregadas solo son válidas hasta la siguiente llamada a
+    # buffer_libre(), que puede compactar el buffer.
+    def __init__(self, modo=MODO_LINEA, tamano_buffer=65536, max_trama=4096,
+                 separador=b"\n", bytes_longitud=2, tamano_registro=None):
+        if max_trama + bytes_longitud > tamano_buffer:
+            raise ValueError("El buffer debe ser mayor que la trama máxima")
+        self.max_trama = max_trama
+        self.separador = separador
+        self.bytes_longitud = bytes_longitud
+        self.buffer = bytearray(tamano_buffer)
+        self.vista = memoryview(self.buffer)
+        self.inicio = 0         # Primer byte aún no consumido
+        self.fin = 0            # Final de los datos recibidos
+        self._buscar_desde = 0  # Evita volver a buscar el separador en bytes ya revisados
+        self._descartar = 0     # Bytes pendientes de descartar (trama sobredimensionada)
+        self._descartando = False
+
+        # Contadores
+        self.tramas = 0
+        self.bytes_recibidos = 0
+        self.parciales = 0
+        self.sobredimensionadas = 0
+        self.compactaciones = 0
+
+        self.cambiar_modo(modo, tamano_registro)
+
+    def cambiar_modo(self, modo, tamano_registro=None):
+        if modo not in (MODO_LINEA, MODO_LONGITUD, MODO_FIJO):
+            raise ValueError(f"Modo de trama desconocido: {modo}")
+        if modo == MODO_FIJO and not 0 < (tamano_registro or 0) <= len(self.buffer) // 2:
+            raise ValueError("El modo fijo necesita un tamano_registro menor que medio buffer")
+        self.modo = modo
+        self.tamano_registro = tamano_registro
+        self._buscar_desde = self.inicio
+        self._descartando = False
+        self._descartar = 0
+
+    def pendiente(self):
+        # Bytes de una trama incompleta que esperan más datos
+        return self.fin - self.inicio
+
+    def buffer_libre(self):
+        # Devuelve la zona libre del buffer para recv_into; solo mueve la
+        # cola incompleta al principio cuando el buffer se ha llenado
+        if self.fin == len(self.buffer):
+            pendiente = self.fin - self.inicio
+            self.buffer[:pendiente] = self.vista[self.inicio:self.fin]
+            self._buscar_desde -= self.inicio
+            self.inicio = 0
+            self.fin = pendiente
+            self.compactaciones += 1
+        return self.vista[self.fin:]
+
+    def recibir_de(self, sock):
+        # Lee de un socket bloqueante directamente en el buffer;
+        # devuelve el número de bytes leídos (0 si se cerró la conexión)
+        n = sock.recv_into(self.buffer_libre())
+        return n
+
+    def recibidos(self, n):
+        # Registra n bytes escritos en buffer_libre() y entrega las tramas completas
+        self.fin += n
+        self.bytes_recibidos += n
+        modo = None
+        while modo != self.modo:
+            modo = self.modo
+            if modo == MODO_LINEA:
+                yield from self._tramas_linea()
+            elif modo == MODO_LONGITUD:
+                yield from self._tramas_longitud()
+            else:
+                yield from self._tramas_fijas()
+        if self.inicio == self.fin:
+            # Buffer vacío: vuelve al principio sin copiar nada
+            self.inicio = self.fin = self._buscar_desde = 0
+
+    def finalizar(self):
+        # Entrega los datos incompletos restantes (p. ej. al cerrar la conexión
+        # o cuando el emisor no termina sus mensajes con separador)
+        if self.inicio == self.fin or self._descartando or self._descartar:
+            return None
+        if self.modo == MODO_FIJO:
+            return None  # Un registro incompleto no se puede interpretar
+        trama = bytes(self.vista[self.inicio:self.fin])
+        self.inicio = self.fin = self._buscar_desde = 0
+        self.parciales += 1
+        self.tramas += 1
+        return trama
+
+    def estadisticas(self):
+        return {
+            "tramas": self.tramas,
+            "bytes_recibidos": self.bytes_recibidos,
+            "parciales": self.parciales,
+            "sobredimensionadas": self.sobredimensionadas,
+            "compactaciones": self.compactaciones,
+            "pendiente": self.pendiente(),
+        }
+
+    def _tramas_linea(self):
+        buffer = self.buffer
+        separador = self.separador
+        while self.modo == MODO_LINEA:
+            idx = buffer.find(separador, self._buscar_desde, self.fin)
+            if idx < 0:
+                self._buscar_desde = self.fin
+                # Trama demasiado larga sin separador: se descarta hasta el siguiente
+                if self.fin - self.inicio > self.max_trama:
+                    if not self._descartando:
+                        self.sobredimensionadas += 1
+                        self._descartando = True
+                    self.inicio = self.fin
+                return
+
+            inicio = self.inicio
+            self.inicio = self._buscar_desde = idx + len(separador)
+            if self._descartando:
+                self._descartando = False
+                continue
+            if idx - inicio > self.max_trama:
+                self.sobredimensionadas += 1
+                continue
+
+            # Quita el retorno de carro de los mensajes terminados en "\r\n"
+            if idx > inicio and buffer[idx - 1] == 0x0D:
+                idx -= 1
+            if idx > inicio:
+                self.tramas += 1
+                yield self.vista[inicio:idx]
+
+    def _tramas_longitud(self):
+        cabecera = self.bytes_longitud
+        while self.modo == MODO_LONGITUD:
+            # Descarta el resto de una trama sobredimensionada
+            if self._descartar:
+                saltar = min(self._descartar, self.fin - self.inicio)
+                self.inicio += saltar
+                self._descartar -= saltar
+                if self._descartar:
+                    return
+
+            if self.fin - self.inicio < cabecera:
+                return
+            longitud = int.from_bytes(self.vista[self.inicio:self.inicio + cabecera], "big")
+            if longitud > self.max_trama:
+                self.sobredimensionadas += 1
+                self.inicio += cabecera
+                self._descartar = longitud
+                continue
+
+            final = self.inicio + cabecera + longitud
+            if final > self.fin:
+                return
+            trama = self.vista[self.inicio + cabecera:final]
+            self.inicio = final
+            self.tramas += 1
+            yield trama
+
+    def _tramas_fijas(self):
+        tamano = self.tamano_registro
+        completos = (self.fin - self.inicio) // tamano * tamano
+        if completos:
+            trama = self.vista[self.inicio:self.inicio + completos]
+            self.inicio += completos
+            self.tramas += completos // tamano
+            yield trama